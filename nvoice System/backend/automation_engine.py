@@ -1,113 +1,1269 @@
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
+from concurrent.futures import Future
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+from requests.adapters import HTTPAdapter
+import base64
+import hashlib
 import json
+import math
 import os
+import queue
+import re
 import sys
+import tempfile
+import threading
+import time
+import requests
 
-# Force UTF-8 for console output to avoid 'charmap' errors on Windows
-if sys.platform == "win32":
-    import io
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+CDP_ENDPOINT = os.getenv('AUTOMATION_CDP_URL', 'http://127.0.0.1:9222')
+# Several secure browsers (launch_browser.py --port ...), possibly logged in with different
+# portal accounts: AUTOMATION_CDP_URLS="http://127.0.0.1:9222,http://127.0.0.1:9223"
+SESSION_ENDPOINTS = [u.strip() for u in os.getenv('AUTOMATION_CDP_URLS', CDP_ENDPOINT).split(',') if u.strip()]
+# Seconds a session stays out of rotation after its login expired / its browser was unreachable
+SESSION_LOGIN_RETRY = int(os.getenv('AUTOMATION_SESSION_LOGIN_RETRY', '300'))
+SESSION_CONNECT_RETRY = int(os.getenv('AUTOMATION_SESSION_CONNECT_RETRY', '30'))
+# Point at `manage.py mock_portal` for offline runs and benchmarks
+INQUIRY_URL = os.getenv('AUTOMATION_INQUIRY_URL', "https://gfn-spgs.efinance.com.eg/client/InvoiceInquiry/TempFreezeInvoice")
+POOL_SIZE = int(os.getenv('AUTOMATION_POOL_SIZE', '2'))
+# A worker's headless fallback browser is relaunched after this many jobs to bound leaks
+BROWSER_MAX_JOBS = int(os.getenv('AUTOMATION_BROWSER_MAX_JOBS', '200'))
+# Max wait for the portal to answer an inquiry (it often answers in a few hundred ms)
+RESULT_TIMEOUT_MS = int(os.getenv('AUTOMATION_RESULT_TIMEOUT_MS', '15000'))
 
-def run_governance(tax_number=None, invoice_uuid=None, invoice_url=None, inquiry_mode=False):
-    print(f"🚀 البدء في {'الاستعلام الخارجي' if inquiry_mode else 'الحوكمة الذكية'}...")
-    
-    with sync_playwright() as p:
+# نصوص الحالة في صفحة الاستعلام، بالترتيب
+STATUS_MARKERS = [
+    ("accepted", ["مقبولة", "Accepted"]),
+    ("rejected", ["مرفوضة", "Rejected"]),
+    ("not_found", ["لم يتم العثور"]),
+]
+STATUS_PATTERN = re.compile("|".join(m for _, markers in STATUS_MARKERS for m in markers))
+
+# "browser": fill the form in a tab. "http": replay the form with the browser session's
+# cookies over pooled HTTP, falling back to the browser when the session is rejected
+ENGINE_MODE = os.getenv('AUTOMATION_ENGINE_MODE', 'browser')
+HTTP_POOL_SIZE = int(os.getenv('AUTOMATION_HTTP_POOL_SIZE', '20'))
+
+# Automation tabs only fetch these resource types from the portal hosts (and their
+# subdomains); images, fonts, stylesheets and third-party requests are aborted
+BLOCK_ASSETS = os.getenv('AUTOMATION_BLOCK_ASSETS', 'True') == 'True'
+ALLOWED_HOSTS = [h.strip() for h in os.getenv('AUTOMATION_ALLOWED_HOSTS', 'efinance.com.eg,eta.gov.eg').split(',') if h.strip()]
+# The portal pages wire their buttons with JS, so scripts stay on the allow-list
+ALLOWED_RESOURCE_TYPES = {t.strip() for t in os.getenv('AUTOMATION_ALLOWED_RESOURCES', 'document,xhr,fetch,script').split(',') if t.strip()}
+
+# Traffic budget per portal host, shared by every process on this machine (gunicorn
+# workers, job runners, the dispatcher) through small files in GOVERNOR_DIR:
+# requests per second (token bucket) and max tabs/HTTP calls working at once.
+# Per-host overrides: AUTOMATION_HOST_LIMITS="gfn-spgs.efinance.com.eg=2/4,invoicing.eta.gov.eg=5/8"
+PORTAL_RPS = float(os.getenv('AUTOMATION_PORTAL_RPS', '2'))
+PORTAL_MAX_PAGES = int(os.getenv('AUTOMATION_PORTAL_MAX_PAGES', '4'))
+HOST_LIMITS = {}
+for item in os.getenv('AUTOMATION_HOST_LIMITS', '').split(','):
+    host, _, limits = item.partition('=')
+    if host.strip() and limits:
+        rps, _, pages = limits.partition('/')
+        HOST_LIMITS[host.strip()] = (float(rps), int(pages or PORTAL_MAX_PAGES))
+# Seconds a job may queue for budget before it is turned away as busy
+GOVERNOR_WAIT = float(os.getenv('AUTOMATION_GOVERNOR_WAIT', '10'))
+GOVERNOR_DIR = os.getenv('AUTOMATION_GOVERNOR_DIR', os.path.join(tempfile.gettempdir(), 'zahran_governor'))
+# A page slot still held after this many seconds belonged to a process that died
+GOVERNOR_SLOT_STALE = int(os.getenv('AUTOMATION_GOVERNOR_SLOT_STALE', '300'))
+
+# Selectors come from config/automation_mapping.json (written by save_mapping.py) and are
+# re-read whenever the file changes; per-selector hit counts are kept next to it
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config')
+MAPPING_FILE = os.getenv('AUTOMATION_MAPPING_FILE', os.path.join(CONFIG_DIR, 'automation_mapping.json'))
+SELECTOR_STATS_FILE = os.getenv('AUTOMATION_SELECTOR_STATS_FILE', os.path.join(CONFIG_DIR, 'selector_stats.json'))
+DEFAULT_SELECTORS = {
+    "tax_registration_number": "#RIN",
+    "invoice_id": "#invoiceId",
+    "btn_inquire": "#btnInquire",
+    "rin_extraction": ["#TaxRegistrationNumber", ".tax-id", "td:has-text('رقم التسجيل') + td"],
+}
+# Encrypted snapshot (cookies + local storage) of each logged-in secure browser, used to
+# start headless contexts already authenticated. Needs its own AUTOMATION_STATE_KEY: the
+# SECRET_KEY fallback is committed to the repo, so it would leave the portal cookies readable
+STATE_DIR = os.getenv('AUTOMATION_STATE_DIR', CONFIG_DIR)
+STATE_KEY = os.getenv('AUTOMATION_STATE_KEY')
+if STATE_KEY and STATE_KEY.startswith('django-insecure-'):
+    STATE_KEY = None
+# Seconds before the attached worker takes a fresh snapshot
+STATE_MAX_AGE = int(os.getenv('AUTOMATION_STATE_MAX_AGE', '900'))
+# Extra workers of a session run in headless contexts seeded from the snapshot instead of
+# as tabs of the interactive browser; the session's first worker stays attached to refresh it
+PREFER_HEADLESS = os.getenv('AUTOMATION_PREFER_HEADLESS', 'False') == 'True'
+
+# One wait for whichever RIN selector shows up first (was up to 2 s per selector, in sequence)
+RIN_EXTRACTION_TIMEOUT_MS = 4000
+
+
+def log(message):
+    # Human-readable progress goes to stderr; stdout is reserved for the event stream
+    # The engine now also runs inside the server process, whose console may not be UTF-8
+    try:
+        print(message, file=sys.stderr)
+    except UnicodeEncodeError:
+        print(message.encode('ascii', 'replace').decode('ascii'), file=sys.stderr)
+
+
+# Result protocol: newline-delimited JSON events, one object per line.
+#   {"v": 1, "type": "step", "step": "navigate"}               a step started
+#   {"v": 1, "type": "timing", "step": "navigate", "ms": 812}  a step finished
+#   {"v": 1, "type": "result", "result": {...}}                final result, always last
+# In-process callers subscribe with event_sink(); the CLI writes the events to stdout.
+PROTOCOL_VERSION = 1
+
+_events = threading.local()
+
+
+@contextmanager
+def event_sink(callback):
+    # Events are emitted on the thread running the job, so the sink is thread-local
+    previous = getattr(_events, "sink", None)
+    _events.sink = callback
+    try:
+        yield
+    finally:
+        _events.sink = previous
+
+
+def emit(event_type, **data):
+    event = {"v": PROTOCOL_VERSION, "type": event_type, **data}
+    sink = getattr(_events, "sink", None)
+    if sink is not None:
         try:
-            # Try connecting to existing browser (created by launch_browser.py)
-            connected_to_existing = False
+            sink(event)
+        except Exception as e:
+            # A broken progress consumer must not fail the governance itself
+            log(f"⚠️ event sink failed: {e}")
+    return event
+
+
+class PortalBusy(Exception):
+    def __init__(self, host, retry_after):
+        super().__init__(f"portal budget exhausted for {host}")
+        self.host = host
+        self.retry_after = retry_after
+
+
+def create_exclusive(path, stale_after):
+    # O_EXCL creation is atomic across processes; a file older than stale_after is taken over
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.path.getmtime(path) <= stale_after:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return False
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class HostBudget:
+    # The bucket is kept as its next free send time (GCRA), so a take is one read and one
+    # write under a short file mutex; page slots are one file each
+    def __init__(self, host, rps, max_pages):
+        self.host = host
+        self.rps = rps
+        self.capacity = max(1.0, rps)
+        self.max_pages = max(1, max_pages)
+        self.lock = threading.Lock()
+        self.dir = os.path.join(GOVERNOR_DIR, re.sub(r'[^A-Za-z0-9.-]', '_', host) or '_')
+        os.makedirs(self.dir, exist_ok=True)
+        self.bucket = os.path.join(self.dir, 'bucket')
+        self.mutex = os.path.join(self.dir, 'bucket.lock')
+
+    @contextmanager
+    def locked(self):
+        # Threads of this process queue on self.lock rather than spinning on the file
+        with self.lock:
+            while not create_exclusive(self.mutex, 1):
+                time.sleep(0.005)
             try:
-                browser = p.chromium.connect_over_cdp("http://127.0.0.1:9222")
-                context = browser.contexts[0]
-                page = context.new_page()
-                connected_to_existing = True
-                print("✅ Connected to existing Secure Browser session.")
-            except Exception as e:
-                print(f"⚠️ Could not connect to existing browser: {e}. Launching new headless instance.")
-                browser = p.chromium.launch(headless=True)
-                context = browser.new_context()
-                page = context.new_page()
-            
-            # استخراج البيانات لو مش موجودة
-            if invoice_url and (not tax_number or not invoice_uuid):
-                print(f"🔗 فتح الرابط لاستخراج البيانات...")
-                page.goto(invoice_url)
-                page.wait_for_load_state("networkidle")
-                
-                if not invoice_uuid:
-                    import re
-                    match = re.search(r'([A-Z0-9-]{36})', invoice_url)
-                    if match: invoice_uuid = match.group(0)
-
-                if not tax_number:
-                    selectors = ["#TaxRegistrationNumber", ".tax-id", "td:has-text('رقم التسجيل') + td"]
-                    for selector in selectors:
-                        try:
-                            el = page.wait_for_selector(selector, timeout=2000)
-                            tax_number = el.inner_text().strip()
-                            if tax_number: break
-                        except: continue
-                
-            if not tax_number or not invoice_uuid:
-                return {"status": "error", "message": "فشل استخراج البيانات"}
-
-            # التوجه لصفحة الاستعلام
-            target_url = "https://gfn-spgs.efinance.com.eg/client/InvoiceInquiry/TempFreezeInvoice"
-            page.goto(target_url)
+                yield
+            finally:
+                remove_file(self.mutex)
+
+    def take(self, wait):
+        if self.rps <= 0:
+            return
+        interval = 1 / self.rps
+        deadline = time.time() + wait
+        while True:
+            with self.locked():
+                now = time.time()
+                try:
+                    with open(self.bucket) as f:
+                        next_free = max(float(f.read() or 0), now)
+                except (OSError, ValueError):
+                    next_free = now
+                needed = next_free - now - (self.capacity - 1) * interval
+                if needed <= 0:
+                    with open(self.bucket, 'w') as f:
+                        f.write(repr(next_free + interval))
+                    return
+            if now + needed > deadline:
+                raise PortalBusy(self.host, math.ceil(needed))
+            time.sleep(needed)
+
+    def acquire_page(self, wait):
+        deadline = time.time() + wait
+        while True:
+            for i in range(self.max_pages):
+                path = os.path.join(self.dir, f"page-{i}")
+                if create_exclusive(path, GOVERNOR_SLOT_STALE):
+                    return path
+            if time.time() >= deadline:
+                return None
+            time.sleep(0.05)
+
+
+class PortalGovernor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.budgets = {}
+
+    def budget(self, url):
+        host = urlparse(url).hostname or ""
+        with self.lock:
+            if host not in self.budgets:
+                rps, max_pages = HOST_LIMITS.get(host, (PORTAL_RPS, PORTAL_MAX_PAGES))
+                if host == urlparse(INQUIRY_URL).hostname:
+                    # The inquiry budget is per portal account, so it grows with the sessions
+                    rps, max_pages = rps * len(SESSION_ENDPOINTS), max_pages * len(SESSION_ENDPOINTS)
+                self.budgets[host] = HostBudget(host, rps, max_pages)
+            return self.budgets[host]
+
+    def throttle(self, url, wait=GOVERNOR_WAIT):
+        # Blocks until the host's token bucket allows one more request
+        self.budget(url).take(wait)
+
+    @contextmanager
+    def slot(self, url, wait=GOVERNOR_WAIT):
+        # Holds one of the host's concurrent page slots for the duration of the block
+        budget = self.budget(url)
+        page = budget.acquire_page(wait)
+        if page is None:
+            raise PortalBusy(budget.host, max(1, math.ceil(wait)))
+        try:
+            yield
+        finally:
+            remove_file(page)
+
+
+governor = PortalGovernor()
+
+
+class NetworkStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.allowed_requests = 0
+        self.blocked_requests = 0
+        self.bytes_loaded = 0
+        self.blocked_by_type = {}
+        self.bytes_by_type = {}
+
+    def record_allowed(self):
+        with self.lock:
+            self.allowed_requests += 1
+
+    def record_blocked(self, resource_type):
+        with self.lock:
+            self.blocked_requests += 1
+            self.blocked_by_type[resource_type] = self.blocked_by_type.get(resource_type, 0) + 1
+
+    def record_response(self, resource_type, size):
+        with self.lock:
+            self.bytes_loaded += size
+            self.bytes_by_type[resource_type] = self.bytes_by_type.get(resource_type, 0) + size
+
+    def merge(self, other):
+        with self.lock:
+            self.allowed_requests += other.allowed_requests
+            self.blocked_requests += other.blocked_requests
+            self.bytes_loaded += other.bytes_loaded
+            for k, v in other.blocked_by_type.items():
+                self.blocked_by_type[k] = self.blocked_by_type.get(k, 0) + v
+            for k, v in other.bytes_by_type.items():
+                self.bytes_by_type[k] = self.bytes_by_type.get(k, 0) + v
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "allowed_requests": self.allowed_requests,
+                "blocked_requests": self.blocked_requests,
+                "blocked_by_type": dict(self.blocked_by_type),
+                "bytes_loaded": self.bytes_loaded,
+                "bytes_by_type": dict(self.bytes_by_type),
+            }
+
+
+# Totals since the process started; compare runs with AUTOMATION_BLOCK_ASSETS on/off
+# to see the bytes each blocked resource type used to cost
+network_stats = NetworkStats()
+
+
+def host_allowed(host):
+    return any(host == h or host.endswith("." + h) for h in ALLOWED_HOSTS)
+
+
+def install_request_filter(page, stats):
+    def handle(route):
+        request = route.request
+        host = urlparse(request.url).hostname or ""
+        if request.resource_type in ALLOWED_RESOURCE_TYPES and host_allowed(host):
+            stats.record_allowed()
+            route.continue_()
+        else:
+            stats.record_blocked(request.resource_type)
+            route.abort()
+
+    def on_response(response):
+        try:
+            size = int(response.headers.get("content-length", 0))
+        except ValueError:
+            size = 0
+        stats.record_response(response.request.resource_type, size)
+
+    if BLOCK_ASSETS:
+        page.route("**/*", handle)
+    page.on("response", on_response)
+
+
+class StateStore:
+    def __init__(self, path, key=STATE_KEY):
+        self.path = path
+        self.lock = threading.Lock()
+        self.cached = None
+        self.cached_mtime = None
+        self.fernet = None
+        if not key:
+            log("⚠️ AUTOMATION_STATE_KEY is not set (or is Django's insecure default), portal session snapshots are disabled.")
+            return
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            log("⚠️ cryptography is not installed, portal session snapshots are disabled.")
+            return
+        # Any secret string works; Fernet needs 32 url-safe base64 bytes
+        self.fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(key.encode('utf-8')).digest()))
+
+    @property
+    def enabled(self):
+        return self.fernet is not None
+
+    def saved_at(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def load(self):
+        # Returns the Playwright storage_state dict, or None
+        if not self.enabled:
+            return None
+        mtime = self.saved_at()
+        if mtime is None:
+            return None
+        with self.lock:
+            if mtime != self.cached_mtime:
+                try:
+                    with open(self.path, 'rb') as f:
+                        self.cached = json.loads(self.fernet.decrypt(f.read()))
+                except Exception as e:
+                    # Wrong key or corrupt file: behave as if there were no snapshot
+                    log(f"⚠️ Could not read portal session snapshot {self.path}: {type(e).__name__} {e}")
+                    self.cached = None
+                self.cached_mtime = mtime
+            return self.cached
+
+    def is_stale(self):
+        saved_at = self.saved_at()
+        return saved_at is None or time.time() - saved_at > STATE_MAX_AGE
+
+    def save(self, state):
+        if not self.enabled:
+            return
+        token = self.fernet.encrypt(json.dumps(state).encode('utf-8'))
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", 'wb') as f:
+                f.write(token)
+            os.replace(self.path + ".tmp", self.path)
+
+    def refresh(self, context):
+        # Only called from a context that just completed a logged-in job
+        if not self.enabled or not self.is_stale():
+            return
+        try:
+            self.save(context.storage_state())
+            log(f"🔐 Portal session snapshot refreshed ({self.path})")
+        except Exception as e:
+            log(f"⚠️ Could not snapshot the portal session: {e}")
+
+    def invalidate(self):
+        with self.lock:
+            try:
+                os.remove(self.path)
+                log(f"🔒 Portal session snapshot expired, removed {self.path}")
+            except OSError:
+                pass
+            self.cached = self.cached_mtime = None
+
+
+def attach_browser(p, endpoint=CDP_ENDPOINT, storage_state=None):
+    # Try connecting to existing browser (created by launch_browser.py)
+    try:
+        browser = p.chromium.connect_over_cdp(endpoint)
+        log(f"✅ Connected to existing Secure Browser session ({endpoint}).")
+        return browser, browser.contexts[0], True
+    except Exception as e:
+        log(f"⚠️ Could not connect to existing browser: {e}. Launching new headless instance.")
+        browser = p.chromium.launch(headless=True)
+        return browser, browser.new_context(storage_state=storage_state), False
+
+
+class SelectorMapping:
+    def __init__(self, path=MAPPING_FILE):
+        self.path = path
+        self.mtime = None
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def reload(self):
+        # Cheap stat() per lookup; the JSON is only parsed again when the file changed
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            data = {}
+            if mtime is not None:
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                    log(f"🗺️ Selector mapping loaded from {self.path}")
+                except (OSError, ValueError) as e:
+                    # Keep the last good mapping while the file is half-written or broken
+                    log(f"⚠️ Could not read selector mapping {self.path}: {e}")
+                    return
+            self.data, self.mtime = data, mtime
+
+    def selector(self, name):
+        self.reload()
+        return self.data.get("selectors", {}).get(name) or DEFAULT_SELECTORS[name]
+
+    def candidates(self, name):
+        value = self.selector(name)
+        return [value] if isinstance(value, str) else list(value)
+
+    def timeout_ms(self, name, default):
+        self.reload()
+        return int(self.data.get("timeouts_ms", {}).get(name, default))
+
+
+class SelectorStats:
+    def __init__(self, path=SELECTOR_STATS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.dirty = 0
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.stats = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def entry(self, name, selector):
+        return self.stats.setdefault(name, {}).setdefault(selector, {"hits": 0, "misses": 0, "total_ms": 0})
+
+    def score(self, name, selector):
+        # Laplace-smoothed hit rate, so a new selector gets a fair first try
+        e = self.stats.get(name, {}).get(selector, {"hits": 0, "misses": 0})
+        return (e["hits"] + 1) / (e["hits"] + e["misses"] + 2)
+
+    def rank(self, name, candidates):
+        with self.lock:
+            return sorted(candidates, key=lambda c: -self.score(name, c))
+
+    def record(self, name, hit, missed, ms):
+        with self.lock:
+            if hit is not None:
+                e = self.entry(name, hit)
+                e["hits"] += 1
+                e["total_ms"] += ms
+            for selector in missed:
+                self.entry(name, selector)["misses"] += 1
+            self.dirty += 1
+            if self.dirty >= 20:
+                self.save_locked()
+
+    def save_locked(self):
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(self.stats, f, indent=2, ensure_ascii=False)
+            os.replace(self.path + ".tmp", self.path)
+            self.dirty = 0
+        except OSError as e:
+            log(f"⚠️ Could not save selector stats: {e}")
+
+    def save(self):
+        with self.lock:
+            if self.dirty:
+                self.save_locked()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {
+                    selector: {
+                        "hits": e["hits"],
+                        "misses": e["misses"],
+                        "hit_rate": round(e["hits"] / (e["hits"] + e["misses"]), 3) if e["hits"] + e["misses"] else None,
+                        "avg_ms": round(e["total_ms"] / e["hits"]) if e["hits"] else None,
+                    }
+                    for selector, e in selectors.items()
+                }
+                for name, selectors in self.stats.items()
+            }
+
+
+selector_mapping = SelectorMapping()
+selector_stats = SelectorStats()
+
+
+def extract_text(page, name):
+    # Races every candidate selector in one wait, then takes the best-ranked one that matched
+    candidates = selector_stats.rank(name, selector_mapping.candidates(name))
+    timeout_ms = selector_mapping.timeout_ms(name, RIN_EXTRACTION_TIMEOUT_MS)
+    started = time.perf_counter()
+
+    combined = page.locator(candidates[0])
+    for selector in candidates[1:]:
+        combined = combined.or_(page.locator(selector))
+    try:
+        combined.first.wait_for(state="visible", timeout=timeout_ms)
+    except PlaywrightTimeout:
+        selector_stats.record(name, None, candidates, 0)
+        return None
+
+    ms = round((time.perf_counter() - started) * 1000)
+    missed = []
+    for selector in candidates:
+        locator = page.locator(selector).first
+        try:
+            text = locator.inner_text(timeout=500).strip() if locator.count() else ""
+        except PlaywrightTimeout:
+            text = ""
+        if text:
+            selector_stats.record(name, selector, missed, ms)
+            return text
+        missed.append(selector)
+    selector_stats.record(name, None, missed, ms)
+    return None
+
+
+def classify_status(text):
+    for status, markers in STATUS_MARKERS:
+        if any(m in text for m in markers):
+            return status
+    return None
+
+
+def is_inquiry_response(response):
+    # The inquiry answer comes back from the portal host as XHR/fetch or as a form POST
+    request = response.request
+    if urlparse(response.url).netloc != urlparse(INQUIRY_URL).netloc:
+        return False
+    return request.resource_type in ("xhr", "fetch") or request.method == "POST"
+
+
+def wait_for_result(page, timeout_ms=RESULT_TIMEOUT_MS):
+    # Returns (external_status, detected_by) as soon as the portal answers
+    deadline = time.perf_counter() + timeout_ms / 1000
+    try:
+        with page.expect_response(is_inquiry_response, timeout=timeout_ms) as response_info:
+            page.click(selector_mapping.selector("btn_inquire"))
+        try:
+            status = classify_status(response_info.value.text())
+        except Exception:
+            # Body not readable (redirect / navigation); the rendered page decides
+            status = None
+        if status:
+            return status, "response"
+    except PlaywrightTimeout:
+        pass
+
+    # The answer may be rendered client-side; wait for a visible status text
+    # (a timeout of 0 means "wait forever" in Playwright, so keep at least 1 ms)
+    remaining_ms = max(1, (deadline - time.perf_counter()) * 1000)
+    try:
+        locator = page.get_by_text(STATUS_PATTERN).first
+        locator.wait_for(state="visible", timeout=remaining_ms)
+        return classify_status(locator.inner_text()) or "غير معروف", "dom"
+    except PlaywrightTimeout:
+        return "غير معروف", "timeout"
+
+
+class SessionExpired(Exception):
+    pass
+
+
+class FormParser(HTMLParser):
+    # Collects <form> actions and <input> attributes of the inquiry page
+    def __init__(self):
+        super().__init__()
+        self.forms = []
+        self.inputs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "form":
+            self.forms.append(dict(attrs))
+        elif tag == "input":
+            self.inputs.append(dict(attrs))
+
+    def find_input(self, key):
+        for attrs in self.inputs:
+            if attrs.get("id") == key or attrs.get("name") == key:
+                return attrs
+        return None
+
+
+class PortalHttpClient:
+    def __init__(self, cookies, user_agent=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if user_agent:
+            self.session.headers["User-Agent"] = user_agent
+        for c in cookies:
+            self.session.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path", "/"))
+        self.lock = threading.Lock()
+        self.load_form()
+
+    def check_logged_in(self, response):
+        if response.status_code in (401, 403) or "login" in response.url.lower():
+            raise SessionExpired(f"portal session rejected ({response.status_code} {response.url})")
+
+    def load_form(self):
+        governor.throttle(INQUIRY_URL)
+        response = self.session.get(INQUIRY_URL, timeout=RESULT_TIMEOUT_MS / 1000)
+        self.check_logged_in(response)
+        parser = FormParser()
+        parser.feed(response.text)
+
+        rin_input = parser.find_input(selector_mapping.selector("tax_registration_number").lstrip("#"))
+        uuid_input = parser.find_input(selector_mapping.selector("invoice_id").lstrip("#"))
+        if rin_input is None or uuid_input is None:
+            raise SessionExpired("inquiry form not found, the portal probably shows the login page")
+        token_input = parser.find_input("__RequestVerificationToken") or {}
+
+        with self.lock:
+            self.rin_field = rin_input.get("name") or "RIN"
+            self.uuid_field = uuid_input.get("name") or "invoiceId"
+            self.token = token_input.get("value")
+            action = next((f.get("action") for f in parser.forms if f.get("action")), None)
+            self.action_url = urljoin(response.url, action) if action else response.url
+
+    def inquire(self, tax_number, invoice_uuid, retry=True):
+        started = time.perf_counter()
+        data = {self.rin_field: tax_number, self.uuid_field: invoice_uuid}
+        headers = {"X-Requested-With": "XMLHttpRequest", "Referer": INQUIRY_URL}
+        if self.token:
+            data["__RequestVerificationToken"] = self.token
+            headers["RequestVerificationToken"] = self.token
+
+        with governor.slot(INQUIRY_URL):
+            governor.throttle(INQUIRY_URL)
+            response = self.session.post(self.action_url, data=data, headers=headers, timeout=RESULT_TIMEOUT_MS / 1000)
+        self.check_logged_in(response)
+        if response.status_code == 400 and retry:
+            # Anti-forgery token rotated; read the form again once
+            self.load_form()
+            return self.inquire(tax_number, invoice_uuid, retry=False)
+        response.raise_for_status()
+
+        return {
+            "status": "success",
+            "external_status": classify_status(response.text) or "غير معروف",
+            "rin": tax_number,
+            "uuid": invoice_uuid,
+            "detected_by": "http",
+            "timings": {"inquiry_ms": round((time.perf_counter() - started) * 1000)}
+        }
+
+
+# One HTTP client per portal session, built from that session's browser cookies
+_http_clients = {}
+# Guards the dict only and is never held over network I/O; building a client (cookies over
+# CDP, then a GET of the form) holds that session's own latch, so a slow portal answer only
+# delays tabs of the same session
+_http_lock = threading.Lock()
+_http_loading = {}
+_http_turn = 0
+
+
+def drop_http_client(session):
+    with _http_lock:
+        _http_clients.pop(session, None)
+
+
+def load_http_client(session, page):
+    with _http_lock:
+        latch = _http_loading.setdefault(session, threading.Lock())
+    with latch:
+        with _http_lock:
+            client = _http_clients.get(session)
+        if client is not None:
+            # Another tab of this session built it while we waited
+            return client
+        try:
+            client = PortalHttpClient(page.context.cookies(), page.evaluate("navigator.userAgent"))
+        except (SessionExpired, requests.RequestException) as e:
+            log(f"⚠️ HTTP inquiry mode unavailable: {e}")
+            return None
+        with _http_lock:
+            _http_clients[session] = client
+        log(f"⚡ HTTP inquiry session loaded from the secure browser ({session}).")
+        return client
+
+
+def http_inquiry(tax_number, invoice_uuid, page=None, session=None):
+    # Returns None when the HTTP path can't answer, so the caller uses the browser
+    global _http_turn
+    session = session or SESSION_ENDPOINTS[0]
+    if page is not None:
+        with _http_lock:
+            client = _http_clients.get(session)
+        if client is None:
+            client = load_http_client(session, page)
+            if client is None:
+                return None
+    else:
+        with _http_lock:
+            if not _http_clients:
+                return None
+            # Called without a tab (straight from the API): rotate over the loaded sessions
+            _http_turn += 1
+            session, client = list(_http_clients.items())[_http_turn % len(_http_clients)]
+
+    try:
+        return client.inquire(tax_number, invoice_uuid)
+    except (SessionExpired, requests.RequestException) as e:
+        log(f"⚠️ HTTP inquiry failed ({e}), falling back to the browser.")
+        with _http_lock:
+            if _http_clients.get(session) is client:
+                del _http_clients[session]
+        return None
+
+
+def process_invoice(page, tax_number=None, invoice_uuid=None, invoice_url=None, inquiry_mode=False, session=None):
+    timings = {}
+    started = step = time.perf_counter()
+
+    def lap(name):
+        nonlocal step
+        now = time.perf_counter()
+        timings[f"{name}_ms"] = round((now - step) * 1000)
+        emit("timing", step=name, ms=timings[f"{name}_ms"])
+        step = now
+
+    # استخراج البيانات لو مش موجودة
+    if invoice_url and (not tax_number or not invoice_uuid):
+        emit("step", step="extract")
+        with governor.slot(invoice_url):
+            governor.throttle(invoice_url)
+            log(f"🔗 فتح الرابط لاستخراج البيانات...")
+            page.goto(invoice_url)
             page.wait_for_load_state("networkidle")
 
-            page.fill("#RIN", tax_number)
-            page.fill("#invoiceId", invoice_uuid)
-            page.click("#btnInquire")
-            
-            page.wait_for_timeout(3000) 
-            
-            # قراءة النتيجة من الشاشة
-            # ملاحظة: السيلكتورات دي تخيلية بناءً على المتوقع من السيستم
-            external_status = "غير معروف"
+            if not invoice_uuid:
+                match = re.search(r'([A-Z0-9-]{36})', invoice_url)
+                if match: invoice_uuid = match.group(0)
+
+            if not tax_number:
+                tax_number = extract_text(page, "rin_extraction")
+        lap("extract")
+
+    if not tax_number or not invoice_uuid:
+        return {"status": "error", "message": "فشل استخراج البيانات"}
+
+    if ENGINE_MODE == "http":
+        emit("step", step="http_inquiry")
+        result = http_inquiry(tax_number, invoice_uuid, page, session)
+        if result is not None:
+            emit("timing", step="http_inquiry", ms=result["timings"]["inquiry_ms"])
+            timings.update(result["timings"])
+            timings["total_ms"] = round((time.perf_counter() - started) * 1000)
+            result["timings"] = timings
+            log(f"✅ النتيجة الخارجية: {result['external_status']}")
+            return result
+
+    with governor.slot(INQUIRY_URL):
+        # التوجه لصفحة الاستعلام
+        emit("step", step="navigate")
+        governor.throttle(INQUIRY_URL)
+        page.goto(INQUIRY_URL)
+        page.wait_for_load_state("networkidle")
+        if "login" in page.url.lower():
+            raise SessionExpired(f"portal redirected to the login page ({page.url})")
+        lap("navigate")
+
+        page.fill(selector_mapping.selector("tax_registration_number"), tax_number)
+        page.fill(selector_mapping.selector("invoice_id"), invoice_uuid)
+
+        # انتظار رد المنظومة الفعلي بدل مهلة ثابتة
+        emit("step", step="inquiry")
+        governor.throttle(INQUIRY_URL)
+        external_status, detected_by = wait_for_result(page)
+        lap("inquiry")
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000)
+
+    if detected_by == "timeout":
+        # No answer is not an answer: never freeze or cache it
+        log("⏱️ المنظومة لم ترد على الاستعلام في الوقت المحدد")
+        return {
+            "status": "error",
+            "error_type": "timeout",
+            "message": "لم ترد المنظومة الخارجية على الاستعلام في الوقت المحدد",
+            "rin": tax_number,
+            "uuid": invoice_uuid,
+            "timings": timings
+        }
+
+    log(f"✅ النتيجة الخارجية: {external_status}")
+
+    return {
+        "status": "success",
+        "external_status": external_status,
+        "rin": tax_number,
+        "uuid": invoice_uuid,
+        "detected_by": detected_by,
+        "timings": timings
+    }
+
+
+def busy_result(e):
+    log(f"⏳ {e}, retry after {e.retry_after}s")
+    return {"status": "error", "error_type": "busy", "message": str(e), "retry_after": e.retry_after}
+
+
+def error_result(e):
+    # error_type lets the API's circuit breaker tell a dead portal from a bad invoice
+    message = str(e)
+    if isinstance(e, (PlaywrightTimeout, requests.Timeout)):
+        error_type = "timeout"
+    elif isinstance(e, SessionExpired):
+        error_type = "login"
+    elif isinstance(e, requests.ConnectionError) or "net::ERR_" in message or "ECONNREFUSED" in message:
+        error_type = "connect"
+    else:
+        error_type = "error"
+    return {"status": "error", "error_type": error_type, "message": message}
+
+
+def run_governance(tax_number=None, invoice_uuid=None, invoice_url=None, inquiry_mode=False, context=None, on_event=None, session=None):
+    if on_event is not None:
+        with event_sink(on_event):
+            return run_governance(tax_number, invoice_uuid, invoice_url, inquiry_mode, context, session=session)
+
+    log(f"🚀 البدء في {'الاستعلام الخارجي' if inquiry_mode else 'الحوكمة الذكية'}...")
+
+    # Worker path: the browser context is already open, only a tab is opened per job
+    if context is not None:
+        page = context.new_page()
+        stats = NetworkStats()
+        install_request_filter(page, stats)
+        try:
+            result = process_invoice(page, tax_number, invoice_uuid, invoice_url, inquiry_mode, session)
+        except PortalBusy as e:
+            result = busy_result(e)
+        except Exception as e:
+            result = error_result(e)
+        finally:
+            # Close the tab to avoid clutter in the secure session
+            try: page.close()
+            except Exception: pass
+        network_stats.merge(stats)
+        result["network"] = stats.snapshot()
+        emit("result", result=result)
+        return result
+
+    with sync_playwright() as p:
+        try:
+            browser, context, _ = attach_browser(p)
             try:
-                # بنحاول ندور على نصوص تدل على الحالة
-                content = page.content()
-                if "مقبولة" in content or "Accepted" in content:
-                    external_status = "accepted"
-                elif "مرفوضة" in content or "Rejected" in content:
-                    external_status = "rejected"
-                elif "لم يتم العثور" in content:
-                    external_status = "not_found"
-            except: pass
-
-            print(f"✅ النتيجة الخارجية: {external_status}")
-            
-            # Cleanup for existing session to avoid tab clutter
-            if connected_to_existing:
-                page.close()
-                browser.disconnect()
-            else:
+                return run_governance(tax_number, invoice_uuid, invoice_url, inquiry_mode, context=context)
+            finally:
+                # For a CDP session this only disconnects, the secure browser stays open
                 browser.close()
+        except Exception as e:
+            result = error_result(e)
+            emit("result", result=result)
+            return result
+
+
+class PortalSession:
+    # One secure browser (CDP endpoint) with its own job queue and workers
+    def __init__(self, index, endpoint):
+        self.name = f"session-{index + 1}"
+        self.endpoint = endpoint
+        self.jobs = queue.Queue()
+        self.workers = []
+        self.in_flight = 0
+        self.jobs_done = 0
+        self.state = "healthy"
+        self.retry_at = 0
+        self.last_error = None
+        self.storage = StateStore(os.path.join(STATE_DIR, f"portal_state_{self.name}.bin"))
+
+    def available(self, now):
+        return self.state == "healthy" or now >= self.retry_at
+
+    def load(self):
+        return self.in_flight / max(1, len(self.workers))
+
+    def record(self, result):
+        # Called with the pool lock held
+        self.in_flight -= 1
+        if result is None:
+            # Cancelled before a worker picked it up
+            return
+        self.jobs_done += 1
+        error_type = result.get("error_type")
+        if error_type == "login":
+            if self.state != "expired":
+                log(f"🔒 {self.name} ({self.endpoint}): portal login expired, out of rotation")
+            self.state, self.retry_at = "expired", time.time() + SESSION_LOGIN_RETRY
+            self.last_error = result.get("message")
+            drop_http_client(self.endpoint)
+        elif error_type == "connect":
+            self.state, self.retry_at = "down", time.time() + SESSION_CONNECT_RETRY
+            self.last_error = result.get("message")
+        elif result.get("status") == "success" or error_type not in ("timeout", "busy"):
+            if self.state != "healthy":
+                log(f"✅ {self.name} ({self.endpoint}): back in rotation")
+            self.state, self.retry_at = "healthy", 0
+
+    def apply_probe(self, probe):
+        # Heartbeat results take sessions in and out of rotation before a job has to fail
+        if not probe["alive"]:
+            self.state, self.retry_at = "down", time.time() + SESSION_CONNECT_RETRY
+            self.last_error = probe["error"]
+        elif probe["logged_in"] is False:
+            if self.state != "expired":
+                log(f"🔒 {self.name} ({self.endpoint}): heartbeat found the portal login expired")
+            self.state, self.retry_at = "expired", time.time() + SESSION_LOGIN_RETRY
+            self.last_error = probe["error"]
+            drop_http_client(self.endpoint)
+        elif probe["logged_in"] or self.state == "down":
+            self.state, self.retry_at = "healthy", 0
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "endpoint": self.endpoint,
+            "state": self.state,
+            "retry_in": max(0, round(self.retry_at - time.time())) if self.state != "healthy" else 0,
+            "in_flight": self.in_flight,
+            "queued": self.jobs.qsize(),
+            "jobs_done": self.jobs_done,
+            "last_error": self.last_error,
+            "snapshot_age": round(time.time() - self.storage.saved_at()) if self.storage.saved_at() else None,
+            "workers": [w.snapshot() for w in self.workers],
+        }
+
+
+# Playwright's sync API is bound to the thread that started it, so each worker
+# keeps its own driver and browser connection open and pulls jobs from its session's queue.
+class AutomationWorker(threading.Thread):
+    def __init__(self, session, name, index=0):
+        super().__init__(name=name, daemon=True)
+        self.session = session
+        self.jobs = session.jobs
+        self.index = index
+        # mtime of the session snapshot this worker's headless context was built from
+        self.state_loaded = None
+        self.playwright = None
+        self.browser = None
+        self.context = None
+        self.attached = False
+        # Jobs run on the current browser, and headless launches over the worker's life
+        self.browser_jobs = 0
+        self.launches = 0
+        self.jobs_done = 0
+
+    def headless_by_choice(self):
+        return PREFER_HEADLESS and self.index > 0 and self.session.storage.load() is not None
+
+    def ensure_browser(self):
+        if self.browser is not None and not self.attached and self.browser_jobs >= BROWSER_MAX_JOBS:
+            log(f"♻️ {self.name}: recycling headless browser after {self.browser_jobs} jobs")
+            self.close_browser()
+        if self.browser is not None and not self.attached and self.session.storage.saved_at() != self.state_loaded:
+            # A newer (or removed) snapshot: rebuild the headless context from it, keep the browser
+            try:
+                self.context.close()
+                self.context = self.browser.new_context(storage_state=self.session.storage.load())
+                self.state_loaded = self.session.storage.saved_at()
+            except Exception:
+                self.close_browser()
+        if self.browser is not None and self.browser.is_connected():
+            if self.attached or self.headless_by_choice():
+                return
+            # Running on the headless fallback; switch back once the secure browser is up
+            try:
+                browser = self.playwright.chromium.connect_over_cdp(self.session.endpoint, timeout=2000)
+            except Exception:
+                return
+            self.close_browser()
+            self.browser, self.context, self.attached = browser, browser.contexts[0], True
+            return
+        self.close_browser()
+        storage_state = self.session.storage.load()
+        if self.headless_by_choice():
+            self.browser = self.playwright.chromium.launch(headless=True)
+            self.context, self.attached = self.browser.new_context(storage_state=storage_state), False
+        else:
+            self.browser, self.context, self.attached = attach_browser(self.playwright, self.session.endpoint, storage_state)
+        if not self.attached:
+            self.state_loaded = self.session.storage.saved_at()
+            self.launches += 1
+
+    def close_browser(self):
+        if self.browser is not None:
+            try: self.browser.close()
+            except Exception: pass
+        self.browser = self.context = None
+        self.attached = False
+        self.browser_jobs = 0
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "browser": None if self.browser is None else ("attached" if self.attached else "headless"),
+            "browser_jobs": self.browser_jobs,
+            "jobs_done": self.jobs_done,
+            "headless_launches": self.launches,
+        }
+
+    def run(self):
+        self.playwright = sync_playwright().start()
+        try:
+            # Pre-warm: attach or launch before the first job arrives, not while it waits
+            try:
+                self.ensure_browser()
+            except Exception as e:
+                log(f"⚠️ {self.name}: browser warm-up failed: {e}")
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                future, kwargs = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    self.ensure_browser()
+                    self.browser_jobs += 1
+                    self.jobs_done += 1
+                    result = run_governance(context=self.context, session=self.session.endpoint, **kwargs)
+                    if self.attached and result.get("status") == "success":
+                        self.session.storage.refresh(self.context)
+                    elif not self.attached and result.get("error_type") == "login":
+                        # The snapshot no longer logs in; stop seeding contexts from it
+                        self.session.storage.invalidate()
+                    future.set_result(result)
+                except Exception as e:
+                    # Drop the connection so the next job reconnects from scratch
+                    self.close_browser()
+                    result = error_result(e)
+                    if result["error_type"] == "error":
+                        result["error_type"] = "connect"
+                    if kwargs.get("on_event") is not None:
+                        with event_sink(kwargs["on_event"]):
+                            emit("result", result=result)
+                    future.set_result(result)
+        finally:
+            self.close_browser()
+            self.playwright.stop()
+
+
+class AutomationPool:
+    # `size` workers per session, so throughput grows with the number of secure browsers
+    def __init__(self, size=POOL_SIZE, endpoints=None):
+        self.sessions = [PortalSession(i, e) for i, e in enumerate(endpoints or SESSION_ENDPOINTS)]
+        self.lock = threading.Lock()
+        self.ensure_workers(max(1, size) * len(self.sessions))
+
+    @property
+    def workers(self):
+        return [w for session in self.sessions for w in session.workers]
+
+    def ensure_workers(self, size):
+        # Each worker is one more tab working concurrently in its session's browser context
+        per_session = math.ceil(size / len(self.sessions))
+        with self.lock:
+            for session in self.sessions:
+                while len(session.workers) < per_session:
+                    index = len(session.workers)
+                    worker = AutomationWorker(session, f"automation-{session.name}-worker-{index + 1}", index)
+                    worker.start()
+                    session.workers.append(worker)
 
+    def pick_session(self):
+        # Least loaded session still in rotation; if none is, the one due back first gets a probe job
+        now = time.time()
+        available = [s for s in self.sessions if s.available(now)]
+        if available:
+            return min(available, key=lambda s: s.load())
+        return min(self.sessions, key=lambda s: s.retry_at)
+
+    def submit(self, **kwargs):
+        future = Future()
+        with self.lock:
+            session = self.pick_session()
+            session.in_flight += 1
+
+        def done(f):
+            result = None if f.cancelled() else f.result()
+            with self.lock:
+                session.record(result)
+
+        future.add_done_callback(done)
+        session.jobs.put((future, kwargs))
+        return future
+
+    def snapshot(self):
+        with self.lock:
             return {
-                "status": "success", 
-                "external_status": external_status,
-                "rin": tax_number, 
-                "uuid": invoice_uuid
+                "size": len(self.workers),
+                "queued": sum(s.jobs.qsize() for s in self.sessions),
+                "sessions": [s.snapshot() for s in self.sessions],
             }
-            
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.jobs.put(None)
+        selector_stats.save()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def live_cookies(endpoint):
+    # The cookie jar of the running secure browser, read over CDP (Storage.getCookies on the
+    # browser target), so a login made a second ago counts and an old snapshot never does.
+    # Leaving the block stops our driver and drops only our own CDP connection
+    with sync_playwright() as p:
+        browser = p.chromium.connect_over_cdp(endpoint, timeout=5000)
+        return browser.new_browser_cdp_session().send("Storage.getCookies").get("cookies", [])
+
+
+def probe_session(endpoint):
+    # Cheap readiness check: the CDP endpoint answers, and the browser's live portal cookies
+    # open the inquiry form (one GET). logged_in stays None when the cookies could not be read
+    probe = {"endpoint": endpoint, "alive": False, "logged_in": None, "browser_ms": None, "portal_ms": None, "error": None}
+    started = time.perf_counter()
+    try:
+        requests.get(endpoint.rstrip("/") + "/json/version", timeout=3).raise_for_status()
+    except requests.RequestException as e:
+        probe["error"] = f"secure browser unreachable: {e}"
+        return probe
+    probe["alive"] = True
+    probe["browser_ms"] = round((time.perf_counter() - started) * 1000)
+
+    try:
+        cookies = live_cookies(endpoint)
+    except Exception as e:
+        probe["error"] = f"could not read the browser cookies: {e}"
+        return probe
+    started = time.perf_counter()
+    try:
+        PortalHttpClient(cookies)
+        probe["logged_in"] = True
+    except SessionExpired as e:
+        probe["logged_in"] = False
+        probe["error"] = str(e)
+    except (PortalBusy, requests.RequestException) as e:
+        probe["error"] = f"portal check failed: {e}"
+    probe["portal_ms"] = round((time.perf_counter() - started) * 1000)
+    return probe
+
+
+def probe_sessions():
+    # Probes every configured session and updates this process's pool, if it has one
+    sessions = _pool.sessions if _pool is not None else [PortalSession(i, e) for i, e in enumerate(SESSION_ENDPOINTS)]
+    probes = []
+    for session in sessions:
+        probe = probe_session(session.endpoint)
+        if _pool is not None:
+            with _pool.lock:
+                session.apply_probe(probe)
+        probes.append(probe)
+    return probes
+
+
+def apply_probes(probes):
+    # Applies probes another process recorded to this process's pool, if it has one
+    if _pool is None:
+        return
+    by_endpoint = {probe["endpoint"]: probe for probe in probes}
+    for session in _pool.sessions:
+        probe = by_endpoint.get(session.endpoint)
+        if probe is not None:
+            with _pool.lock:
+                session.apply_probe(probe)
+
+
+def pool_snapshot():
+    return _pool.snapshot() if _pool is not None else None
+
+
+def get_pool(size=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = AutomationPool(size or POOL_SIZE)
+        return _pool
+
 
 if __name__ == "__main__":
-    result = {"status": "error", "message": "No arguments provided"}
-    import json
-    
+    # Force UTF-8 for console output to avoid 'charmap' errors on Windows
+    if sys.platform == "win32":
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+    def write_event(event):
+        sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
     # التحقق لو فيه علم الاستعلام --inquiry
     inquiry = "--inquiry" in sys.argv
     args = [a for a in sys.argv if not a.startswith('--')]
 
-    if len(args) > 1:
-        arg = args[1]
-        if arg.startswith('http'):
-            result = run_governance(invoice_url=arg, inquiry_mode=inquiry)
+    with event_sink(write_event):
+        if len(args) > 1 and args[1].startswith('http'):
+            run_governance(invoice_url=args[1], inquiry_mode=inquiry)
         elif len(args) > 2:
-            result = run_governance(tax_number=args[1], invoice_uuid=args[2], inquiry_mode=inquiry)
-    
-    print(f"RESULT_JSON:{json.dumps(result)}")
+            run_governance(tax_number=args[1], invoice_uuid=args[2], inquiry_mode=inquiry)
+        else:
+            emit("result", result={"status": "error", "message": "No arguments provided"})
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 import os
+import tempfile
 import dj_database_url
 from pathlib import Path
 from dotenv import load_dotenv
@@ -96,6 +97,25 @@ DATABASES = {
 }
 
 
+# Cache
+# File based so every gunicorn worker shares the same entries. Django culls a third of the
+# entries past MAX_ENTRIES (300 by default), far fewer than a day of cached inquiries; the
+# breaker has its own directory so no amount of cached results can cull its state
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'zahran_cache'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '20000'))},
+    },
+    'breaker': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'breaker'),
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -133,15 +153,18 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
-# Simplest WhiteNoise configuration to avoid 500 errors if files are missing
+# Hashed file names (served with a far-future Cache-Control) plus gzip/brotli copies.
+# Falls back to plain names when collectstatic has not run, to avoid 500 errors
 STORAGES = {
     "default": {
         "BACKEND": "django.core.files.storage.FileSystemStorage",
     },
     "staticfiles": {
-        "BACKEND": "whitenoise.storage.CompressedStaticFilesStorage",
+        "BACKEND": "core.storage.ForgivingManifestStaticFilesStorage",
     },
 }
+# Also serve app static files straight from their source folders when nothing was collected
+WHITENOISE_USE_FINDERS = True
 
 # CORS Settings - Production Ready
 # Allow specific origins for better security
@@ -176,6 +199,10 @@ CORS_ALLOW_METHODS = [
 
 
 # REST Framework Settings
+# Invoice list API: cursor page size (clients may ask for up to INVOICE_MAX_PAGE_SIZE with ?page_size=)
+INVOICE_PAGE_SIZE = int(os.getenv('INVOICE_PAGE_SIZE', '50'))
+INVOICE_MAX_PAGE_SIZE = int(os.getenv('INVOICE_MAX_PAGE_SIZE', '500'))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -198,3 +225,74 @@ SIMPLE_JWT = {
 # https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Automation Engine
+# Warm Playwright workers per secure browser session (AUTOMATION_CDP_URLS), each with its own CDP connection
+AUTOMATION_POOL_SIZE = int(os.getenv('AUTOMATION_POOL_SIZE', '2'))
+# Max seconds a request waits for one automation run
+AUTOMATION_TIMEOUT = int(os.getenv('AUTOMATION_TIMEOUT', '120'))
+# Start the workers (and their browsers) when the server boots instead of on the first request.
+# Only serving processes warm (see invoices.apps.serving_process); set to False to defer it
+AUTOMATION_PREWARM = os.getenv('AUTOMATION_PREWARM', 'True') == 'True'
+# Seconds between readiness probes of each secure browser session (0 disables the
+# in-process heartbeat; `python manage.py automation_heartbeat` runs it standalone)
+AUTOMATION_HEARTBEAT_INTERVAL = int(os.getenv('AUTOMATION_HEARTBEAT_INTERVAL', '60'))
+# Only the process holding this lock probes; the others reuse its recorded results
+AUTOMATION_HEARTBEAT_LOCK = os.getenv('AUTOMATION_HEARTBEAT_LOCK', os.path.join(tempfile.gettempdir(), 'zahran_automation_heartbeat.lock'))
+
+# Governance job queue (DB-backed, no external broker)
+# Run job runners as threads inside the web process; set to False when
+# `python manage.py run_governance_jobs` runs as a separate process
+GOVERNANCE_INLINE_RUNNER = os.getenv('GOVERNANCE_INLINE_RUNNER', 'True') == 'True'
+GOVERNANCE_JOB_WORKERS = int(os.getenv('GOVERNANCE_JOB_WORKERS', str(AUTOMATION_POOL_SIZE)))
+GOVERNANCE_JOB_POLL_INTERVAL = float(os.getenv('GOVERNANCE_JOB_POLL_INTERVAL', '1'))
+# How often runners fail jobs left "running" by a killed process, busy or not
+GOVERNANCE_STALE_SWEEP_INTERVAL = int(os.getenv('GOVERNANCE_STALE_SWEEP_INTERVAL', '30'))
+# Backpressure: start_governance answers 429 once this many jobs are waiting
+GOVERNANCE_MAX_QUEUED = int(os.getenv('GOVERNANCE_MAX_QUEUED', '200'))
+# Retry-After (seconds) sent with 429/503 answers when no better estimate exists
+GOVERNANCE_RETRY_AFTER = int(os.getenv('GOVERNANCE_RETRY_AFTER', '30'))
+
+# Batch governance: upper bound for concurrent tabs requested by start_governance_batch
+GOVERNANCE_BATCH_MAX_CONCURRENCY = int(os.getenv('GOVERNANCE_BATCH_MAX_CONCURRENCY', '4'))
+
+# External inquiry cache (check_status): seconds to keep a portal answer per invoice UUID
+INQUIRY_CACHE_TTL = int(os.getenv('INQUIRY_CACHE_TTL', '600'))
+# "not_found" (and unknown) answers may change soon after, so they expire faster
+INQUIRY_CACHE_NOT_FOUND_TTL = int(os.getenv('INQUIRY_CACHE_NOT_FOUND_TTL', '60'))
+
+# Circuit breaker around the external portal: open after BREAKER_FAILURE_THRESHOLD
+# connect/timeout/login failures within BREAKER_WINDOW seconds, then fail fast for
+# BREAKER_COOLDOWN seconds before letting one probe run through (half-open)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '120'))
+BREAKER_COOLDOWN = int(os.getenv('BREAKER_COOLDOWN', '60'))
+# Created exclusively by the one half-open probe, so it is unique across processes
+BREAKER_PROBE_LOCK = os.getenv('BREAKER_PROBE_LOCK', os.path.join(tempfile.gettempdir(), 'zahran_breaker_probe.lock'))
+
+# Mobile scanner sync: max links returned by one incremental pull
+MOBILE_SYNC_PULL_LIMIT = int(os.getenv('MOBILE_SYNC_PULL_LIMIT', '100'))
+# Max links in one push_batch request from the scanner's offline queue
+MOBILE_SYNC_PUSH_MAX_BATCH = int(os.getenv('MOBILE_SYNC_PUSH_MAX_BATCH', '200'))
+# Max seconds a long-poll pull (?wait=) holds the request open, and the lifetime of one
+# SSE connection before the browser reconnects (needs a threaded gunicorn worker class)
+MOBILE_SYNC_LONG_POLL_TIMEOUT = int(os.getenv('MOBILE_SYNC_LONG_POLL_TIMEOUT', '25'))
+MOBILE_SYNC_STREAM_LIFETIME = int(os.getenv('MOBILE_SYNC_STREAM_LIFETIME', '300'))
+# Long-polls and SSE streams one process may hold at once (each ties up a gunicorn thread;
+# keep well below --threads), and how often idle subscribers look for links pushed elsewhere
+MOBILE_SYNC_MAX_HELD = int(os.getenv('MOBILE_SYNC_MAX_HELD', '4'))
+MOBILE_SYNC_WATCH_INTERVAL = float(os.getenv('MOBILE_SYNC_WATCH_INTERVAL', '2'))
+# compact_mobile_sync deletes processed scanner links older than this many days,
+# MOBILE_SYNC_COMPACT_BATCH rows per DELETE so the table is never locked for long
+MOBILE_SYNC_RETENTION_DAYS = int(os.getenv('MOBILE_SYNC_RETENTION_DAYS', '30'))
+MOBILE_SYNC_COMPACT_BATCH = int(os.getenv('MOBILE_SYNC_COMPACT_BATCH', '1000'))
+
+# dispatch_mobile_sync: scanned links claimed per round and seconds between rounds when idle.
+# On SQLite only one dispatcher may run; it holds MOBILE_SYNC_DISPATCH_LOCK, and a lock not
+# refreshed for MOBILE_SYNC_DISPATCH_LOCK_STALE seconds is taken over
+MOBILE_SYNC_DISPATCH_BATCH = int(os.getenv('MOBILE_SYNC_DISPATCH_BATCH', '20'))
+MOBILE_SYNC_DISPATCH_INTERVAL = float(os.getenv('MOBILE_SYNC_DISPATCH_INTERVAL', '2'))
+MOBILE_SYNC_DISPATCH_LOCK = os.getenv('MOBILE_SYNC_DISPATCH_LOCK', os.path.join(tempfile.gettempdir(), 'zahran_mobile_sync_dispatch.lock'))
+MOBILE_SYNC_DISPATCH_LOCK_STALE = int(os.getenv('MOBILE_SYNC_DISPATCH_LOCK_STALE', '60'))
+# A link claimed this many seconds ago that never got a job (dispatcher died mid-batch) is claimed again
+MOBILE_SYNC_DISPATCH_RECLAIM_AFTER = int(os.getenv('MOBILE_SYNC_DISPATCH_RECLAIM_AFTER', '60'))
@@ -0,0 +1,13 @@
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class ForgivingManifestStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    # Before `collectstatic` has run (runserver on the office PC with DEBUG off) there is no
+    # manifest and no collected file to hash; serve the plain name instead of a 500
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
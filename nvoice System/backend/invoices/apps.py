@@ -1,5 +1,48 @@
+import os
+import sys
 from django.apps import AppConfig
 
+# manage.py commands that serve automation; gunicorn is not started through manage.py
+SERVING_COMMANDS = ('runserver', 'run_governance_jobs', 'dispatch_mobile_sync')
+SERVERS = ('gunicorn', 'uvicorn', 'daphne', 'waitress')
+
+
+def serving_process():
+    # Not migrate/collectstatic/shell or one-off scripts, nor runserver's autoreload parent
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if program == 'manage.py':
+        if len(sys.argv) < 2 or sys.argv[1] not in SERVING_COMMANDS:
+            return False
+        return sys.argv[1] != 'runserver' or '--noreload' in sys.argv or os.environ.get('RUN_MAIN') == 'true'
+    return any(server in program for server in SERVERS)
+
 
 class InvoicesConfig(AppConfig):
     name = 'invoices'
+
+    def ready(self):
+        from django.conf import settings
+        if not serving_process():
+            return
+        self.start_automation(settings)
+        if settings.GOVERNANCE_INLINE_RUNNER and sys.argv[1:2] != ['run_governance_jobs']:
+            # Jobs still queued from before a restart run without waiting for the next enqueue
+            from . import jobs
+            jobs.start_runners()
+
+    def start_automation(self, settings):
+        if not (settings.AUTOMATION_PREWARM or settings.AUTOMATION_HEARTBEAT_INTERVAL > 0):
+            return
+        from .automation import get_engine
+        try:
+            # Imported here, before any background thread, so they never race the import
+            engine = get_engine()
+        except ImportError as e:
+            print(f">>> AUTOMATION: pre-warm skipped, engine unavailable: {e}")
+            return
+        if settings.AUTOMATION_PREWARM:
+            # Workers attach (or launch their headless fallback) as soon as they start
+            engine.get_pool(settings.AUTOMATION_POOL_SIZE)
+        if settings.AUTOMATION_HEARTBEAT_INTERVAL > 0:
+            from . import heartbeat
+            heartbeat.start()
@@ -0,0 +1,303 @@
+import json
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from rest_framework import status
+from .models import Invoice, Company, RinResolution
+from . import breaker
+
+# Concurrent batch items would otherwise hit "database is locked" on SQLite
+# when several threads upgrade their read transactions to writes at once
+_save_lock = threading.Lock()
+
+# Portal answers that confirm the (RIN, UUID) pair exists
+DEFINITIVE_STATUSES = ('accepted', 'rejected')
+
+
+def get_engine():
+    # automation_engine.py lives next to manage.py; imported lazily so the API
+    # still boots on hosts without Playwright installed
+    backend_dir = str(settings.BASE_DIR)
+    if backend_dir not in sys.path:
+        sys.path.append(backend_dir)
+    import automation_engine
+    return automation_engine
+
+
+def run_automation(rin=None, uuid=None, url=None, inquiry=False, on_event=None):
+    # Fail fast while the portal is known to be down instead of waiting on Playwright
+    allowed, wait = breaker.allow_request()
+    if not allowed:
+        return {
+            "status": "error",
+            "error_type": "circuit_open",
+            "message": "المنظومة الخارجية غير متاحة حالياً",
+            "retry_after": wait
+        }
+    resolved = False
+    if url and not rin:
+        # A known invoice skips the ETA share page and goes straight to the inquiry
+        uuid = uuid or extract_uuid(url)
+        rin = resolve_rin(uuid)
+        resolved = rin is not None
+
+    result = call_engine(rin, uuid, url, inquiry, on_event)
+    breaker.record_result(result)
+    if resolved and result.get('status') == 'success' and result.get('external_status') == 'not_found':
+        # The remembered issuer may be wrong: forget it and read the share page once
+        forget_rin(uuid)
+        resolved = False
+        result = call_engine(None, uuid, url, inquiry, on_event)
+        breaker.record_result(result)
+    if result.get('status') == 'success':
+        if resolved:
+            result['rin_resolved'] = True
+        elif result.get('external_status') in DEFINITIVE_STATUSES:
+            # Only a pair the portal recognised; not_found/unknown may mean a wrong RIN
+            remember_rin(result.get('uuid') or uuid, result.get('rin'))
+    return result
+
+
+def call_engine(rin=None, uuid=None, url=None, inquiry=False, on_event=None):
+    engine = get_engine()
+    if engine.ENGINE_MODE == "http" and rin and uuid:
+        # Once a worker has loaded the portal cookies, plain HTTP needs no browser tab
+        with engine.event_sink(on_event):
+            engine.emit("step", step="http_inquiry")
+            try:
+                result = engine.http_inquiry(rin, uuid)
+            except engine.PortalBusy as e:
+                result = engine.busy_result(e)
+            if result is not None:
+                engine.emit("result", result=result)
+                return result
+    future = engine.get_pool(settings.AUTOMATION_POOL_SIZE).submit(
+        tax_number=rin,
+        invoice_uuid=uuid,
+        invoice_url=url,
+        inquiry_mode=inquiry,
+        on_event=on_event,
+    )
+    try:
+        return future.result(timeout=settings.AUTOMATION_TIMEOUT)
+    except FutureTimeout:
+        future.cancel()
+        return {"status": "error", "error_type": "timeout", "message": "انتهت مهلة تنفيذ المحرك"}
+
+
+def normalize_uuid(value):
+    return (value or '').strip().upper()
+
+
+def extract_uuid(url):
+    match = re.search(r'([A-Z0-9-]{36})', url or '', re.IGNORECASE)
+    return normalize_uuid(match.group(0)) if match else None
+
+
+def resolve_rin(uuid):
+    uuid = normalize_uuid(uuid)
+    if not uuid:
+        return None
+    entry = RinResolution.objects.filter(invoice_uuid=uuid).values_list('rin', flat=True).first()
+    if entry:
+        with _save_lock:
+            RinResolution.objects.filter(invoice_uuid=uuid).update(hits=F('hits') + 1)
+        return entry
+
+    # Invoices governed before the index existed already know their issuer. Exact matches on
+    # the unique invoice_id index (iexact would scan); ETA UUIDs come upper or lower case
+    invoice = Invoice.objects.filter(invoice_id__in=(uuid, uuid.lower())).select_related('company').first()
+    if invoice is None:
+        return None
+    remember_rin(uuid, invoice.company.tax_registration_number, source='invoice')
+    return invoice.company.tax_registration_number
+
+
+def remember_rin(uuid, rin, source='engine'):
+    uuid = normalize_uuid(uuid)
+    rin = (rin or '').strip()
+    if uuid and rin:
+        with _save_lock:
+            RinResolution.objects.update_or_create(invoice_uuid=uuid, defaults={'rin': rin, 'source': source})
+
+
+def forget_rin(uuid):
+    with _save_lock:
+        RinResolution.objects.filter(invoice_uuid=normalize_uuid(uuid)).delete()
+
+
+def get_cached_inquiry(uuid):
+    # Returns (external_data, cache_info) or None on a miss
+    entry = cache.get(f"inquiry:{normalize_uuid(uuid)}")
+    if entry is None:
+        return None
+    return entry['result'], {"hit": True, "age": round(time.time() - entry['cached_at'], 1)}
+
+
+def run_inquiry(uuid=None, url=None, on_event=None):
+    # Asks the portal and caches real answers; engine errors are never cached
+    result = run_automation(url=url, uuid=uuid, inquiry=True, on_event=on_event)
+    if result.get('status') == 'success':
+        definitive = result.get('external_status') in DEFINITIVE_STATUSES
+        ttl = settings.INQUIRY_CACHE_TTL if definitive else settings.INQUIRY_CACHE_NOT_FOUND_TTL
+        cache.set(f"inquiry:{normalize_uuid(uuid)}", {'result': result, 'cached_at': time.time()}, ttl)
+    return result
+
+
+def save_governance(res_data, rin, uuid, user, output):
+    final_rin = res_data.get('rin') or rin
+    final_uuid = res_data.get('uuid') or uuid
+
+    # Check if invoice already exists and is frozen
+    existing_invoice = Invoice.objects.filter(invoice_id=final_uuid).first()
+    if existing_invoice and existing_invoice.status == 'frozen':
+        return {
+            "result_code": "already_frozen",
+            "message": "تم إيجاد الفاتورة ولكنها مجمدة مسبقاً",
+            "rin": final_rin,
+            "uuid": final_uuid,
+            "status": "frozen"
+        }, status.HTTP_200_OK
+
+    company, _ = Company.objects.get_or_create(
+        tax_registration_number=final_rin,
+        defaults={'name': f"شركة - {final_rin}"}
+    )
+
+    Invoice.objects.update_or_create(
+        invoice_id=final_uuid,
+        defaults={
+            'company': company,
+            'status': 'frozen', # Default to frozen on success per user request
+            'governance_result': output,
+            'frozen_by': user if user is not None and user.is_authenticated else None
+        }
+    )
+
+    return {
+        "result_code": "success_frozen",
+        "message": "تم إيجاد الفاتورة وتجميدها بنجاح",
+        "rin": final_rin,
+        "uuid": final_uuid,
+        "status": "frozen"
+    }, status.HTTP_200_OK
+
+
+def busy_payload(res_data):
+    return {
+        "result_code": "portal_busy",
+        "error": "المنظومة الخارجية مشغولة حالياً، يرجى إعادة المحاولة بعد قليل",
+        "retry_after": res_data.get('retry_after', settings.GOVERNANCE_RETRY_AFTER)
+    }
+
+
+def govern(rin=None, uuid=None, url=None, user=None, on_event=None):
+    # Runs one governance and returns (payload, http_status) exactly as start_governance answers
+    try:
+        res_data = run_automation(rin=rin, uuid=uuid, url=url, on_event=on_event)
+        output = json.dumps(res_data, ensure_ascii=False)
+
+        if res_data.get('status') == 'success':
+            # Save to database
+            with _save_lock:
+                return save_governance(res_data, rin, uuid, user, output)
+
+        if res_data.get('error_type') == 'busy':
+            return busy_payload(res_data), status.HTTP_503_SERVICE_UNAVAILABLE
+        if res_data.get('error_type') == 'circuit_open':
+            return {
+                "result_code": "portal_unavailable",
+                "error": res_data['message'],
+                "retry_after": res_data['retry_after']
+            }, status.HTTP_503_SERVICE_UNAVAILABLE
+        if res_data.get('error_type') == 'timeout':
+            return {
+                "result_code": "portal_timeout",
+                "error": "لم ترد المنظومة الخارجية في الوقت المحدد، يرجى إعادة المحاولة",
+                "details": res_data.get('message')
+            }, status.HTTP_504_GATEWAY_TIMEOUT
+
+        error_msg = res_data.get('message', 'فشلت الأتمتة في استخراج البيانات أو التنفيذ')
+        return {
+            "result_code": "not_found",
+            "error": "لم يسفر البحث عن شيء أو حدث خطأ",
+            "details": error_msg,
+            "technical_details": output
+        }, status.HTTP_404_NOT_FOUND
+
+    except Exception as e:
+        return {
+            "result_code": "engine_error",
+            "error": "حدث خطأ غير متوقع أثناء تشغيل المحرك",
+            "details": str(e)
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def parse_batch_item(item):
+    # Accepts "https://...", {"url": ...}, {"rin": ..., "uuid": ...} or ["rin", "uuid"]
+    if isinstance(item, str):
+        return {"url": item.strip()} if item.strip() else None
+    if isinstance(item, (list, tuple)) and len(item) == 2 and all(item):
+        return {"rin": str(item[0]).strip(), "uuid": str(item[1]).strip()}
+    if isinstance(item, dict):
+        if item.get('url'):
+            url = item['url']
+            return {"url": url.strip()} if isinstance(url, str) and url.strip() else None
+        if item.get('rin') and item.get('uuid'):
+            return {"rin": str(item['rin']).strip(), "uuid": str(item['uuid']).strip()}
+    return None
+
+
+def govern_batch_item(index, item, user):
+    from . import jobs
+    try:
+        # Same single-flight as start_governance: a UUID already in flight is joined, not re-run
+        job, _ = jobs.run_or_join(rin=item.get('rin'), uuid=item.get('uuid'), url=item.get('url'), user=user)
+        payload, http_status = jobs.job_payload(job)
+    finally:
+        # Executor threads open their own DB connection; don't leak it
+        connection.close()
+    return {"index": index, "item": item, "http_status": http_status, **payload}
+
+
+def as_completed_items(futures):
+    # as_completed over (future, tag) pairs, yielding each pair as its future finishes
+    tags = dict(futures)
+    for future in as_completed(tags):
+        yield future, tags[future]
+
+
+def govern_batch(items, concurrency, user=None):
+    # Yields one result per item as soon as it finishes, then a final summary
+    concurrency = max(1, min(concurrency, settings.GOVERNANCE_BATCH_MAX_CONCURRENCY))
+    get_engine().get_pool(settings.AUTOMATION_POOL_SIZE).ensure_workers(concurrency)
+
+    summary = {"total": len(items), "frozen": 0, "already_frozen": 0, "not_found": 0, "errors": 0}
+    counters = {"success_frozen": "frozen", "already_frozen": "already_frozen", "not_found": "not_found"}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        for index, raw in enumerate(items):
+            item = parse_batch_item(raw)
+            if item is None:
+                summary["errors"] += 1
+                yield {"index": index, "item": raw, "http_status": 400, "result_code": "invalid_item", "error": "Invoice URL or (RIN and UUID) are required"}
+                continue
+            futures.append((executor.submit(govern_batch_item, index, item, user), (index, item)))
+
+        for future, (index, item) in as_completed_items(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # One broken item must not end the stream before the summary
+                result = {"index": index, "item": item, "http_status": 500, "result_code": "engine_error", "error": "حدث خطأ غير متوقع أثناء تشغيل المحرك", "details": str(e)}
+            summary[counters.get(result.get('result_code'), "errors")] += 1
+            yield result
+
+    yield {"summary": summary}
@@ -0,0 +1,134 @@
+import os
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+# Failures that mean the portal (or our session to it) is down, not that one invoice is bad
+TRACKED_ERRORS = ('connect', 'timeout', 'login')
+
+STATE_KEY = 'automation:breaker'
+
+
+def cache():
+    return caches['breaker']
+
+
+def initial_state():
+    return {"state": "closed", "opened_at": None, "failures": [], "last_error": None, "changed_at": time.time()}
+
+
+def get_state():
+    # Kept in the shared cache so every gunicorn worker sees the same breaker
+    return cache().get(STATE_KEY) or initial_state()
+
+
+def save_state(state):
+    cache().set(STATE_KEY, state, None)
+
+
+def retry_after(state):
+    if state["opened_at"] is None:
+        return settings.BREAKER_COOLDOWN
+    return max(1, int(state["opened_at"] + settings.BREAKER_COOLDOWN - time.time()))
+
+
+def allow_request():
+    # Returns (allowed, retry_after)
+    state = get_state()
+    if state["state"] == "closed":
+        return True, 0
+
+    if state["state"] == "open":
+        if time.time() - state["opened_at"] < settings.BREAKER_COOLDOWN:
+            return False, retry_after(state)
+        state["state"] = "half_open"
+        state["changed_at"] = time.time()
+        save_state(state)
+
+    # Half-open: exactly one probe run goes to the portal, the rest keep failing fast
+    if take_probe():
+        return True, 0
+    return False, settings.BREAKER_COOLDOWN
+
+
+def take_probe():
+    # O_EXCL creation is atomic across processes; add() on the file cache is not
+    path = settings.BREAKER_PROBE_LOCK
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+        if age < settings.AUTOMATION_TIMEOUT:
+            return False
+        # The probe never reported back (its worker died): one process renames it away and retries
+        stale = f"{path}.{os.getpid()}"
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return False
+        os.remove(stale)
+    return False
+
+
+def release_probe():
+    try:
+        os.remove(settings.BREAKER_PROBE_LOCK)
+    except FileNotFoundError:
+        pass
+
+
+def record_result(result):
+    state = get_state()
+    error_type = result.get('error_type')
+    if error_type not in TRACKED_ERRORS:
+        if error_type == 'busy':
+            # Turned away by our own governor, so the portal was never asked and nothing is
+            # counted; a half-open probe still hands its slot back for the next request
+            if state["state"] == "half_open":
+                release_probe()
+            return state
+        if state["state"] != "closed" or state["failures"]:
+            state = initial_state()
+            save_state(state)
+        release_probe()
+        return state
+
+    now = time.time()
+    window_start = now - settings.BREAKER_WINDOW
+    state["failures"] = [f for f in state["failures"] if f["at"] >= window_start]
+    state["failures"].append({"at": now, "type": error_type})
+    state["last_error"] = {"type": error_type, "message": result.get('message'), "at": now}
+
+    if state["state"] == "half_open" or len(state["failures"]) >= settings.BREAKER_FAILURE_THRESHOLD:
+        if state["state"] != "open":
+            print(f">>> BREAKER: opened after {error_type} ({len(state['failures'])} recent failures)")
+        state["state"] = "open"
+        state["opened_at"] = now
+        state["changed_at"] = now
+        release_probe()
+    save_state(state)
+    return state
+
+
+def snapshot():
+    state = get_state()
+    by_type = {}
+    for f in state["failures"]:
+        by_type[f["type"]] = by_type.get(f["type"], 0) + 1
+    return {
+        "state": state["state"],
+        "recent_failures": len(state["failures"]),
+        "failures_by_type": by_type,
+        "last_error": state["last_error"],
+        "opened_at": state["opened_at"],
+        "retry_after": retry_after(state) if state["state"] != "closed" else 0,
+        "threshold": settings.BREAKER_FAILURE_THRESHOLD,
+        "window": settings.BREAKER_WINDOW,
+        "cooldown": settings.BREAKER_COOLDOWN,
+    }
@@ -0,0 +1,158 @@
+import datetime
+import os
+import time
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import GovernanceJob, MobileSync
+from .automation import extract_uuid
+from . import jobs, mobile_sync
+
+FINISHED_STATUSES = ['done', 'failed']
+
+
+class DispatchLocked(RuntimeError):
+    pass
+
+
+class LockFile:
+    # SQLite has no SKIP LOCKED, so only one dispatcher runs at a time there. The holder
+    # touches the file every loop; one left untouched for stale_after seconds was killed
+    def __init__(self, path, stale_after):
+        self.path = path
+        self.stale_after = stale_after
+
+    def acquire(self):
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(self.path)
+                except FileNotFoundError:
+                    continue
+                if age < self.stale_after:
+                    raise DispatchLocked(f"another dispatcher holds {self.path}")
+                os.remove(self.path)
+                continue
+            os.write(fd, str(os.getpid()).encode('ascii'))
+            os.close(fd)
+            return
+        raise DispatchLocked(f"could not take {self.path}")
+
+    def touch(self):
+        os.utime(self.path)
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def skip_locked():
+    return connection.features.has_select_for_update_skip_locked
+
+
+def claimable(now):
+    # Unclaimed links, plus links a dispatcher claimed but never fed into a job (it died or
+    # enqueue failed) once MOBILE_SYNC_DISPATCH_RECLAIM_AFTER seconds have passed
+    stranded = Q(
+        is_processed=True, job__isnull=True, result_code__isnull=True,
+        dispatched_at__lt=now - datetime.timedelta(seconds=settings.MOBILE_SYNC_DISPATCH_RECLAIM_AFTER)
+    )
+    return Q(is_processed=False) | stranded
+
+
+def claim(limit):
+    # Marks up to `limit` links as taken by this dispatcher. Desks pulling with claim=1 then
+    # never see them, and vice versa
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = MobileSync.objects.filter(claimable(now)).order_by('id')
+        if skip_locked():
+            # Postgres: concurrent dispatchers each lock a different set of rows
+            rows = list(queryset.select_for_update(skip_locked=True)[:limit])
+            MobileSync.objects.filter(pk__in=[row.pk for row in rows]).update(is_processed=True, dispatched_at=now)
+        else:
+            # SQLite: a desk's claim pull may still race us, so keep the per-row conditional UPDATE
+            rows = [
+                row for row in queryset[:limit]
+                if MobileSync.objects.filter(claimable(now), pk=row.pk).update(is_processed=True, dispatched_at=now)
+            ]
+    for row in rows:
+        row.is_processed, row.dispatched_at = True, now
+    return rows
+
+
+def dispatch_row(row):
+    if extract_uuid(row.url) is None:
+        # Not an ETA share link; there is nothing to govern
+        row.result_code = 'invalid_link'
+        row.save(update_fields=['result_code'])
+        return None
+    # Same single-flight as start_governance: a link already governing joins that job
+    row.job, _ = jobs.enqueue(url=row.url)
+    row.save(update_fields=['job'])
+    return row.job
+
+
+def dispatch_batch(limit=None):
+    # Returns how many links were claimed; leaves room in the job queue for the desks
+    limit = limit or settings.MOBILE_SYNC_DISPATCH_BATCH
+    free = settings.GOVERNANCE_MAX_QUEUED - GovernanceJob.objects.filter(status='queued').count()
+    if free <= 0:
+        return 0
+    rows = claim(min(limit, free))
+    for row in rows:
+        try:
+            dispatch_row(row)
+        except Exception as e:
+            # The row stays claimed without a job and is picked up again after the reclaim delay
+            print(f">>> DISPATCH: could not dispatch link {row.id}: {e}")
+    if rows:
+        print(f">>> DISPATCH: {len(rows)} scanned links sent to governance")
+    return len(rows)
+
+
+def settle():
+    # Copies the outcome of finished jobs onto their links
+    outcome = GovernanceJob.objects.filter(pk=OuterRef('job_id')).values('result_code')[:1]
+    return MobileSync.objects.filter(result_code__isnull=True, job__status__in=FINISHED_STATUSES).update(
+        result_code=Coalesce(Subquery(outcome), Value('engine_error'))
+    )
+
+
+def pending_inline():
+    # --once waits for jobs run by this process's inline runners before exiting
+    return settings.GOVERNANCE_INLINE_RUNNER and MobileSync.objects.filter(
+        result_code__isnull=True, job__status__in=jobs.ACTIVE_STATUSES
+    ).exists()
+
+
+def run(stop_event=None, interval=None, batch_size=None, once=False):
+    interval = interval or settings.MOBILE_SYNC_DISPATCH_INTERVAL
+    lock = None if skip_locked() else LockFile(settings.MOBILE_SYNC_DISPATCH_LOCK, settings.MOBILE_SYNC_DISPATCH_LOCK_STALE)
+    if lock:
+        lock.acquire()
+    try:
+        while stop_event is None or not stop_event.is_set():
+            close_old_connections()
+            if lock:
+                lock.touch()
+            try:
+                dispatched = dispatch_batch(batch_size)
+                settle()
+            except Exception as e:
+                print(f">>> DISPATCH: error: {e}")
+                dispatched = 0
+            if once and not dispatched and not pending_inline():
+                return
+            if not dispatched:
+                # A push in this process wakes us at once; other processes are seen on the next round
+                mobile_sync.wait_for_push(interval)
+    finally:
+        if lock:
+            lock.release()
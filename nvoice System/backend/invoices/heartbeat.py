@@ -0,0 +1,110 @@
+import datetime
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import AutomationSession
+from .automation import get_engine
+from .dispatch import DispatchLocked, LockFile
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def beat():
+    # Probes every secure browser once and records the outcome on its AutomationSession row
+    probes = get_engine().probe_sessions()
+    for probe in probes:
+        defaults = {
+            "is_active": probe['alive'],
+            "browser_latency_ms": probe['browser_ms'],
+            "portal_latency_ms": probe['portal_ms'],
+            "last_error": probe['error'],
+            "end_time": None if probe['alive'] else timezone.now(),
+        }
+        if probe['logged_in'] is not None:
+            # Cookies that could not be read mean "unknown": keep the last known login state
+            defaults["otp_verified"] = probe['logged_in']
+        AutomationSession.objects.update_or_create(endpoint=probe['endpoint'], defaults=defaults)
+    return probes
+
+
+def stale_after():
+    return datetime.timedelta(seconds=max(settings.AUTOMATION_HEARTBEAT_INTERVAL, 1) * 3)
+
+
+def follow():
+    # Processes that do not hold the heartbeat lock steer their own pool with the probes the
+    # holder recorded, instead of opening their own driver and CDP connection per browser
+    sessions = AutomationSession.objects.filter(
+        endpoint__isnull=False, last_heartbeat__gte=timezone.now() - stale_after()
+    )
+    probes = [
+        {"endpoint": s.endpoint, "alive": s.is_active, "logged_in": s.otp_verified, "error": s.last_error}
+        for s in sessions
+    ]
+    get_engine().apply_probes(probes)
+    return probes
+
+
+def is_ready(session):
+    return session.is_active and session.otp_verified and timezone.now() - session.last_heartbeat < stale_after()
+
+
+def readiness():
+    sessions = AutomationSession.objects.filter(endpoint__isnull=False).order_by('endpoint')
+    return [
+        {
+            "endpoint": s.endpoint,
+            "ready": is_ready(s),
+            "browser_alive": s.is_active,
+            "logged_in": s.otp_verified,
+            "browser_latency_ms": s.browser_latency_ms,
+            "portal_latency_ms": s.portal_latency_ms,
+            "last_error": s.last_error,
+            "last_heartbeat": s.last_heartbeat,
+        }
+        for s in sessions
+    ]
+
+
+def run(stop_event=None, interval=None):
+    interval = interval or settings.AUTOMATION_HEARTBEAT_INTERVAL
+    stop_event = stop_event or threading.Event()
+    # One process per host probes; the others retry the lock every round and take it over
+    # once the holder has not touched it for three intervals
+    lock = LockFile(settings.AUTOMATION_HEARTBEAT_LOCK, max(interval, 1) * 3)
+    held = False
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            if held:
+                try:
+                    lock.touch()
+                except FileNotFoundError:
+                    held = False
+            if not held:
+                try:
+                    lock.acquire()
+                    held = True
+                except DispatchLocked:
+                    pass
+            try:
+                if held:
+                    beat()
+                else:
+                    follow()
+            except Exception as e:
+                print(f">>> HEARTBEAT: probe failed: {e}")
+            stop_event.wait(interval)
+    finally:
+        if held:
+            lock.release()
+
+
+def start():
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=run, name="automation-heartbeat", daemon=True)
+            _thread.start()
@@ -0,0 +1,193 @@
+import datetime
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from .models import GovernanceJob
+from .automation import govern, run_inquiry, normalize_uuid, extract_uuid
+
+ACTIVE_STATUSES = ['queued', 'running']
+
+_wakeup = threading.Event()
+_runners = []
+_runners_lock = threading.Lock()
+
+
+def dedup_key(kind, uuid=None, url=None):
+    key = normalize_uuid(uuid) or extract_uuid(url)
+    if not key and url:
+        key = "url:" + hashlib.sha1(url.strip().encode('utf-8')).hexdigest()
+    return f"{kind}:{key}" if key else None
+
+
+def create_or_join(kind='governance', rin=None, uuid=None, url=None, user=None, status='queued'):
+    # Returns (job, created). A second caller for the same invoice gets the job already
+    # in flight; the partial unique index makes this hold across gunicorn workers too
+    key = dedup_key(kind, uuid, url)
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                job = GovernanceJob.objects.create(
+                    kind=kind,
+                    rin=rin,
+                    invoice_uuid=uuid,
+                    url=url,
+                    status=status,
+                    started_at=timezone.now() if status == 'running' else None,
+                    dedup_key=key,
+                    created_by=user if user is not None and user.is_authenticated else None,
+                )
+            return job, True
+        except IntegrityError:
+            existing = GovernanceJob.objects.filter(dedup_key=key, status__in=ACTIVE_STATUSES).first()
+            if existing is not None:
+                return existing, False
+            # The other run finished between our insert and lookup; try again
+    raise IntegrityError(f"could not enqueue job for {key}")
+
+
+def queue_full():
+    return GovernanceJob.objects.filter(status='queued').count() >= settings.GOVERNANCE_MAX_QUEUED
+
+
+def enqueue(rin=None, uuid=None, url=None, user=None):
+    job, created = create_or_join('governance', rin=rin, uuid=uuid, url=url, user=user)
+    if created:
+        if settings.GOVERNANCE_INLINE_RUNNER:
+            start_runners()
+        _wakeup.set()
+    return job, created
+
+
+def wait_for(job, timeout=None):
+    timeout = timeout if timeout is not None else settings.AUTOMATION_TIMEOUT + 10
+    deadline = time.monotonic() + timeout
+    while job.status in ACTIVE_STATUSES and time.monotonic() < deadline:
+        time.sleep(0.25)
+        job.refresh_from_db()
+    return job
+
+
+def run_or_join(kind='governance', rin=None, uuid=None, url=None, user=None):
+    # Runs the job in the calling thread, or waits for the run already in flight
+    job, created = create_or_join(kind, rin=rin, uuid=uuid, url=url, user=user, status='running')
+    if created:
+        return run_job(job), True
+    return wait_for(job), False
+
+
+def stream_events(job, timeout=None):
+    # Yields the job's progress events as they are recorded, then one final "result" event
+    timeout = timeout if timeout is not None else settings.AUTOMATION_TIMEOUT + 10
+    deadline = time.monotonic() + timeout
+    sent = 0
+    while True:
+        progress = job.progress or []
+        for event in progress[sent:]:
+            yield event
+        sent = len(progress)
+        if job.status not in ACTIVE_STATUSES or time.monotonic() >= deadline:
+            break
+        time.sleep(0.25)
+        job.refresh_from_db()
+    payload, http_status = job_payload(job)
+    yield {"type": "result", "status": job.status, "http_status": http_status, "result": payload}
+
+
+def job_payload(job):
+    if job.status in ACTIVE_STATUSES:
+        return {"result_code": "timeout", "error": "انتهت مهلة انتظار المهمة الجارية"}, 504
+    return job.result, job.http_status
+
+
+def claim_next():
+    # Conditional UPDATE works the same on SQLite and Postgres: only one runner wins each row
+    candidates = GovernanceJob.objects.filter(status='queued').order_by('id').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        claimed = GovernanceJob.objects.filter(pk=job_id, status='queued').update(
+            status='running',
+            started_at=timezone.now(),
+        )
+        if claimed:
+            return GovernanceJob.objects.get(pk=job_id)
+    return None
+
+
+def progress_recorder(job):
+    # Stores the engine's step/timing events on the job as they arrive, for job_status / job_events.
+    # Events arrive on the Playwright worker thread, which has its own connection: drop it
+    # when stale before the write and when obsolete after it, like the runner loop does
+    def record(event):
+        if event['type'] == 'result':
+            return
+        job.progress = (job.progress or []) + [{k: v for k, v in event.items() if k != 'v'}]
+        close_old_connections()
+        try:
+            GovernanceJob.objects.filter(pk=job.pk).update(progress=job.progress)
+        finally:
+            close_old_connections()
+    return record
+
+
+def run_job(job):
+    on_event = progress_recorder(job)
+    try:
+        if job.kind == 'inquiry':
+            payload, http_status = run_inquiry(uuid=job.invoice_uuid, url=job.url, on_event=on_event), 200
+        else:
+            payload, http_status = govern(rin=job.rin, uuid=job.invoice_uuid, url=job.url, user=job.created_by, on_event=on_event)
+        job.status = 'done' if http_status < 500 else 'failed'
+    except Exception as e:
+        payload, http_status = {"result_code": "engine_error", "error": "حدث خطأ غير متوقع أثناء تشغيل المحرك", "details": str(e)}, 500
+        job.status = 'failed'
+    job.result = payload
+    job.result_code = payload.get('result_code')
+    job.http_status = http_status
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'result_code', 'http_status', 'finished_at'])
+    return job
+
+
+def fail_stale_jobs():
+    # Jobs left "running" by a killed worker process would otherwise never finish
+    threshold = timezone.now() - datetime.timedelta(seconds=settings.AUTOMATION_TIMEOUT * 2)
+    return GovernanceJob.objects.filter(status='running', started_at__lt=threshold).update(
+        status='failed',
+        result_code='timeout',
+        result={"result_code": "timeout", "error": "انتهت مهلة تنفيذ المهمة"},
+        http_status=504,
+        finished_at=timezone.now(),
+    )
+
+
+def work(stop_event=None, poll_interval=None):
+    poll_interval = poll_interval or settings.GOVERNANCE_JOB_POLL_INTERVAL
+    next_sweep = 0
+    while stop_event is None or not stop_event.is_set():
+        close_old_connections()
+        try:
+            # Swept on a timer, not only when idle, so a busy queue still reaps dead jobs
+            if time.monotonic() >= next_sweep:
+                fail_stale_jobs()
+                next_sweep = time.monotonic() + settings.GOVERNANCE_STALE_SWEEP_INTERVAL
+            job = claim_next()
+            if job is None:
+                _wakeup.wait(poll_interval)
+                _wakeup.clear()
+                continue
+            run_job(job)
+        except Exception as e:
+            print(f">>> JOBS: runner error: {e}")
+            _wakeup.wait(poll_interval)
+
+
+def start_runners():
+    with _runners_lock:
+        if _runners:
+            return
+        for i in range(settings.GOVERNANCE_JOB_WORKERS):
+            runner = threading.Thread(target=work, name=f"governance-job-runner-{i + 1}", daemon=True)
+            runner.start()
+            _runners.append(runner)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from invoices import heartbeat
+
+
+class Command(BaseCommand):
+    help = 'Probes every secure browser session and records readiness on AutomationSession'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Probe once, print the result and exit')
+        parser.add_argument('--interval', type=float, default=None, help='Seconds between probes')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            for probe in heartbeat.beat():
+                state = 'ready' if probe['alive'] and probe['logged_in'] else 'not ready'
+                print(f"{'✅' if state == 'ready' else '⚠️'} {probe['endpoint']}: {state} "
+                      f"(browser {probe['browser_ms']} ms, portal {probe['portal_ms']} ms) {probe['error'] or ''}")
+            return
+        print('💓 Automation heartbeat started. Press Ctrl+C to stop.')
+        try:
+            heartbeat.run(interval=options['interval'])
+        except KeyboardInterrupt:
+            print('🛑 Automation heartbeat stopped.')
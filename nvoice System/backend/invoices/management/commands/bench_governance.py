@@ -0,0 +1,143 @@
+import json
+import math
+import time
+import uuid as uuid_lib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from invoices.automation import get_engine
+
+INQUIRY_PATH = '/client/InvoiceInquiry/TempFreezeInvoice'
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks governance latency and throughput against the mock portal (engine or start_governance endpoint)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=['engine', 'api'], default='engine',
+                            help='engine: automation_engine.run_governance through the worker pool; api: POST start_governance and poll the job')
+        parser.add_argument('--concurrency', default='1,4,8', help='Comma-separated concurrency levels')
+        parser.add_argument('--count', type=int, default=40, help='Invoices per concurrency level')
+        parser.add_argument('--portal', default='http://127.0.0.1:8765', help='Base URL of `manage.py mock_portal`')
+        parser.add_argument('--share-links', action='store_true', help='Send ETA share links so the RIN extraction step is measured too')
+        parser.add_argument('--api-url', default='http://127.0.0.1:8000', help='Running API server for --target api')
+        parser.add_argument('--token', default=None, help='JWT access token for --target api (sent as "Bearer <token>")')
+        parser.add_argument('--live', action='store_true', help='Allow benchmarking a non-local portal (do not use against efinance)')
+        parser.add_argument('--json', dest='json_path', default=None, help='Also write the report to this file')
+
+    def handle(self, *args, **options):
+        portal = options['portal'].rstrip('/')
+        host = urlparse(portal).hostname
+        if host not in ('127.0.0.1', 'localhost') and not options['live']:
+            raise CommandError(f'{portal} is not local; pass --live to benchmark it anyway')
+        try:
+            levels = [int(c) for c in options['concurrency'].split(',') if c.strip()]
+        except ValueError:
+            raise CommandError('--concurrency must be a list of numbers, e.g. 1,4,8')
+
+        if options['target'] == 'engine':
+            engine = get_engine()
+            # Same effect as AUTOMATION_INQUIRY_URL / AUTOMATION_ALLOWED_HOSTS for this process
+            engine.INQUIRY_URL = portal + INQUIRY_PATH
+            if host not in engine.ALLOWED_HOSTS:
+                engine.ALLOWED_HOSTS.append(host)
+            call = self.engine_call(engine, portal, options)
+        else:
+            print(f"⚠️ The API server must run with AUTOMATION_INQUIRY_URL={portal}{INQUIRY_PATH} and AUTOMATION_ALLOWED_HOSTS={host}")
+            call = self.api_call(portal, options)
+
+        report = []
+        for concurrency in levels:
+            print(f"⏱️ {options['target']}: {options['count']} invoices at concurrency {concurrency}...")
+            if options['target'] == 'engine':
+                engine.get_pool(settings.AUTOMATION_POOL_SIZE).ensure_workers(concurrency)
+            report.append(self.run_level(call, concurrency, options['count']))
+            self.print_level(report[-1])
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as f:
+                json.dump({"target": options['target'], "portal": portal, "levels": report}, f, indent=2)
+            print(f"📝 Report written to {options['json_path']}")
+
+    def item(self, portal, options):
+        invoice_uuid = str(uuid_lib.uuid4()).upper()
+        if options['share_links']:
+            return {"url": f"{portal}/documents/{invoice_uuid}/share/bench"}
+        return {"rin": "100000001", "uuid": invoice_uuid}
+
+    def engine_call(self, engine, portal, options):
+        pool = engine.get_pool(settings.AUTOMATION_POOL_SIZE)
+
+        def call():
+            item = self.item(portal, options)
+            future = pool.submit(tax_number=item.get('rin'), invoice_uuid=item.get('uuid'), invoice_url=item.get('url'))
+            result = future.result(timeout=settings.AUTOMATION_TIMEOUT)
+            return result.get('external_status') if result.get('status') == 'success' else result.get('error_type', 'error')
+        return call
+
+    def api_call(self, portal, options):
+        api = options['api_url'].rstrip('/')
+        headers = {"Authorization": f"Bearer {options['token']}"} if options['token'] else {}
+
+        def call():
+            session = requests.Session()
+            session.headers.update(headers)
+            response = session.post(f"{api}/api/invoices/start_governance/", json=self.item(portal, options), timeout=30)
+            if response.status_code != 202:
+                return f"http_{response.status_code}"
+            status_url = response.json()['status_url']
+            deadline = time.monotonic() + settings.AUTOMATION_TIMEOUT + 30
+            while time.monotonic() < deadline:
+                job = session.get(status_url, timeout=30).json()
+                if job['status'] not in ('queued', 'running'):
+                    return job.get('result_code') or job['status']
+                time.sleep(0.1)
+            return 'poll_timeout'
+        return call
+
+    def run_level(self, call, concurrency, count):
+        latencies = []
+        outcomes = {}
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                outcome = call()
+            except Exception as e:
+                outcome = type(e).__name__
+            return (time.perf_counter() - started) * 1000, outcome
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for latency, outcome in executor.map(lambda _: timed(), range(count)):
+                latencies.append(latency)
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "concurrency": concurrency,
+            "count": count,
+            "wall_s": round(wall, 2),
+            "invoices_per_min": round(count / wall * 60, 1) if wall else None,
+            "p50_ms": round(percentile(latencies, 50)),
+            "p95_ms": round(percentile(latencies, 95)),
+            "p99_ms": round(percentile(latencies, 99)),
+            "outcomes": outcomes,
+        }
+
+    def print_level(self, level):
+        print(
+            f"   p50 {level['p50_ms']} ms | p95 {level['p95_ms']} ms | p99 {level['p99_ms']} ms | "
+            f"{level['invoices_per_min']} invoices/min | {level['outcomes']}"
+        )
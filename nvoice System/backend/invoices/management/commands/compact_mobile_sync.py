@@ -0,0 +1,59 @@
+import datetime
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from invoices.models import MobileSync
+
+
+class Command(BaseCommand):
+    help = 'Deletes (optionally archiving) processed mobile scanner links older than MOBILE_SYNC_RETENTION_DAYS, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Retention age in days (default: MOBILE_SYNC_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per DELETE (default: MOBILE_SYNC_COMPACT_BATCH)')
+        parser.add_argument('--archive', default=None, help='Append the deleted rows to this JSON-lines file first')
+        parser.add_argument('--include-unprocessed', action='store_true',
+                            help='Also drop old links nobody claimed (desks on the legacy pull never mark them processed)')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+
+    def handle(self, *args, **options):
+        days = settings.MOBILE_SYNC_RETENTION_DAYS if options['days'] is None else options['days']
+        batch_size = options['batch_size'] or settings.MOBILE_SYNC_COMPACT_BATCH
+        if days < 0 or batch_size < 1:
+            raise CommandError('--days must be >= 0 and --batch-size >= 1')
+
+        cutoff = timezone.now() - datetime.timedelta(days=days)
+        queryset = MobileSync.objects.filter(created_at__lt=cutoff)
+        if not options['include_unprocessed']:
+            queryset = queryset.filter(is_processed=True)
+
+        if options['dry_run']:
+            print(f"🧮 {queryset.count()} links older than {cutoff:%Y-%m-%d %H:%M} would be deleted")
+            return
+
+        archive = open(options['archive'], 'a', encoding='utf-8') if options['archive'] else None
+        deleted = 0
+        try:
+            while True:
+                # Walk by primary key so each batch is a short indexed DELETE ... WHERE id IN (...)
+                batch = list(queryset.order_by('id').values('id', 'url', 'client_key', 'is_processed', 'scanned_at', 'created_at')[:batch_size])
+                if not batch:
+                    break
+                if archive:
+                    for row in batch:
+                        archive.write(json.dumps(row, default=str, ensure_ascii=False) + '\n')
+                    archive.flush()
+                count, _ = MobileSync.objects.filter(id__in=[row['id'] for row in batch]).delete()
+                deleted += count
+                if options['verbosity'] > 1:
+                    print(f"   ... {deleted} deleted (up to id {batch[-1]['id']})")
+                if options['pause']:
+                    time.sleep(options['pause'])
+        finally:
+            if archive:
+                archive.close()
+
+        print(f"🧹 Deleted {deleted} mobile sync links older than {cutoff:%Y-%m-%d %H:%M}")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from invoices import dispatch
+
+
+class Command(BaseCommand):
+    help = 'Feeds scanned mobile links into governance jobs as they arrive and records each outcome on the link'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Links claimed per round (default: MOBILE_SYNC_DISPATCH_BATCH)')
+        parser.add_argument('--interval', type=float, default=None, help='Seconds to wait when nothing is pending')
+        parser.add_argument('--once', action='store_true', help='Drain what is pending, then exit')
+
+    def handle(self, *args, **options):
+        print('📲 Mobile sync dispatcher started. Press Ctrl+C to stop.')
+        try:
+            dispatch.run(interval=options['interval'], batch_size=options['batch_size'], once=options['once'])
+        except dispatch.DispatchLocked as e:
+            raise CommandError(str(e))
+        except KeyboardInterrupt:
+            print('🛑 Mobile sync dispatcher stopped.')
@@ -0,0 +1,207 @@
+import hashlib
+import html
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from django.core.management.base import BaseCommand
+
+INQUIRY_PATH = '/client/InvoiceInquiry/TempFreezeInvoice'
+UUID_PATTERN = re.compile(r'([A-Z0-9-]{36})', re.IGNORECASE)
+
+STATUS_TEXT = {
+    'accepted': 'حالة الفاتورة: مقبولة',
+    'rejected': 'حالة الفاتورة: مرفوضة',
+    'not_found': 'لم يتم العثور على الفاتورة',
+}
+
+INQUIRY_PAGE = """<!DOCTYPE html>
+<html lang="ar" dir="rtl">
+<head><meta charset="utf-8"><title>استعلام الفاتورة</title></head>
+<body>
+<form id="inquiryForm" action="{action}" method="post">
+  <input type="hidden" name="__RequestVerificationToken" value="{token}">
+  <input id="RIN" name="RIN" type="text">
+  <input id="invoiceId" name="invoiceId" type="text">
+  <button id="btnInquire" type="button">استعلام</button>
+</form>
+<div id="result"></div>
+<script>
+document.getElementById('btnInquire').addEventListener('click', function () {{
+  var form = document.getElementById('inquiryForm');
+  fetch(form.action, {{
+    method: 'POST',
+    headers: {{'X-Requested-With': 'XMLHttpRequest'}},
+    body: new URLSearchParams(new FormData(form))
+  }}).then(function (r) {{ return r.text(); }}).then(function (text) {{
+    document.getElementById('result').innerHTML = text;
+  }});
+}});
+</script>
+</body>
+</html>
+"""
+
+SHARE_PAGE = """<!DOCTYPE html>
+<html lang="ar" dir="rtl">
+<head><meta charset="utf-8"><title>فاتورة إلكترونية</title></head>
+<body>
+<table>
+  <tr><td>رقم الفاتورة</td><td id="InvoiceId">{uuid}</td></tr>
+  <tr><td>رقم التسجيل</td><td><span id="TaxRegistrationNumber">{rin}</span></td></tr>
+</table>
+</body>
+</html>
+"""
+
+
+def bucket(value, salt=''):
+    # Stable 0..99 per invoice so repeated runs see the same portal answers
+    return int(hashlib.sha1((salt + value).encode('utf-8')).hexdigest()[:8], 16) % 100
+
+
+def rin_for(uuid):
+    return str(100000000 + int(hashlib.sha1(uuid.encode('utf-8')).hexdigest()[:8], 16) % 900000000)
+
+
+class PortalHandler(BaseHTTPRequestHandler):
+    server_version = 'MockPortal/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.options['verbosity'] > 1:
+            super().log_message(format, *args)
+
+    def count(self, key):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + 1
+
+    def send_text(self, code, body, content_type='text/html; charset=utf-8', headers=None):
+        payload = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def delay(self):
+        options = self.server.options
+        latency = max(0.0, random.gauss(options['latency'], options['jitter'])) / 1000
+        time.sleep(latency)
+
+    def inject_error(self):
+        # Returns True when a fault was served instead of the real page
+        options = self.server.options
+        roll = random.random() * 100
+        if roll < options['login_rate']:
+            self.count('login')
+            self.send_text(302, '', headers={'Location': '/Account/Login'})
+            return True
+        roll -= options['login_rate']
+        if roll < options['error_rate']:
+            self.count('error')
+            self.send_text(500, 'Internal Server Error', 'text/plain; charset=utf-8')
+            return True
+        roll -= options['error_rate']
+        if roll < options['hang_rate']:
+            # Longer than the engine's result timeout, so it is seen as a timeout
+            self.count('hang')
+            time.sleep(options['hang_seconds'])
+            self.send_text(504, 'Gateway Timeout', 'text/plain; charset=utf-8')
+            return True
+        return False
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.lower().startswith('/account/login'):
+            self.send_text(200, '<html><body><form id="login"></form></body></html>')
+            return
+
+        self.delay()
+        if path == INQUIRY_PATH:
+            if self.inject_error():
+                return
+            self.count('form')
+            self.send_text(200, INQUIRY_PAGE.format(action=INQUIRY_PATH, token=self.server.token))
+            return
+
+        match = UUID_PATTERN.search(path)
+        if path.startswith('/documents/') and match:
+            if self.inject_error():
+                return
+            self.count('share')
+            uuid = match.group(0).upper()
+            self.send_text(200, SHARE_PAGE.format(uuid=html.escape(uuid), rin=rin_for(uuid)))
+            return
+
+        self.send_text(404, 'Not Found', 'text/plain; charset=utf-8')
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        if path != INQUIRY_PATH:
+            self.send_text(404, 'Not Found', 'text/plain; charset=utf-8')
+            return
+
+        self.delay()
+        if self.inject_error():
+            return
+        if form.get('__RequestVerificationToken', [''])[0] != self.server.token:
+            self.count('bad_token')
+            self.send_text(400, 'Bad Request', 'text/plain; charset=utf-8')
+            return
+
+        uuid = (form.get('invoiceId', [''])[0]).strip().upper()
+        options = self.server.options
+        roll = bucket(uuid)
+        if roll < options['accepted']:
+            status = 'accepted'
+        elif roll < options['accepted'] + options['rejected']:
+            status = 'rejected'
+        else:
+            status = 'not_found'
+        self.count(status)
+        self.send_text(200, f'<div class="inquiry-status">{STATUS_TEXT[status]}</div>')
+
+
+class Command(BaseCommand):
+    help = 'Serves an offline stand-in for the efinance inquiry form and the ETA share page (for benchmarks and tests)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=300, help='Mean response latency in ms')
+        parser.add_argument('--jitter', type=float, default=100, help='Latency standard deviation in ms')
+        parser.add_argument('--accepted', type=int, default=70, help='Percent of invoices answered as accepted')
+        parser.add_argument('--rejected', type=int, default=20, help='Percent of invoices answered as rejected (the rest are not found)')
+        parser.add_argument('--error-rate', type=float, default=0, help='Percent of requests answered with HTTP 500')
+        parser.add_argument('--login-rate', type=float, default=0, help='Percent of requests redirected to the login page')
+        parser.add_argument('--hang-rate', type=float, default=0, help='Percent of requests that hang past the engine timeout')
+        parser.add_argument('--hang-seconds', type=float, default=30)
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer((options['host'], options['port']), PortalHandler)
+        server.daemon_threads = True
+        server.options = options
+        server.token = hashlib.sha1(str(time.time()).encode('utf-8')).hexdigest()
+        server.stats = {}
+        server.stats_lock = threading.Lock()
+
+        base = f"http://{options['host']}:{options['port']}"
+        print(f'🧪 Mock portal listening on {base}')
+        print('   Point the engine at it with:')
+        print(f'   AUTOMATION_INQUIRY_URL={base}{INQUIRY_PATH}')
+        print(f"   AUTOMATION_ALLOWED_HOSTS={options['host']}")
+        print(f'   Share links: {base}/documents/<UUID>/share/mock')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print(f'🛑 Mock portal stopped. Requests served: {server.stats}')
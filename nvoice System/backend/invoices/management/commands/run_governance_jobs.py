@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from invoices import jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs the governance job queue in the foreground (use with GOVERNANCE_INLINE_RUNNER=False)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=None, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        print('🚀 Governance job runner started. Press Ctrl+C to stop.')
+        try:
+            jobs.work(poll_interval=options['poll_interval'])
+        except KeyboardInterrupt:
+            print('🛑 Governance job runner stopped.')
@@ -0,0 +1,26 @@
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from invoices.scanner import VENDOR_ASSETS, VENDOR_DIR
+
+
+class Command(BaseCommand):
+    help = 'Downloads html5-qrcode into static files for browsers without a native QR decoder (run before collectstatic)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Download again even if the file is already vendored')
+
+    def handle(self, *args, **options):
+        VENDOR_DIR.mkdir(parents=True, exist_ok=True)
+        for name, url in VENDOR_ASSETS.items():
+            target = VENDOR_DIR / name
+            if target.is_file() and not options['force']:
+                print(f'✅ {name} already vendored')
+                continue
+            try:
+                response = requests.get(url, timeout=30)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                raise CommandError(f'Could not download {url}: {e}')
+            target.write_bytes(response.content)
+            print(f'📦 {name} ({len(response.content) // 1024} KB)')
+        print(f'🎉 Scanner assets are in {VENDOR_DIR}; run collectstatic next')
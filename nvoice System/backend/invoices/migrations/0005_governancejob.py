@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('invoices', '0004_mobilesync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GovernanceJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('governance', 'Governance'), ('inquiry', 'Inquiry')], default='governance', max_length=20)),
+                ('rin', models.CharField(blank=True, max_length=50, null=True)),
+                ('invoice_uuid', models.CharField(blank=True, max_length=100, null=True)),
+                ('url', models.URLField(blank=True, max_length=1000, null=True)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('result_code', models.CharField(blank=True, max_length=50, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('http_status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='governance_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0005_governancejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='governancejob',
+            name='dedup_key',
+            field=models.CharField(blank=True, max_length=120, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='governancejob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('dedup_key',), name='unique_active_governance_job'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0006_governancejob_dedup_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='governancejob',
+            name='progress',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
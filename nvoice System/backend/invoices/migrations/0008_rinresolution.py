@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0007_governancejob_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RinResolution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('invoice_uuid', models.CharField(max_length=100, unique=True)),
+                ('rin', models.CharField(max_length=50)),
+                ('source', models.CharField(choices=[('engine', 'Engine'), ('invoice', 'Invoice')], default='engine', max_length=20)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0009_automationsession_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mobilesync',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='mobilesync',
+            index=models.Index(fields=['is_processed', 'id'], name='mobilesync_claim_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0010_mobilesync_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mobilesync',
+            name='client_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='mobilesync',
+            name='scanned_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:40
+
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+from django.db import migrations, models
+
+# Frozen copies of invoices.mobile_sync.url_hash/dedup_bucket as they were when this ran,
+# so later changes to the app code never alter (or break) the backfill
+BACKFILL_BATCH = 1000
+DEDUP_WINDOW_SECONDS = 10
+
+
+def url_hash(url):
+    parts = urlsplit(url.strip())
+    normalized = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def dedup_bucket(when):
+    return int(when.timestamp() // DEDUP_WINDOW_SECONDS)
+
+
+def backfill_url_hash(apps, schema_editor):
+    MobileSync = apps.get_model('invoices', 'MobileSync')
+    seen = set()
+    batch = []
+    for row in MobileSync.objects.order_by('id').only('id', 'url', 'created_at').iterator(chunk_size=BACKFILL_BATCH):
+        key = (url_hash(row.url), dedup_bucket(row.created_at))
+        # Old rows may hold the same link twice in one window; only the first gets a bucket
+        row.url_hash, row.dedup_bucket = key[0], (key[1] if key not in seen else None)
+        seen.add(key)
+        batch.append(row)
+        if len(batch) >= BACKFILL_BATCH:
+            MobileSync.objects.bulk_update(batch, ['url_hash', 'dedup_bucket'])
+            batch = []
+    if batch:
+        MobileSync.objects.bulk_update(batch, ['url_hash', 'dedup_bucket'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0011_mobilesync_client_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mobilesync',
+            name='dedup_bucket',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mobilesync',
+            name='url_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_url_hash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='mobilesync',
+            index=models.Index(fields=['url_hash', 'created_at'], name='mobilesync_url_hash_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='mobilesync',
+            constraint=models.UniqueConstraint(fields=('url_hash', 'dedup_bucket'), name='unique_mobilesync_push_window'),
+        ),
+    ]
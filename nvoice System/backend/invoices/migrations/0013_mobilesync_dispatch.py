@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0012_mobilesync_url_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mobilesync',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mobilesync',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mobile_links', to='invoices.governancejob'),
+        ),
+        migrations.AddField(
+            model_name='mobilesync',
+            name='result_code',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+    ]
@@ -0,0 +1,369 @@
+import base64
+import datetime
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import MobileSync
+
+# Same spam guard as the single push: a URL seen this recently is not stored again
+PUSH_DEDUP_WINDOW = datetime.timedelta(seconds=10)
+
+
+def normalize_url(url):
+    # Scheme and host are case-insensitive and the fragment never reaches the server
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+
+def url_hash(url):
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+def dedup_bucket(when):
+    # The (url_hash, dedup_bucket) unique constraint keeps two concurrent pushes of the
+    # same link out of one window even when both pass the lookup below
+    return int(when.timestamp() // PUSH_DEDUP_WINDOW.total_seconds())
+
+
+def new_link(url, client_key=None, scanned_at=None):
+    return MobileSync(
+        url=url, client_key=client_key, scanned_at=scanned_at,
+        url_hash=url_hash(url), dedup_bucket=dedup_bucket(timezone.now())
+    )
+
+
+def recent_duplicates(hashes):
+    return MobileSync.objects.filter(url_hash__in=hashes, created_at__gte=timezone.now() - PUSH_DEDUP_WINDOW)
+
+
+def push(url):
+    # Returns (row, created)
+    hashed = url_hash(url)
+    recent = recent_duplicates([hashed]).order_by('id').first()
+    if recent is not None:
+        return recent, False
+    obj = new_link(url)
+    try:
+        with transaction.atomic():
+            obj.save()
+    except IntegrityError:
+        return MobileSync.objects.filter(url_hash=hashed, dedup_bucket=obj.dedup_bucket).first(), False
+    notify()
+    return obj, True
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(f"mobile-sync:{last_id}".encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        prefix, _, last_id = raw.partition(':')
+        if prefix != 'mobile-sync':
+            raise ValueError(raw)
+        return int(last_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+
+def initial_since():
+    # A desk that just opened starts at the legacy 5-minute window, not at the whole history
+    threshold = timezone.now() - datetime.timedelta(minutes=5)
+    last_old = MobileSync.objects.filter(created_at__lt=threshold).order_by('-id').values_list('id', flat=True).first()
+    return last_old or 0
+
+
+def claim_row(row):
+    # Conditional UPDATE (same as the job queue): exactly one caller wins each row
+    if not MobileSync.objects.filter(pk=row.pk, is_processed=False).update(is_processed=True):
+        return False
+    row.is_processed = True
+    return True
+
+
+def release_row(row):
+    MobileSync.objects.filter(pk=row.pk).update(is_processed=False)
+    row.is_processed = False
+
+
+def pull(since, limit=None, claim=False):
+    # Returns (rows, next_since). With claim=True every row goes to exactly one caller.
+    # Delivery is at most once: rows are claimed before the response is written, so a desk
+    # that drops the answer loses them (they still show in plain pulls and the dashboard list)
+    # A negative slice would fail inside the ORM; callers validate, this only guards
+    limit = max(1, min(limit or settings.MOBILE_SYNC_PULL_LIMIT, settings.MOBILE_SYNC_PULL_LIMIT))
+    queryset = MobileSync.objects.filter(id__gt=since)
+    if claim:
+        queryset = queryset.filter(is_processed=False)
+    rows = list(queryset.order_by('id')[:limit])
+    if not rows:
+        return [], since
+
+    next_since = rows[-1].id
+    if claim:
+        rows = [row for row in rows if claim_row(row)]
+    return rows, next_since
+
+
+# Long-polls and SSE streams sleep on this condition. A push in this process wakes them at
+# once; pushes stored by other processes are seen by one watcher thread per process, which
+# checks the newest id every MOBILE_SYNC_WATCH_INTERVAL seconds while anyone is waiting, so
+# idle subscribers cost one cheap query per process instead of one per open tab
+_new_link = threading.Condition()
+_generation = 0
+_waiters = 0
+_watcher = None
+
+# Each held request (SSE stream or long-poll) ties up a server thread; beyond this many per
+# process, long-polls answer at once and new streams are refused so the API keeps threads
+_held = threading.BoundedSemaphore(settings.MOBILE_SYNC_MAX_HELD)
+
+
+class SubscribersFull(Exception):
+    pass
+
+
+def notify():
+    global _generation
+    with _new_link:
+        _generation += 1
+        _new_link.notify_all()
+
+
+def wait_for_push(timeout):
+    with _new_link:
+        _new_link.wait(timeout)
+
+
+def latest_id():
+    return MobileSync.objects.order_by('-id').values_list('id', flat=True).first()
+
+
+def watch():
+    global _watcher
+    try:
+        latest = latest_id()
+        # A link stored while the first waiter was querying would otherwise wait a whole timeout
+        notify()
+        while True:
+            time.sleep(settings.MOBILE_SYNC_WATCH_INTERVAL)
+            with _new_link:
+                if not _waiters:
+                    _watcher = None
+                    return
+            current = latest_id()
+            if current != latest:
+                latest = current
+                notify()
+    finally:
+        connection.close()
+
+
+@contextmanager
+def waiting():
+    global _waiters, _watcher
+    with _new_link:
+        _waiters += 1
+        if _watcher is None:
+            _watcher = threading.Thread(target=watch, name="mobile-sync-watcher", daemon=True)
+            _watcher.start()
+    try:
+        yield
+    finally:
+        with _new_link:
+            _waiters -= 1
+
+
+@contextmanager
+def held_slot():
+    # Yields whether this request may hold its thread
+    acquired = _held.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            _held.release()
+
+
+def wait_for_links(since, timeout, limit=None, claim=False):
+    # Long-poll: returns as soon as there is something newer than `since`, or after timeout
+    deadline = time.monotonic() + timeout
+    with waiting():
+        while True:
+            with _new_link:
+                generation = _generation
+            rows, next_since = pull(since, limit=limit, claim=claim)
+            remaining = deadline - time.monotonic()
+            if rows or remaining <= 0:
+                return rows, next_since
+            since = next_since
+            with _new_link:
+                # Nothing new since our query: sleep until the next push or watcher tick
+                if _generation == generation:
+                    _new_link.wait(remaining)
+
+
+def event_stream(since, claim=False):
+    # Server-Sent Events; the connection is recycled after a while and the browser's
+    # EventSource reconnects on its own, resuming from Last-Event-ID
+    yield "retry: 3000\n\n"
+    deadline = time.monotonic() + settings.MOBILE_SYNC_STREAM_LIFETIME
+    while time.monotonic() < deadline:
+        # Claimed one row at a time as it is written, never a whole batch up front
+        rows, since = wait_for_links(since, settings.MOBILE_SYNC_LONG_POLL_TIMEOUT)
+        if not rows:
+            yield ": keepalive\n\n"
+            continue
+        for row in rows:
+            if claim and not claim_row(row):
+                continue
+            # Per-row id, so a reconnect in the middle of a batch resumes after the last row seen
+            data = json.dumps({"id": row.id, "url": row.url, "created_at": row.created_at.isoformat()}, ensure_ascii=False)
+            try:
+                yield f"id: {encode_cursor(row.id)}\nevent: link\ndata: {data}\n\n"
+            except GeneratorExit:
+                # The server closes us here only when it could not write this event: the
+                # desk went away, so the link goes back to the next desk or the dispatcher
+                if claim:
+                    release_row(row)
+                raise
+
+
+class HeldStream:
+    # Streaming body that holds one of the process's held-thread slots until Django closes it
+    def __init__(self, events):
+        if not _held.acquire(blocking=False):
+            raise SubscribersFull()
+        self.events = events
+        self.released = False
+
+    def __iter__(self):
+        return self.events
+
+    def close(self):
+        self.events.close()
+        if not self.released:
+            self.released = True
+            _held.release()
+
+
+class LinkStream(HeldStream):
+    # SSE body of new links
+    def __init__(self, since, claim=False):
+        super().__init__(event_stream(since, claim=claim))
+
+
+def parse_scanned_at(value):
+    # ISO string or epoch milliseconds (Date.now() on the phone)
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+    parsed = parse_datetime(str(value))
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def parse_push_item(item):
+    # Returns (url, key, scanned_at) or raises ValueError with the reason
+    if isinstance(item, str):
+        item = {"url": item}
+    if not isinstance(item, dict):
+        raise ValueError("item must be a URL or an object")
+    url = item.get('url')
+    if not isinstance(url, str):
+        raise ValueError("invalid url")
+    url = url.strip()
+    # As loose as the single push: any http(s) link that fits the column
+    if not url.lower().startswith(('http://', 'https://')) or len(url) > 1000:
+        raise ValueError("invalid url")
+    key = item.get('key') or item.get('client_key')
+    key = str(key)[:64] if key else None
+    try:
+        scanned_at = parse_scanned_at(item.get('scanned_at'))
+    except (TypeError, ValueError, OverflowError, OSError):
+        # OSError: epoch values the platform's clock cannot represent (e.g. 1e20)
+        raise ValueError("invalid scanned_at")
+    return url, key, scanned_at
+
+
+def push_batch(items):
+    # One lookup for every key/URL already stored, one bulk INSERT for the rest.
+    # Returns one result per item, in order
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, *parse_push_item(item)))
+        except ValueError as e:
+            results[index] = {"index": index, "status": "invalid", "error": str(e)}
+
+    keys = {key for _, _, key, _ in parsed if key}
+    hashes = {url_hash(url) for _, url, _, _ in parsed}
+    window_start = timezone.now() - PUSH_DEDUP_WINDOW
+    existing = MobileSync.objects.filter(
+        Q(client_key__in=keys) | Q(pk__in=recent_duplicates(hashes).values('pk'))
+    ).values_list('id', 'url_hash', 'client_key', 'created_at')
+    by_key = {key: pk for pk, _, key, _ in existing if key}
+    # Rows found only through their key may be old; the same URL counts as a repeat only
+    # inside the dedup window
+    by_hash = {hashed: pk for pk, hashed, _, created_at in existing if hashed in hashes and created_at >= window_start}
+
+    to_create = []
+    in_batch = {}
+    for index, url, key, scanned_at in parsed:
+        obj = new_link(url, client_key=key, scanned_at=scanned_at)
+        seen = (by_key.get(key) if key else None) or by_hash.get(obj.url_hash)
+        first = in_batch.get(key) if key in in_batch else in_batch.get(obj.url_hash)
+        if seen:
+            results[index] = {"index": index, "key": key, "status": "duplicate", "id": seen}
+        elif first is not None:
+            # Repeated inside this batch
+            results[index] = {"index": index, "key": key, "status": "duplicate", "ref": first}
+        else:
+            in_batch[obj.url_hash] = index
+            if key:
+                in_batch[key] = index
+            to_create.append((index, obj))
+
+    try:
+        with transaction.atomic():
+            MobileSync.objects.bulk_create([obj for _, obj in to_create])
+        outcomes = [(obj, "created") for _, obj in to_create]
+    except IntegrityError:
+        # Another request stored one of these keys or URLs in the meantime; fall back row by row
+        outcomes = []
+        for _, obj in to_create:
+            try:
+                with transaction.atomic():
+                    obj.save()
+                outcomes.append((obj, "created"))
+            except IntegrityError:
+                clash = Q(url_hash=obj.url_hash, dedup_bucket=obj.dedup_bucket)
+                if obj.client_key:
+                    clash |= Q(client_key=obj.client_key)
+                outcomes.append((MobileSync.objects.filter(clash).order_by('id').first(), "duplicate"))
+
+    for (index, obj), (stored, status) in zip(to_create, outcomes):
+        results[index] = {"index": index, "key": obj.client_key, "status": status, "id": stored.id if stored else None}
+    # In-batch repeats point at the row their first occurrence created
+    for result in results:
+        if result and "ref" in result:
+            result["id"] = results[result.pop("ref")].get("id")
+    if any(status == "created" for _, status in outcomes):
+        notify()
+    return results
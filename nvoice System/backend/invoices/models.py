@@ -33,19 +33,31 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Cursor pagination of the invoice list, unfiltered and by status
+            models.Index(fields=['-created_at', '-id'], name='invoice_list_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='invoice_status_list_idx'),
+        ]
+
     def __str__(self):
         return f"{self.invoice_id} - {self.company.name}"
 
 class AutomationSession(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     start_time = models.DateTimeField(auto_now_add=True)
     end_time = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     otp_verified = models.BooleanField(default=False)
     last_heartbeat = models.DateTimeField(auto_now=True)
+    # Written by the heartbeat: one row per secure browser (CDP endpoint)
+    endpoint = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    browser_latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    portal_latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
 
     def __str__(self):
-        return f"Session {self.id} for {self.user.username}"
+        return f"Session {self.id} for {self.user.username if self.user else self.endpoint}"
 
 class AuditLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -58,8 +70,89 @@ class AuditLog(models.Model):
 
 class MobileSync(models.Model):
     url = models.URLField(max_length=1000)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     is_processed = models.BooleanField(default=False)
+    # Set by the scanner's offline queue: idempotency key and when the code was scanned
+    client_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    scanned_at = models.DateTimeField(null=True, blank=True)
+    # sha256 of the normalized URL and the 10-second window it was pushed in; the pair is
+    # unique, so the push spam guard holds in the database and never scans the long url column
+    url_hash = models.CharField(max_length=64, null=True, blank=True)
+    dedup_bucket = models.BigIntegerField(null=True, blank=True)
+    # Set by dispatch_mobile_sync: the governance job the link was fed into and how it ended
+    job = models.ForeignKey('GovernanceJob', on_delete=models.SET_NULL, null=True, blank=True, related_name='mobile_links')
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    result_code = models.CharField(max_length=50, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Cursor pull with claim: WHERE is_processed = false AND id > cursor ORDER BY id
+            models.Index(fields=['is_processed', 'id'], name='mobilesync_claim_idx'),
+            models.Index(fields=['url_hash', 'created_at'], name='mobilesync_url_hash_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['url_hash', 'dedup_bucket'], name='unique_mobilesync_push_window'),
+        ]
 
     def __str__(self):
         return self.url
+
+class GovernanceJob(models.Model):
+    KIND_CHOICES = [
+        ('governance', 'Governance'),
+        ('inquiry', 'Inquiry'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='governance')
+    rin = models.CharField(max_length=50, null=True, blank=True)
+    invoice_uuid = models.CharField(max_length=100, null=True, blank=True)
+    url = models.URLField(max_length=1000, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    result_code = models.CharField(max_length=50, null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    http_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    # Engine step/timing events, appended live while the job runs
+    progress = models.JSONField(default=list, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='governance_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # kind + normalized invoice UUID; at most one queued/running job per key (single-flight)
+    dedup_key = models.CharField(max_length=120, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_governance_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.kind}) - {self.status}"
+
+
+class RinResolution(models.Model):
+    # Invoice UUID -> issuer RIN learned from earlier runs, so a share URL we have
+    # seen before goes straight to the inquiry step without opening the ETA page
+    SOURCE_CHOICES = [
+        ('engine', 'Engine'),
+        ('invoice', 'Invoice'),
+    ]
+
+    invoice_uuid = models.CharField(max_length=100, unique=True)
+    rin = models.CharField(max_length=50)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='engine')
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.invoice_uuid} -> {self.rin}"
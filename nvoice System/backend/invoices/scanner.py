@@ -0,0 +1,40 @@
+import hashlib
+from pathlib import Path
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+# The scanner decodes with the browser's own BarcodeDetector and uses system Arabic fonts, so
+# it needs nothing from the internet. Browsers without BarcodeDetector load html5-qrcode when
+# scanning starts, only from this origin: the copy `manage.py vendor_scanner_assets` stores
+# here at build time. Without it they fall back to typing the link by hand
+VENDOR_DIR = Path(__file__).resolve().parent / 'static' / 'invoices' / 'scanner' / 'vendor'
+VENDOR_ASSETS = {
+    'html5-qrcode.min.js': 'https://cdn.jsdelivr.net/npm/html5-qrcode@2.3.8/html5-qrcode.min.js',
+}
+
+_page = None
+
+
+def vendored():
+    return all((VENDOR_DIR / name).is_file() for name in VENDOR_ASSETS)
+
+
+def render_page():
+    # The HTML only changes on deploy (new hashed asset names), so it is rendered once per process
+    global _page
+    if _page is None or settings.DEBUG:
+        html = render_to_string('invoices/push_page.html', {'vendored': vendored()})
+        _page = (html.encode('utf-8'), '"%s"' % hashlib.sha1(html.encode('utf-8')).hexdigest())
+    return _page
+
+
+def page_response(request):
+    content, etag = render_page()
+    # Phones revalidate the small HTML (a 304 when nothing changed); the CSS/JS/fonts it
+    # links are hashed static files that WhiteNoise serves compressed with a far-future expiry
+    response = get_conditional_response(request, etag=etag) or HttpResponse(content)
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Invoice, Company, MobileSync
+from .models import Invoice, Company, MobileSync, GovernanceJob
 
 class CompanySerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,3 +19,10 @@ class MobileSyncSerializer(serializers.ModelSerializer):
     class Meta:
         model = MobileSync
         fields = '__all__'
+
+class GovernanceJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.ReadOnlyField(source='id')
+
+    class Meta:
+        model = GovernanceJob
+        fields = ['job_id', 'kind', 'status', 'result_code', 'http_status', 'result', 'progress', 'rin', 'invoice_uuid', 'url', 'created_at', 'started_at', 'finished_at']
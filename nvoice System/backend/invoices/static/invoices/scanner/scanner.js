@@ -0,0 +1,185 @@
+const toast = document.getElementById('toast');
+const connStatus = document.getElementById('connStatus');
+
+// Check connection every 5 seconds
+async function checkConnection() {
+    try {
+        const res = await fetch(window.location.origin + '/api/mobile-sync/pull/?cursor=&limit=1');
+        if(res.ok) connStatus.innerHTML = "🟢 متصل بالسيرفر المركزي";
+        else connStatus.innerHTML = "🔴 خطأ في الاستجابة (" + res.status + ")";
+    } catch(e) {
+        connStatus.innerHTML = "🔴 غير متصل بالكمبيوتر (تأكد من الـ WiFi)";
+    }
+}
+checkConnection();
+setInterval(checkConnection, 10000);
+
+function showToast(count) {
+    toast.innerText = count > 0 ? `✅ تم الإرسال! (في الانتظار: ${count})` : "✅ تم الإرسال والمزامنة!";
+    toast.style.display = 'block';
+    if(window.navigator.vibrate) window.navigator.vibrate([100, 50, 100]);
+    setTimeout(() => { toast.style.display = 'none'; }, 4000);
+}
+
+// Offline queue: every scan is stored on the phone first and flushed in
+// batches, so nothing is lost while the warehouse Wi-Fi is down
+const QUEUE_KEY = 'zahran_scan_queue';
+let flushing = null;
+
+function loadQueue() {
+    try { return JSON.parse(localStorage.getItem(QUEUE_KEY)) || []; } catch(e) { return []; }
+}
+
+function saveQueue(queue) {
+    localStorage.setItem(QUEUE_KEY, JSON.stringify(queue));
+}
+
+async function sendQueue() {
+    try {
+        let queue = loadQueue();
+        while(queue.length > 0) {
+            const batch = queue.slice(0, 50);
+            const response = await fetch(window.location.origin + '/api/mobile-sync/push_batch/', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ items: batch })
+            });
+            if(!response.ok) break;
+            // Every item got an answer (created, duplicate or invalid): drop them
+            const sent = new Set(batch.map(item => item.key));
+            queue = loadQueue().filter(item => !sent.has(item.key));
+            saveQueue(queue);
+        }
+        return queue.length;
+    } catch(e) {
+        return loadQueue().length;
+    }
+}
+
+function flushQueue() {
+    // A scan queued while a flush is running waits for it, then goes out in the next one,
+    // so the caller always learns how many scans are still pending
+    if(flushing) return flushing.then(() => flushQueue());
+    flushing = sendQueue().finally(() => { flushing = null; });
+    return flushing;
+}
+
+async function sendToBackend(url) {
+    const queue = loadQueue();
+    queue.push({
+        url: url,
+        key: Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 10),
+        scanned_at: new Date().toISOString()
+    });
+    saveQueue(queue);
+    const pending = await flushQueue();
+    if(pending > 0) connStatus.innerHTML = "🟠 غير متصل - في الانتظار: " + pending;
+    showToast(pending);
+    return true;
+}
+
+window.addEventListener('online', flushQueue);
+setInterval(flushQueue, 5000);
+flushQueue();
+
+// Chrome on Android decodes QR codes natively, so the page needs no library and no
+// internet; other browsers load the vendored html5-qrcode from this server when scanning starts
+const reader = document.getElementById('reader');
+
+function loadScript(src) {
+    return new Promise((resolve, reject) => {
+        const script = document.createElement('script');
+        script.src = src;
+        script.onload = resolve;
+        script.onerror = reject;
+        document.body.appendChild(script);
+    });
+}
+
+async function nativeScanner(onScan) {
+    const detector = new BarcodeDetector({ formats: ['qr_code'] });
+    const video = document.createElement('video');
+    video.setAttribute('playsinline', '');
+    video.muted = true;
+    video.srcObject = await navigator.mediaDevices.getUserMedia({ video: { facingMode: 'environment' } });
+    reader.appendChild(video);
+    await video.play();
+
+    let paused = false;
+    const tick = async () => {
+        if(!paused && video.readyState >= 2) {
+            try {
+                const codes = await detector.detect(video);
+                if(codes.length > 0) onScan(codes[0].rawValue);
+            } catch(e) { /* silent errors */ }
+        }
+        setTimeout(tick, 1000 / 15);
+    };
+    tick();
+    return { pause: () => { paused = true; }, resume: () => { paused = false; } };
+}
+
+async function libraryScanner(onScan) {
+    if(!window.Html5Qrcode) {
+        // Not vendored on this server: there is no decoder to load
+        if(!reader.dataset.fallback) throw new Error('no-decoder');
+        await loadScript(reader.dataset.fallback);
+    }
+    const html5QrCode = new Html5Qrcode("reader");
+    const config = {
+        fps: 15,
+        qrbox: (viewfinderWidth, viewfinderHeight) => {
+            return {
+                width: viewfinderWidth * 0.7,
+                height: viewfinderWidth * 0.7
+            };
+        },
+        aspectRatio: 1.0
+    };
+    await html5QrCode.start({ facingMode: "environment" }, config, onScan, (errorMessage) => { /* silent errors */ });
+    return { pause: () => html5QrCode.pause(), resume: () => html5QrCode.resume() };
+}
+
+async function createScanner(onScan) {
+    if('BarcodeDetector' in window) {
+        const formats = await BarcodeDetector.getSupportedFormats();
+        if(formats.includes('qr_code')) return nativeScanner(onScan);
+    }
+    return libraryScanner(onScan);
+}
+
+async function initScanner() {
+    document.getElementById('startBtn').style.display = 'none';
+    reader.style.display = 'block';
+
+    let scanner = null;
+    let busy = false;
+    try {
+        scanner = await createScanner(async (decodedText) => {
+            if(busy) return;
+            busy = true;
+            // Action on detection
+            if(window.navigator.vibrate) window.navigator.vibrate(50);
+
+            const success = await sendToBackend(decodedText);
+            if(success) {
+                scanner.pause();
+                setTimeout(() => { scanner.resume(); busy = false; }, 4000);
+            } else {
+                busy = false;
+            }
+        });
+    } catch(err) {
+        if(err && err.message === 'no-decoder') alert("⚠️ هذا المتصفح لا يدعم قراءة رموز QR. يرجى إدخال الرابط يدوياً.");
+        else alert("⚠️ تنبيه أمني: المتصفح يمنع الكاميرا على الروابط غير المؤمنة (HTTP).\n\nللمتابعة، يرجى استخدام متصفح مغاير أو السماح للكاميرا من إعدادات الموقع.");
+        document.getElementById('startBtn').style.display = 'flex';
+        reader.style.display = 'none';
+    }
+}
+
+async function sendManual() {
+    const input = document.getElementById('manualUrl');
+    if(!input.value.trim()) return;
+    const success = await sendToBackend(input.value.trim());
+    if(success) input.value = '';
+}
@@ -1,3 +1,857 @@
-from django.test import TestCase
+import contextlib
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .models import AutomationSession, Company, GovernanceJob, Invoice, MobileSync, RinResolution
+from . import automation, breaker, dispatch, heartbeat, jobs, mobile_sync, scanner
 
-# Create your tests here.
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'breaker': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-breaker'},
+}
+INVOICE_UUID = 'ABCDEFGH-1234-5678-9ABC-DEF012345678'
+SHARE_URL = f'https://invoicing.eta.gov.eg/print/documents/{INVOICE_UUID.lower()}/share/abc'
+
+
+class JobsTests(TestCase):
+    def test_second_caller_joins_the_job_in_flight(self):
+        first, created = jobs.create_or_join('inquiry', uuid=INVOICE_UUID)
+        second, joined_created = jobs.create_or_join('inquiry', uuid=INVOICE_UUID.lower())
+        self.assertTrue(created)
+        self.assertFalse(joined_created)
+        self.assertEqual(first.pk, second.pk)
+
+    def test_finished_job_is_not_joined(self):
+        first, _ = jobs.create_or_join('inquiry', uuid=INVOICE_UUID)
+        GovernanceJob.objects.filter(pk=first.pk).update(status='done')
+        second, created = jobs.create_or_join('inquiry', uuid=INVOICE_UUID)
+        self.assertTrue(created)
+        self.assertNotEqual(first.pk, second.pk)
+
+    def test_kinds_do_not_share_jobs(self):
+        inquiry, _ = jobs.create_or_join('inquiry', uuid=INVOICE_UUID)
+        governance, created = jobs.create_or_join('governance', uuid=INVOICE_UUID)
+        self.assertTrue(created)
+        self.assertNotEqual(inquiry.pk, governance.pk)
+
+    @mock.patch('invoices.jobs.run_inquiry')
+    def test_run_or_join_runs_in_the_calling_thread(self, run_inquiry):
+        run_inquiry.return_value = {"status": "success", "external_status": "accepted"}
+        job, created = jobs.run_or_join('inquiry', uuid=INVOICE_UUID)
+        self.assertTrue(created)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(jobs.job_payload(job), (run_inquiry.return_value, 200))
+        run_inquiry.assert_called_once()
+
+    @mock.patch('invoices.jobs.run_inquiry')
+    def test_run_or_join_waits_for_the_run_in_flight(self, run_inquiry):
+        running, _ = jobs.create_or_join('inquiry', uuid=INVOICE_UUID, status='running')
+        with mock.patch('invoices.jobs.wait_for', side_effect=lambda job: job) as wait_for:
+            job, created = jobs.run_or_join('inquiry', uuid=INVOICE_UUID)
+        self.assertFalse(created)
+        self.assertEqual(job.pk, running.pk)
+        wait_for.assert_called_once()
+        run_inquiry.assert_not_called()
+
+    @mock.patch('invoices.jobs.run_inquiry', side_effect=RuntimeError('boom'))
+    def test_engine_crash_fails_the_job(self, run_inquiry):
+        job, _ = jobs.run_or_join('inquiry', uuid=INVOICE_UUID)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.http_status, 500)
+        self.assertEqual(job.result_code, 'engine_error')
+
+    def test_progress_write_refreshes_the_worker_connection(self):
+        job, _ = jobs.create_or_join('inquiry', uuid=INVOICE_UUID, status='running')
+        record = jobs.progress_recorder(job)
+        with mock.patch('invoices.jobs.close_old_connections') as close_old:
+            record({"type": "step", "step": "open", "v": 1})
+            record({"type": "result", "status": "success"})
+        self.assertEqual(close_old.call_count, 2)
+        job.refresh_from_db()
+        self.assertEqual(job.progress, [{"type": "step", "step": "open"}])
+
+    def test_job_events_streams_then_frees_its_slot(self):
+        job, _ = jobs.create_or_join('inquiry', uuid=INVOICE_UUID, status='done')
+        GovernanceJob.objects.filter(pk=job.pk).update(result={"status": "success"}, http_status=200)
+        held = threading.BoundedSemaphore(1)
+        with mock.patch.object(mobile_sync, '_held', held):
+            response = self.client.get(f'/api/invoices/jobs/{job.pk}/events/')
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+            response.close()
+            self.assertTrue(held.acquire(blocking=False))
+        self.assertEqual(lines[-1]["type"], "result")
+        self.assertEqual(lines[-1]["result"], {"status": "success"})
+
+    def test_job_events_refused_when_slots_are_taken(self):
+        job, _ = jobs.create_or_join('inquiry', uuid=INVOICE_UUID, status='running')
+        with mock.patch.object(mobile_sync, '_held', threading.BoundedSemaphore(1)) as held:
+            held.acquire()
+            response = self.client.get(f'/api/invoices/jobs/{job.pk}/events/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+
+class MobileSyncPushBatchTests(TestCase):
+    def test_creates_and_reports_in_order(self):
+        results = mobile_sync.push_batch([
+            {"url": "https://example.com/a", "key": "k1"},
+            "not a url",
+            {"url": "https://example.com/b", "key": "k2"},
+        ])
+        self.assertEqual([r["status"] for r in results], ["created", "invalid", "created"])
+        self.assertEqual(MobileSync.objects.count(), 2)
+        self.assertEqual(MobileSync.objects.get(pk=results[0]["id"]).client_key, "k1")
+
+    def test_replayed_keys_are_duplicates(self):
+        first = mobile_sync.push_batch([{"url": "https://example.com/a", "key": "k1"}])
+        again = mobile_sync.push_batch([{"url": "https://example.com/other", "key": "k1"}])
+        self.assertEqual(again[0]["status"], "duplicate")
+        self.assertEqual(again[0]["id"], first[0]["id"])
+        self.assertEqual(MobileSync.objects.count(), 1)
+
+    def test_repeats_inside_a_batch_point_at_the_first(self):
+        results = mobile_sync.push_batch(["https://example.com/a", "HTTPS://EXAMPLE.COM/a#frag"])
+        self.assertEqual([r["status"] for r in results], ["created", "duplicate"])
+        self.assertEqual(results[1]["id"], results[0]["id"])
+
+    def test_malformed_items_do_not_fail_the_batch(self):
+        results = mobile_sync.push_batch([
+            {"url": 123},
+            {"url": "https://example.com/a", "scanned_at": 1e20},
+            {"url": "https://example.com/b", "scanned_at": "yesterday-ish"},
+            {"url": "https://example.com/c", "scanned_at": 1700000000000},
+        ])
+        self.assertEqual([r["status"] for r in results], ["invalid", "invalid", "created", "created"])
+        self.assertEqual(results[1]["error"], "invalid scanned_at")
+
+    def test_old_row_matched_by_key_does_not_dedup_the_url(self):
+        old = mobile_sync.push_batch([{"url": "https://example.com/a", "key": "k1"}])[0]
+        pushed_at = timezone.now() - datetime.timedelta(minutes=5)
+        MobileSync.objects.filter(pk=old["id"]).update(created_at=pushed_at, dedup_bucket=mobile_sync.dedup_bucket(pushed_at))
+        results = mobile_sync.push_batch([
+            {"url": "https://example.com/a", "key": "k1"},
+            {"url": "https://example.com/a", "key": "k2"},
+        ])
+        self.assertEqual([r["status"] for r in results], ["duplicate", "created"])
+        self.assertEqual(results[0]["id"], old["id"])
+
+    def test_race_loser_is_reported_as_duplicate(self):
+        # A concurrent request stored the same link after our lookup ran
+        stored = mobile_sync.new_link("https://example.com/a")
+        stored.save()
+        with mock.patch('invoices.mobile_sync.recent_duplicates', return_value=MobileSync.objects.none()):
+            results = mobile_sync.push_batch(["https://example.com/a", "https://example.com/b"])
+        self.assertEqual(results[0], {"index": 0, "key": None, "status": "duplicate", "id": stored.id})
+        self.assertEqual(results[1]["status"], "created")
+        self.assertEqual(MobileSync.objects.count(), 2)
+
+
+def engine_answer(external_status, rin='100200300'):
+    return {"status": "success", "external_status": external_status, "rin": rin, "uuid": INVOICE_UUID, "detected_by": "response"}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RinResolutionTests(TestCase):
+    def test_resolve_unknown_uuid(self):
+        self.assertIsNone(automation.resolve_rin(INVOICE_UUID))
+        self.assertIsNone(automation.resolve_rin(''))
+
+    def test_remember_then_resolve_counts_hits(self):
+        automation.remember_rin(INVOICE_UUID.lower(), ' 100200300 ')
+        self.assertEqual(automation.resolve_rin(INVOICE_UUID), '100200300')
+        entry = RinResolution.objects.get(invoice_uuid=INVOICE_UUID)
+        self.assertEqual((entry.rin, entry.source, entry.hits), ('100200300', 'engine', 1))
+
+    def test_backfills_from_governed_invoices(self):
+        company = Company.objects.create(name='Acme', tax_registration_number='555666777')
+        Invoice.objects.create(invoice_id=INVOICE_UUID.lower(), company=company, url=SHARE_URL)
+        self.assertEqual(automation.resolve_rin(INVOICE_UUID), '555666777')
+        self.assertEqual(RinResolution.objects.get(invoice_uuid=INVOICE_UUID).source, 'invoice')
+
+    @mock.patch('invoices.automation.call_engine')
+    def test_learns_only_confirmed_pairs(self, call_engine):
+        for external_status in ('not_found', 'غير معروف'):
+            call_engine.return_value = engine_answer(external_status, rin='9')
+            automation.run_automation(url=SHARE_URL, inquiry=True)
+        self.assertFalse(RinResolution.objects.exists())
+        call_engine.return_value = engine_answer('accepted')
+        automation.run_automation(url=SHARE_URL, inquiry=True)
+        self.assertEqual(RinResolution.objects.get(invoice_uuid=INVOICE_UUID).rin, '100200300')
+
+    @mock.patch('invoices.automation.call_engine')
+    def test_resolved_rin_skips_the_share_page(self, call_engine):
+        automation.remember_rin(INVOICE_UUID, '100200300')
+        call_engine.return_value = engine_answer('accepted')
+        result = automation.run_automation(url=SHARE_URL, inquiry=True)
+        self.assertTrue(result['rin_resolved'])
+        self.assertEqual(call_engine.call_args.args[:2], ('100200300', INVOICE_UUID))
+
+    @mock.patch('invoices.automation.call_engine')
+    def test_not_found_with_resolved_rin_forgets_it_and_retries(self, call_engine):
+        automation.remember_rin(INVOICE_UUID, '9')
+        call_engine.side_effect = [engine_answer('not_found', rin='9'), engine_answer('accepted')]
+        result = automation.run_automation(url=SHARE_URL, inquiry=True)
+        self.assertEqual(result['external_status'], 'accepted')
+        self.assertNotIn('rin_resolved', result)
+        # The retry went through the share page, without the stale RIN
+        self.assertIsNone(call_engine.call_args_list[1].args[0])
+        self.assertEqual(RinResolution.objects.get(invoice_uuid=INVOICE_UUID).rin, '100200300')
+
+    @mock.patch('invoices.automation.call_engine')
+    def test_retry_that_is_still_not_found_keeps_nothing(self, call_engine):
+        automation.remember_rin(INVOICE_UUID, '9')
+        call_engine.return_value = engine_answer('not_found', rin='9')
+        automation.run_automation(url=SHARE_URL, inquiry=True)
+        self.assertEqual(call_engine.call_count, 2)
+        self.assertFalse(RinResolution.objects.exists())
+
+
+@mock.patch('invoices.automation.get_engine')
+class GovernBatchTests(TestCase):
+    def run_batch(self, items):
+        return list(automation.govern_batch(items, concurrency=2))
+
+    @mock.patch('invoices.automation.govern_batch_item')
+    def test_bad_items_are_reported_and_the_summary_still_comes(self, govern_batch_item, get_engine):
+        govern_batch_item.side_effect = lambda index, item, user: {"index": index, "item": item, "http_status": 200, "result_code": "success_frozen"}
+        lines = self.run_batch([{"url": 5}, {"url": "  "}, ["", "x"], SHARE_URL, {"rin": "1", "uuid": INVOICE_UUID}])
+        invalid = sorted(line["index"] for line in lines if line.get("result_code") == "invalid_item")
+        self.assertEqual(invalid, [0, 1, 2])
+        self.assertEqual(lines[-1], {"summary": {"total": 5, "frozen": 2, "already_frozen": 0, "not_found": 0, "errors": 3}})
+
+    @mock.patch('invoices.automation.govern_batch_item', side_effect=RuntimeError('boom'))
+    def test_crashed_item_still_ends_with_a_summary(self, govern_batch_item, get_engine):
+        lines = self.run_batch([SHARE_URL])
+        self.assertEqual(lines[0]["result_code"], "engine_error")
+        self.assertEqual(lines[0]["index"], 0)
+        self.assertEqual(lines[-1]["summary"]["errors"], 1)
+
+    def test_parse_batch_item_forms(self, get_engine):
+        self.assertEqual(automation.parse_batch_item(f" {SHARE_URL} "), {"url": SHARE_URL})
+        self.assertEqual(automation.parse_batch_item([100, INVOICE_UUID]), {"rin": "100", "uuid": INVOICE_UUID})
+        self.assertEqual(automation.parse_batch_item({"rin": 100, "uuid": INVOICE_UUID}), {"rin": "100", "uuid": INVOICE_UUID})
+        for bad in ({"url": 5}, {"url": ["x"]}, {}, 7, None, ["only-one"]):
+            self.assertIsNone(automation.parse_batch_item(bad))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, INQUIRY_CACHE_TTL=600, INQUIRY_CACHE_NOT_FOUND_TTL=60)
+class InquiryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+
+    def check(self, **data):
+        return self.client.post('/api/invoices/check_status/', {"uuid": INVOICE_UUID, **data}, format='json')
+
+    @mock.patch('invoices.automation.call_engine')
+    def test_second_check_is_served_from_the_cache(self, call_engine):
+        call_engine.return_value = engine_answer('accepted')
+        first = self.check().json()
+        second = self.check().json()
+        self.assertEqual(first["cache"], {"hit": False, "age": 0, "coalesced": False})
+        self.assertTrue(second["cache"]["hit"])
+        self.assertEqual(second["external"]["external_status"], "accepted")
+        call_engine.assert_called_once()
+
+    @mock.patch('invoices.automation.call_engine')
+    def test_refresh_bypasses_the_cache(self, call_engine):
+        call_engine.return_value = engine_answer('accepted')
+        self.check()
+        response = self.check(refresh=True).json()
+        self.assertFalse(response["cache"]["hit"])
+        self.assertEqual(call_engine.call_count, 2)
+
+    @mock.patch('invoices.automation.call_engine')
+    def test_errors_are_never_cached(self, call_engine):
+        call_engine.return_value = {"status": "error", "error_type": "timeout", "message": "no answer"}
+        self.check()
+        self.check()
+        self.assertEqual(call_engine.call_count, 2)
+        self.assertIsNone(automation.get_cached_inquiry(INVOICE_UUID))
+
+    @mock.patch('invoices.automation.call_engine')
+    def test_ttl_depends_on_the_answer(self, call_engine):
+        ttls = {}
+        for external_status in ('accepted', 'rejected', 'not_found', 'غير معروف'):
+            call_engine.return_value = engine_answer(external_status)
+            with mock.patch('invoices.automation.cache') as inquiry_cache:
+                automation.run_inquiry(uuid=INVOICE_UUID)
+            key, entry, ttls[external_status] = inquiry_cache.set.call_args.args
+            self.assertEqual(key, f"inquiry:{INVOICE_UUID}")
+            self.assertEqual(entry["result"]["external_status"], external_status)
+        self.assertEqual(ttls, {'accepted': 600, 'rejected': 600, 'not_found': 60, 'غير معروف': 60})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, BREAKER_FAILURE_THRESHOLD=2, BREAKER_WINDOW=120, BREAKER_COOLDOWN=60)
+class BreakerTests(TestCase):
+    def setUp(self):
+        probe_dir = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, probe_dir)
+        probe = override_settings(BREAKER_PROBE_LOCK=os.path.join(probe_dir, 'probe.lock'))
+        probe.enable()
+        self.addCleanup(probe.disable)
+        self.addCleanup(breaker.release_probe)
+        breaker.cache().clear()
+
+    def record_failure(self, error_type='connect'):
+        return breaker.record_result({"status": "error", "error_type": error_type, "message": "down"})
+
+    def expire_cooldown(self):
+        state = breaker.get_state()
+        state["opened_at"] = time.time() - 61
+        breaker.save_state(state)
+
+    def test_opens_after_threshold(self):
+        self.record_failure()
+        self.assertEqual(breaker.allow_request(), (True, 0))
+        self.record_failure('timeout')
+        allowed, retry_after = breaker.allow_request()
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+        self.assertEqual(breaker.snapshot()["state"], "open")
+
+    def test_invoice_errors_do_not_count(self):
+        for _ in range(3):
+            self.record_failure('not_found')
+        self.assertEqual(breaker.snapshot()["state"], "closed")
+
+    def test_half_open_lets_exactly_one_probe_through(self):
+        self.record_failure()
+        self.record_failure()
+        self.expire_cooldown()
+        self.assertEqual(breaker.allow_request(), (True, 0))
+        self.assertFalse(breaker.allow_request()[0])
+        self.assertEqual(breaker.snapshot()["state"], "half_open")
+
+    def test_successful_probe_closes(self):
+        self.record_failure()
+        self.record_failure()
+        self.expire_cooldown()
+        breaker.allow_request()
+        breaker.record_result({"status": "success"})
+        self.assertEqual(breaker.snapshot()["state"], "closed")
+        self.assertEqual(breaker.allow_request(), (True, 0))
+
+    def test_failed_probe_reopens(self):
+        self.record_failure()
+        self.record_failure()
+        self.expire_cooldown()
+        breaker.allow_request()
+        self.record_failure()
+        self.assertEqual(breaker.snapshot()["state"], "open")
+        # The probe slot was given back for the next cooldown
+        self.expire_cooldown()
+        self.assertEqual(breaker.allow_request(), (True, 0))
+
+    def test_busy_probe_gives_its_slot_back(self):
+        self.record_failure()
+        self.record_failure()
+        self.expire_cooldown()
+        self.assertEqual(breaker.allow_request(), (True, 0))
+        breaker.record_result({"status": "error", "error_type": "busy", "retry_after": 3})
+        self.assertEqual(breaker.snapshot()["state"], "half_open")
+        self.assertEqual(breaker.snapshot()["recent_failures"], 2)
+        self.assertEqual(breaker.allow_request(), (True, 0))
+
+
+class MobileSyncPullTests(TestCase):
+    def setUp(self):
+        self.rows = [MobileSync.objects.create(url=f"https://example.com/{i}") for i in range(3)]
+        # No watcher thread polling the test database
+        patcher = mock.patch.object(mobile_sync, 'waiting', contextlib.nullcontext)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_claim_hands_each_link_out_once(self):
+        rows, next_since = mobile_sync.pull(0, claim=True)
+        self.assertEqual([r.id for r in rows], [r.id for r in self.rows])
+        self.assertEqual(next_since, self.rows[-1].id)
+        self.assertTrue(all(r.is_processed for r in rows))
+        self.assertEqual(mobile_sync.pull(0, claim=True), ([], 0))
+
+    def test_plain_pull_still_sees_claimed_links(self):
+        mobile_sync.pull(0, claim=True)
+        rows, _ = mobile_sync.pull(0)
+        self.assertEqual(len(rows), 3)
+
+    def test_claim_skips_rows_taken_by_another_desk(self):
+        MobileSync.objects.filter(pk=self.rows[1].pk).update(is_processed=True)
+        rows, next_since = mobile_sync.pull(0, claim=True)
+        self.assertEqual([r.id for r in rows], [self.rows[0].id, self.rows[2].id])
+        self.assertEqual(next_since, self.rows[-1].id)
+
+    def test_limit_and_cursor(self):
+        rows, next_since = mobile_sync.pull(0, limit=2)
+        self.assertEqual(len(rows), 2)
+        rows, _ = mobile_sync.pull(next_since, limit=2)
+        self.assertEqual([r.id for r in rows], [self.rows[2].id])
+        self.assertEqual(mobile_sync.decode_cursor(mobile_sync.encode_cursor(next_since)), next_since)
+
+    def test_pull_view_validates_limit_and_cursor(self):
+        client = APIClient()
+        for query in ('limit=-1', 'limit=0', 'limit=abc', 'cursor=not-a-cursor'):
+            response = client.get(f'/api/mobile-sync/pull/?since_id=0&{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_pull_view_pages_with_the_cursor(self):
+        client = APIClient()
+        first = client.get('/api/mobile-sync/pull/?since_id=0&limit=2').json()
+        self.assertEqual([r["id"] for r in first["results"]], [r.id for r in self.rows[:2]])
+        rest = client.get(f'/api/mobile-sync/pull/?cursor={first["next_cursor"]}').json()
+        self.assertEqual([r["id"] for r in rest["results"]], [self.rows[2].id])
+
+    def test_long_poll_wakes_on_push(self):
+        row = self.rows[0]
+        pull = mock.patch.object(mobile_sync, 'pull', side_effect=[([], 7), ([row], row.id)])
+        with pull as pulled:
+            threading.Timer(0.1, mobile_sync.notify).start()
+            started = time.monotonic()
+            rows, next_since = mobile_sync.wait_for_links(0, 5, claim=True)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual((rows, next_since), ([row], row.id))
+        self.assertEqual(pulled.call_args_list[1], mock.call(7, limit=None, claim=True))
+
+    def test_stream_claims_each_link_as_it_is_written(self):
+        events = mobile_sync.event_stream(0, claim=True)
+        self.assertTrue(next(events).startswith('retry:'))
+        self.assertIn(f'"id": {self.rows[0].id}', next(events))
+        claimed = MobileSync.objects.filter(is_processed=True).values_list('id', flat=True)
+        # The rest of the batch is still free for other desks
+        self.assertEqual(list(claimed), [self.rows[0].id])
+        self.assertIn(f'"id": {self.rows[1].id}', next(events))
+        # Closed while the second event was being written: only that one goes back
+        events.close()
+        self.assertEqual(list(claimed), [self.rows[0].id])
+
+    def test_stream_skips_links_another_desk_claimed(self):
+        MobileSync.objects.filter(pk=self.rows[0].pk).update(is_processed=True)
+        events = mobile_sync.event_stream(0, claim=True)
+        next(events)
+        self.assertIn(f'"id": {self.rows[1].id}', next(events))
+        events.close()
+
+
+class GovernorTests(TestCase):
+    def setUp(self):
+        self.engine = automation.get_engine()
+        governor_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, governor_dir)
+        patcher = mock.patch.object(self.engine, 'GOVERNOR_DIR', governor_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_allows_a_burst_then_turns_requests_away(self):
+        budget = self.engine.HostBudget('portal.test', rps=2, max_pages=1)
+        budget.take(0)
+        budget.take(0)
+        with self.assertRaises(self.engine.PortalBusy) as busy:
+            budget.take(0)
+        self.assertEqual(busy.exception.host, 'portal.test')
+        self.assertGreaterEqual(busy.exception.retry_after, 1)
+
+    def test_bucket_is_shared_between_processes(self):
+        # Each process builds its own HostBudget over the same files
+        self.engine.HostBudget('portal.test', rps=1, max_pages=1).take(0)
+        with self.assertRaises(self.engine.PortalBusy):
+            self.engine.HostBudget('portal.test', rps=1, max_pages=1).take(0)
+
+    def test_zero_rps_is_unlimited(self):
+        budget = self.engine.HostBudget('portal.test', rps=0, max_pages=1)
+        for _ in range(5):
+            budget.take(0)
+
+    def test_page_slots_are_limited_and_released(self):
+        governor = self.engine.PortalGovernor()
+        url = 'https://portal.test/inquiry'
+        with mock.patch.dict(self.engine.HOST_LIMITS, {'portal.test': (10, 1)}):
+            with governor.slot(url, wait=0):
+                with self.assertRaises(self.engine.PortalBusy):
+                    with governor.slot(url, wait=0):
+                        pass
+            with governor.slot(url, wait=0):
+                pass
+
+    def test_slot_left_by_a_dead_process_is_taken_over(self):
+        budget = self.engine.HostBudget('portal.test', rps=1, max_pages=1)
+        stale = os.path.join(budget.dir, 'page-0')
+        open(stale, 'w').close()
+        os.utime(stale, (0, 0))
+        self.assertEqual(budget.acquire_page(0), stale)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    @mock.patch('invoices.automation.call_engine')
+    def test_busy_portal_answers_503_with_retry_after(self, call_engine):
+        call_engine.return_value = self.engine.busy_result(self.engine.PortalBusy('portal.test', 7))
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        response = client.post('/api/invoices/check_status/', {"uuid": INVOICE_UUID}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(response.json()["external"]["error_type"], "busy")
+
+
+
+class InvoicePaginationTests(TestCase):
+    def setUp(self):
+        company = Company.objects.create(name='Acme', tax_registration_number='100200300')
+        now = timezone.now()
+        self.invoices = []
+        for i in range(5):
+            invoice = Invoice.objects.create(invoice_id=f'INV-{i}', company=company, url=SHARE_URL, status='accepted' if i % 2 else 'pending')
+            self.invoices.append(invoice)
+        # Two invoices share a timestamp: the id breaks the tie
+        for invoice, minutes in zip(self.invoices, (5, 4, 4, 2, 1)):
+            Invoice.objects.filter(pk=invoice.pk).update(created_at=now - datetime.timedelta(minutes=minutes))
+        self.client = APIClient()
+
+    def walk(self, url):
+        ids = []
+        while url:
+            page = self.client.get(url).json()
+            ids += [item['id'] for item in page['results']]
+            url = page['next']
+        return ids
+
+    def test_pages_follow_created_at_then_id_without_gaps(self):
+        expected = list(Invoice.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/invoices/?page_size=2'), expected)
+        self.assertEqual(expected[2:4], [self.invoices[2].id, self.invoices[1].id])
+
+    def test_new_invoice_does_not_shift_later_pages(self):
+        first = self.client.get('/api/invoices/?page_size=2').json()
+        Invoice.objects.create(invoice_id='INV-new', company=self.invoices[0].company, url=SHARE_URL)
+        rest = self.walk(first['next'])
+        self.assertEqual([item['id'] for item in first['results']] + rest,
+                         list(Invoice.objects.exclude(invoice_id='INV-new').order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_filters_keep_the_ordering(self):
+        expected = list(Invoice.objects.filter(status='accepted').order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/invoices/?status=accepted&page_size=1'), expected)
+
+    def test_page_size_is_capped(self):
+        # The pagination class reads INVOICE_MAX_PAGE_SIZE at import
+        with mock.patch('invoices.views.InvoiceCursorPagination.max_page_size', 3):
+            page = self.client.get('/api/invoices/?page_size=500').json()
+        self.assertEqual(len(page['results']), 3)
+
+
+@override_settings(MOBILE_SYNC_DISPATCH_RECLAIM_AFTER=60, GOVERNANCE_INLINE_RUNNER=False)
+class DispatchTests(TestCase):
+    def link(self, url=SHARE_URL, **fields):
+        row = MobileSync.objects.create(url=url)
+        if fields:
+            MobileSync.objects.filter(pk=row.pk).update(**fields)
+            row.refresh_from_db()
+        return row
+
+    def test_claim_takes_each_link_once(self):
+        rows = [self.link(f'{SHARE_URL}?n={i}') for i in range(3)]
+        claimed = dispatch.claim(2)
+        self.assertEqual([r.id for r in claimed], [r.id for r in rows[:2]])
+        self.assertEqual([r.id for r in dispatch.claim(5)], [rows[2].id])
+        self.assertEqual(dispatch.claim(5), [])
+        self.assertTrue(all(r.dispatched_at for r in MobileSync.objects.all()))
+
+    def test_desk_claims_are_not_dispatched(self):
+        self.link(is_processed=True)
+        self.assertEqual(dispatch.claim(5), [])
+
+    def test_stranded_links_are_reclaimed_after_the_delay(self):
+        long_ago = timezone.now() - datetime.timedelta(seconds=120)
+        stranded = self.link(is_processed=True, dispatched_at=long_ago)
+        self.link(is_processed=True, dispatched_at=timezone.now())
+        job = GovernanceJob.objects.create(kind='governance', url=SHARE_URL, status='queued')
+        self.link(is_processed=True, dispatched_at=long_ago, job=job)
+        self.link(is_processed=True, dispatched_at=long_ago, result_code='invalid_link')
+        self.assertEqual([r.id for r in dispatch.claim(5)], [stranded.id])
+
+    @mock.patch('invoices.dispatch.jobs.enqueue')
+    def test_batch_feeds_links_into_jobs(self, enqueue):
+        job = GovernanceJob.objects.create(kind='governance', url=SHARE_URL, status='queued')
+        enqueue.return_value = (job, True)
+        good = self.link()
+        bad = self.link('https://example.com/not-an-invoice')
+        self.assertEqual(dispatch.dispatch_batch(), 2)
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(good.job, job)
+        self.assertEqual(bad.result_code, 'invalid_link')
+        enqueue.assert_called_once_with(url=SHARE_URL)
+
+    @mock.patch('invoices.dispatch.jobs.enqueue', side_effect=RuntimeError('queue down'))
+    def test_failed_enqueue_leaves_the_link_for_reclaim(self, enqueue):
+        row = self.link()
+        with mock.patch('builtins.print'):
+            self.assertEqual(dispatch.dispatch_batch(), 1)
+        row.refresh_from_db()
+        self.assertTrue(row.is_processed)
+        self.assertIsNone(row.job)
+        MobileSync.objects.filter(pk=row.pk).update(dispatched_at=timezone.now() - datetime.timedelta(seconds=120))
+        self.assertEqual([r.id for r in dispatch.claim(5)], [row.id])
+
+    @override_settings(GOVERNANCE_MAX_QUEUED=1)
+    def test_full_job_queue_is_left_to_the_desks(self):
+        GovernanceJob.objects.create(kind='governance', url=SHARE_URL, status='queued')
+        self.link()
+        self.assertEqual(dispatch.dispatch_batch(), 0)
+
+    def test_settle_copies_the_job_outcome(self):
+        done = GovernanceJob.objects.create(kind='governance', url=SHARE_URL, status='done', result_code='success_frozen')
+        crashed = GovernanceJob.objects.create(kind='governance', url=SHARE_URL + '?x', status='failed')
+        running = GovernanceJob.objects.create(kind='governance', url=SHARE_URL + '?y', status='running')
+        rows = [self.link(is_processed=True, job=job) for job in (done, crashed, running)]
+        self.assertEqual(dispatch.settle(), 2)
+        self.assertEqual([MobileSync.objects.get(pk=r.pk).result_code for r in rows], ['success_frozen', 'engine_error', None])
+
+
+@override_settings(MOBILE_SYNC_RETENTION_DAYS=30)
+class CompactMobileSyncTests(TestCase):
+    def setUp(self):
+        old = timezone.now() - datetime.timedelta(days=40)
+        self.old_done = [MobileSync.objects.create(url=f'https://example.com/done/{i}', is_processed=True) for i in range(3)]
+        self.old_open = MobileSync.objects.create(url='https://example.com/open', client_key='k-open')
+        MobileSync.objects.filter(pk__in=[r.pk for r in self.old_done] + [self.old_open.pk]).update(created_at=old)
+        self.recent = MobileSync.objects.create(url='https://example.com/recent', is_processed=True)
+
+    def compact(self, **options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('compact_mobile_sync', **options)
+
+    def remaining(self):
+        return set(MobileSync.objects.values_list('id', flat=True))
+
+    def test_deletes_old_processed_links_in_batches(self):
+        self.compact(batch_size=2)
+        self.assertEqual(self.remaining(), {self.old_open.id, self.recent.id})
+
+    def test_include_unprocessed(self):
+        self.compact(include_unprocessed=True)
+        self.assertEqual(self.remaining(), {self.recent.id})
+
+    def test_dry_run_deletes_nothing(self):
+        self.compact(dry_run=True)
+        self.assertEqual(len(self.remaining()), 5)
+
+    def test_archive_gets_every_deleted_row_first(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        path = os.path.join(archive_dir, 'links.jsonl')
+        self.compact(archive=path, batch_size=1)
+        with open(path, encoding='utf-8') as f:
+            archived = [json.loads(line) for line in f]
+        self.assertEqual(sorted(row['id'] for row in archived), sorted(r.id for r in self.old_done))
+
+    def test_rejects_bad_options(self):
+        with self.assertRaises(CommandError):
+            self.compact(days=-1)
+
+
+class PushDedupTests(TestCase):
+    def test_same_link_inside_the_window_is_stored_once(self):
+        first, created = mobile_sync.push('https://Example.com/a#scan')
+        again, created_again = mobile_sync.push('HTTPS://EXAMPLE.COM/a')
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(first.pk, again.pk)
+        self.assertEqual(first.url_hash, mobile_sync.url_hash('https://example.com/a'))
+
+    def test_same_link_after_the_window_is_stored_again(self):
+        first, _ = mobile_sync.push('https://example.com/a')
+        pushed_at = timezone.now() - datetime.timedelta(minutes=1)
+        MobileSync.objects.filter(pk=first.pk).update(created_at=pushed_at, dedup_bucket=mobile_sync.dedup_bucket(pushed_at))
+        _, created = mobile_sync.push('https://example.com/a')
+        self.assertTrue(created)
+
+    def test_path_and_query_stay_case_sensitive(self):
+        self.assertNotEqual(mobile_sync.url_hash('https://example.com/A'), mobile_sync.url_hash('https://example.com/a'))
+        self.assertNotEqual(mobile_sync.url_hash('https://example.com/a?x=1'), mobile_sync.url_hash('https://example.com/a?x=2'))
+
+
+class FakeTab:
+    class context:
+        @staticmethod
+        def cookies():
+            return []
+
+    def evaluate(self, script):
+        return "test-agent"
+
+
+class HttpInquiryClientTests(TestCase):
+    def setUp(self):
+        self.engine = automation.get_engine()
+        for name in ('_http_clients', '_http_loading'):
+            patcher = mock.patch.dict(getattr(self.engine, name), clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_slow_build_only_delays_its_own_session(self):
+        building, release = threading.Event(), threading.Event()
+        builds = []
+
+        class SlowClient:
+            def __init__(self, cookies, user_agent):
+                builds.append(self)
+                building.set()
+                release.wait(5)
+
+            def inquire(self, tax_number, invoice_uuid):
+                return {"session": "A"}
+
+        ready = mock.Mock(**{"inquire.return_value": {"session": "B"}})
+        self.engine._http_clients['B'] = ready
+        with mock.patch.object(self.engine, 'PortalHttpClient', SlowClient):
+            results = {}
+            tabs = [threading.Thread(target=lambda n=n: results.setdefault(n, self.engine.http_inquiry('1', 'u', FakeTab(), 'A'))) for n in range(2)]
+            tabs[0].start()
+            self.assertTrue(building.wait(5))
+            tabs[1].start()
+            # Session A's client is still loading; session B answers at once
+            self.assertEqual(self.engine.http_inquiry('1', 'u', FakeTab(), 'B'), {"session": "B"})
+            release.set()
+            for tab in tabs:
+                tab.join(5)
+        self.assertEqual(results, {0: {"session": "A"}, 1: {"session": "A"}})
+        # The second tab of session A waited for the first build instead of starting another
+        self.assertEqual(len(builds), 1)
+
+    def test_failed_build_falls_back_to_the_browser(self):
+        with mock.patch.object(self.engine, 'PortalHttpClient', side_effect=self.engine.SessionExpired('login')):
+            self.assertIsNone(self.engine.http_inquiry('1', 'u', FakeTab(), 'A'))
+        self.assertNotIn('A', self.engine._http_clients)
+
+
+class HeartbeatTests(TestCase):
+    def setUp(self):
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir)
+        self.lock_path = os.path.join(lock_dir, 'heartbeat.lock')
+        lock = override_settings(AUTOMATION_HEARTBEAT_LOCK=self.lock_path)
+        lock.enable()
+        self.addCleanup(lock.disable)
+
+    def run_once(self):
+        stop = threading.Event()
+        with mock.patch.object(heartbeat, 'beat', side_effect=lambda: stop.set()) as beat, \
+                mock.patch.object(heartbeat, 'follow', side_effect=lambda: stop.set()) as follow:
+            heartbeat.run(stop_event=stop, interval=1)
+        return beat, follow
+
+    def test_lock_holder_probes_and_releases(self):
+        beat, follow = self.run_once()
+        self.assertEqual(beat.call_count, 1)
+        follow.assert_not_called()
+        self.assertFalse(os.path.exists(self.lock_path))
+
+    def test_other_process_follows_instead_of_probing(self):
+        with open(self.lock_path, 'w') as f:
+            f.write('1')
+        beat, follow = self.run_once()
+        beat.assert_not_called()
+        self.assertEqual(follow.call_count, 1)
+        # The holder's lock is left in place
+        self.assertTrue(os.path.exists(self.lock_path))
+
+    def test_stale_lock_is_taken_over(self):
+        with open(self.lock_path, 'w') as f:
+            f.write('1')
+        os.utime(self.lock_path, (time.time() - 10, time.time() - 10))
+        beat, follow = self.run_once()
+        self.assertEqual(beat.call_count, 1)
+        follow.assert_not_called()
+
+    def test_follow_applies_recent_probes_only(self):
+        AutomationSession.objects.create(endpoint='http://a:9222', is_active=True, otp_verified=False, last_error='expired')
+        AutomationSession.objects.create(endpoint='http://b:9222', is_active=True, otp_verified=True)
+        AutomationSession.objects.filter(endpoint='http://b:9222').update(
+            last_heartbeat=timezone.now() - datetime.timedelta(hours=1)
+        )
+        engine = mock.Mock()
+        with mock.patch.object(heartbeat, 'get_engine', return_value=engine):
+            heartbeat.follow()
+        engine.apply_probes.assert_called_once_with(
+            [{"endpoint": 'http://a:9222', "alive": True, "logged_in": False, "error": 'expired'}]
+        )
+
+
+class ScannerPageTests(TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, scanner, '_page', None)
+        scanner._page = None
+
+    def fallback(self, vendored):
+        with mock.patch.object(scanner, 'vendored', return_value=vendored):
+            response = APIClient().get('/api/mobile-sync/push_page/')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode('utf-8')
+
+    def test_decoder_loads_from_this_origin_only(self):
+        page = self.fallback(True)
+        self.assertIn('invoices/scanner/vendor/html5-qrcode', page)
+        self.assertNotIn('unpkg.com', page)
+        self.assertNotIn('jsdelivr', page)
+
+    def test_no_decoder_when_not_vendored(self):
+        page = self.fallback(False)
+        self.assertIn('data-fallback=""', page)
+        self.assertNotIn('html5-qrcode', page)
+
+    def test_unchanged_page_revalidates(self):
+        first = APIClient().get('/api/mobile-sync/push_page/')
+        again = APIClient().get('/api/mobile-sync/push_page/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+
+class SelectorEngineTests(TestCase):
+    def setUp(self):
+        self.engine = automation.get_engine()
+        config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_dir)
+        self.mapping_path = os.path.join(config_dir, 'automation_mapping.json')
+        self.stats_path = os.path.join(config_dir, 'selector_stats.json')
+
+    def write_mapping(self, data, mtime):
+        with open(self.mapping_path, 'w', encoding='utf-8') as f:
+            f.write(data if isinstance(data, str) else json.dumps(data))
+        os.utime(self.mapping_path, (mtime, mtime))
+
+    def test_mapping_reloads_when_the_file_changes(self):
+        mapping = self.engine.SelectorMapping(self.mapping_path)
+        self.assertEqual(mapping.selector('invoice_id'), '#invoiceId')
+        self.write_mapping({"selectors": {"invoice_id": "#uuid"}}, 1000)
+        self.assertEqual(mapping.selector('invoice_id'), '#uuid')
+        self.write_mapping({"selectors": {"invoice_id": "#uuid2"}}, 2000)
+        self.assertEqual(mapping.selector('invoice_id'), '#uuid2')
+
+    def test_broken_mapping_keeps_the_last_good_one(self):
+        mapping = self.engine.SelectorMapping(self.mapping_path)
+        self.write_mapping({"selectors": {"rin_extraction": [".a", ".b"]}, "timeouts_ms": {"rin_extraction": 900}}, 1000)
+        self.assertEqual(mapping.candidates('rin_extraction'), ['.a', '.b'])
+        self.write_mapping('{"selectors": ', 2000)
+        self.assertEqual(mapping.candidates('rin_extraction'), ['.a', '.b'])
+        self.assertEqual(mapping.timeout_ms('rin_extraction', 2000), 900)
+
+    def test_stats_rank_hits_first_and_persist(self):
+        stats = self.engine.SelectorStats(self.stats_path)
+        self.assertEqual(stats.rank('rin', ['.a', '.b']), ['.a', '.b'])
+        stats.record('rin', '.b', ['.a'], 40)
+        stats.record('rin', '.b', ['.a'], 60)
+        self.assertEqual(stats.rank('rin', ['.a', '.b', '.new']), ['.b', '.new', '.a'])
+        stats.save()
+        snapshot = self.engine.SelectorStats(self.stats_path).snapshot()
+        self.assertEqual(snapshot['rin']['.b'], {"hits": 2, "misses": 0, "hit_rate": 1.0, "avg_ms": 50})
+        self.assertEqual(snapshot['rin']['.a']['hit_rate'], 0.0)
@@ -1,15 +1,41 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
-from django.http import HttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from django.http import HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from django.db import DatabaseError
 from django.db.models import Count
-from .models import Invoice, Company, MobileSync
-from .serializers import InvoiceSerializer, CompanySerializer, MobileSyncSerializer
+from django.utils import timezone
+from .models import Invoice, Company, MobileSync, GovernanceJob
+from .serializers import InvoiceSerializer, CompanySerializer, MobileSyncSerializer, GovernanceJobSerializer
+from .automation import get_cached_inquiry, govern_batch, get_engine
+from . import jobs, breaker, heartbeat, mobile_sync, scanner, dispatch
+import datetime
 import subprocess
+import json
 import os
 import pandas as pd
 import io
 
+class EventStreamRenderer(BaseRenderer):
+    # Lets EventSource's "Accept: text/event-stream" pass DRF content negotiation
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode('utf-8')
+
+
+class InvoiceCursorPagination(CursorPagination):
+    # Keyset pages (WHERE created_at < cursor) stay as cheap deep in the table as on page one
+    ordering = ('-created_at', '-id')
+    page_size = settings.INVOICE_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.INVOICE_MAX_PAGE_SIZE
+
+
 class MobileSyncViewSet(viewsets.ModelViewSet):
     queryset = MobileSync.objects.all().order_by('-created_at')
     serializer_class = MobileSyncSerializer
@@ -18,14 +44,67 @@ class MobileSyncViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def pull(self, request):
-        from django.utils import timezone
-        import datetime
-        # Get links from last 5 minutes to be safe
-        threshold = timezone.now() - datetime.timedelta(minutes=5)
-        new_links = MobileSync.objects.filter(created_at__gte=threshold).order_by('-created_at')
-        
-        serializer = self.get_serializer(new_links, many=True)
-        return Response(serializer.data)
+        params = request.query_params
+        if 'cursor' not in params and 'since_id' not in params:
+            # Legacy clients: every link from the last 5 minutes
+            threshold = timezone.now() - datetime.timedelta(minutes=5)
+            new_links = MobileSync.objects.filter(created_at__gte=threshold).order_by('-created_at')
+            serializer = self.get_serializer(new_links, many=True)
+            return Response(serializer.data)
+
+        # Incremental: only rows after the cursor, optionally claimed for this desk
+        try:
+            since = self.pull_since(params.get('cursor'), params.get('since_id'))
+            limit = int(params['limit']) if params.get('limit') else None
+            # Long-poll: hold the request until a link arrives or `wait` seconds pass
+            wait = min(float(params.get('wait') or 0), settings.MOBILE_SYNC_LONG_POLL_TIMEOUT)
+        except ValueError:
+            return Response({"error": "Invalid cursor, limit or wait"}, status=400)
+        if limit is not None and limit < 1:
+            return Response({"error": "limit must be at least 1"}, status=400)
+        claim = params.get('claim', '').lower() in ('1', 'true', 'yes')
+
+        with mobile_sync.held_slot() as held:
+            # Too many requests already held in this process: answer at once instead
+            waited = wait > 0 and held
+            if waited:
+                rows, next_since = mobile_sync.wait_for_links(since, wait, limit=limit, claim=claim)
+            else:
+                rows, next_since = mobile_sync.pull(since, limit=limit, claim=claim)
+        return Response({
+            "results": self.get_serializer(rows, many=True).data,
+            "next_cursor": mobile_sync.encode_cursor(next_since),
+            "since_id": next_since,
+            # False when a long-poll was asked for but not held; the client should pause before polling again
+            "waited": waited
+        })
+
+    def pull_since(self, cursor=None, since_id=None):
+        if cursor:
+            return mobile_sync.decode_cursor(cursor)
+        if since_id:
+            return int(since_id)
+        return mobile_sync.initial_since()
+
+    @action(detail=False, methods=['get'], renderer_classes=[EventStreamRenderer, JSONRenderer])
+    def stream(self, request):
+        # Server-Sent Events: each new link is pushed as an "link" event the moment it is stored
+        params = request.query_params
+        try:
+            since = self.pull_since(request.headers.get('Last-Event-ID') or params.get('cursor'), params.get('since_id'))
+        except ValueError:
+            return Response({"error": "Invalid cursor"}, status=400)
+        claim = params.get('claim', '').lower() in ('1', 'true', 'yes')
+
+        try:
+            stream = mobile_sync.LinkStream(since, claim=claim)
+        except mobile_sync.SubscribersFull:
+            # EventSource gives up on a non-200 answer; the dashboard then falls back to polling
+            return Response({"error": "Too many open streams"}, status=503, headers={'Retry-After': '30'})
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
     @action(detail=False, methods=['post'])
     def push(self, request):
@@ -35,168 +114,39 @@ class MobileSyncViewSet(viewsets.ModelViewSet):
             
         print(f">>> PUSH: New link received: {url}")
         # Only create if not exists in last 10 seconds to avoid spam
-        from django.utils import timezone
-        import datetime
-        recent = MobileSync.objects.filter(url=url, created_at__gte=timezone.now() - datetime.timedelta(seconds=10))
-        if not recent.exists():
-            sync_obj = MobileSync.objects.create(url=url)
+        sync_obj, created = mobile_sync.push(url)
+        if created:
             return Response({"message": "تم الاستلام بنجاح", "id": sync_obj.id})
-        return Response({"message": "موجود مسبقاً", "id": recent.first().id})
+        return Response({"message": "موجود مسبقاً", "id": sync_obj.id})
+    @action(detail=False, methods=['post'])
+    def push_batch(self, request):
+        # The scanner's offline queue: [{"url", "key", "scanned_at"}, ...] in one request
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return Response({"error": "items missing"}, status=400)
+        if len(items) > settings.MOBILE_SYNC_PUSH_MAX_BATCH:
+            return Response({"error": f"At most {settings.MOBILE_SYNC_PUSH_MAX_BATCH} items per batch"}, status=400)
+
+        results = mobile_sync.push_batch(items)
+        print(f">>> PUSH: batch of {len(items)} links received")
+        return Response({
+            "results": results,
+            "created": sum(1 for r in results if r['status'] == 'created'),
+            "duplicates": sum(1 for r in results if r['status'] == 'duplicate'),
+            "invalid": sum(1 for r in results if r['status'] == 'invalid')
+        })
+
     @action(detail=False, methods=['get'])
     def push_page(self, request):
-        html = f"""
-        <!DOCTYPE html>
-        <html lang="ar" dir="rtl">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
-            <title>G-Invoice Live Scanner</title>
-            <link href="https://fonts.googleapis.com/css2?family=Cairo:wght@400;700&display=swap" rel="stylesheet">
-            <script src="https://unpkg.com/html5-qrcode"></script>
-            <style>
-                body {{ font-family: 'Cairo', sans-serif; background: #020617; color: white; display: flex; flex-direction: column; align-items: center; min-height: 100vh; margin: 0; padding: 15px; box-sizing: border-box; }}
-                .container {{ width: 100%; max-width: 500px; text-align: center; }}
-                #reader {{ width: 100%; border-radius: 24px; overflow: hidden; border: 2px solid #00f2fe; background: #000; box-shadow: 0 0 30px rgba(0, 242, 254, 0.2); position: relative; display: none; margin-bottom: 20px; }}
-                .btn-power {{ background: linear-gradient(135deg, #00f2fe 0%, #4facfe 100%); color: #000; font-weight: 800; padding: 25px; border-radius: 50%; width: 120px; height: 120px; border: none; font-size: 1rem; margin: 40px auto; cursor: pointer; display: flex; flex-direction: column; align-items: center; justify-content: center; gap: 8px; box-shadow: 0 15px 35px rgba(0, 242, 254, 0.4); transition: transform 0.2s; }}
-                .btn-power:active {{ transform: scale(0.9); }}
-                .status-badge {{ background: rgba(255,255,255,0.05); padding: 8px 15px; border-radius: 20px; font-size: 0.75rem; color: #94a3b8; display: flex; align-items: center; gap: 8px; margin-bottom: 30px; border: 1px solid rgba(255,255,255,0.1); }}
-                .dot {{ width: 8px; height: 8px; background: #22c55e; border-radius: 50%; box-shadow: 0 0 10px #22c55e; animation: pulse 1.5s infinite; }}
-                @keyframes pulse {{ 0% {{ opacity: 0.5; }} 50% {{ opacity: 1; }} 100% {{ opacity: 0.5; }} }}
-                .overlay-text {{ position: fixed; bottom: 30px; left: 0; right: 0; text-align: center; font-size: 0.8rem; color: #64748b; padding: 0 20px; }}
-                .success-toast {{ position: fixed; top: 20px; left: 20px; right: 20px; background: #22c55e; color: #000; padding: 15px; border-radius: 12px; font-weight: 800; display: none; z-index: 1000; animation: slideDown 0.3s ease-out; text-align: center; }}
-                @keyframes slideDown {{ from {{ transform: translateY(-100%); }} to {{ transform: translateY(0); }} }}
-            </style>
-        </head>
-        <body>
-            <div id="toast" class="success-toast">✅ تم استلام الفاتورة في المنظومة!</div>
-
-            <div class="container">
-                <div style="margin-top: 30px; margin-bottom: 10px;">
-                    <h1 style="font-size: 1.8rem; font-weight: 800; color: #00f2fe; margin-bottom: 5px;">الماسح اللحظي 👁️‍🗨️</h1>
-                    <p style="color: #94a3b8; font-size: 0.9rem;">بث مباشر لمزامنة الفواتير</p>
-                </div>
-
-                <div class="status-badge" style="margin: 0 auto 30px auto; width: fit-content;">
-                    <span class="dot"></span> متصل بالسيرفر المركزي (192.168.1.10)
-                </div>
-
-                <div id="reader"></div>
-
-                <button id="startBtn" class="btn-power" onclick="initScanner()">
-                    <span style="font-size: 1.5rem;">🔘</span>
-                    <span>تشغيل</span>
-                </button>
-
-                <div style="margin-top: 20px; padding: 20px; background: rgba(255,255,255,0.02); border-radius: 20px; border: 1px solid rgba(255,255,255,0.05);">
-                    <p style="font-size: 0.8rem; color: #64748b; margin-bottom: 15px;">إرسال يدوي سريع</p>
-                    <input type="url" id="manualUrl" placeholder="الصق الرابط هنا..." style="width: 100%; padding: 15px; border-radius: 12px; border: 1px solid #1e293b; background: #0f172a; color: white; margin-bottom: 10px; text-align: center;">
-                    <button onclick="sendManual()" style="width: 100%; padding: 12px; border-radius: 12px; background: rgba(255,255,255,0.05); color: white; border: 1px solid rgba(255,255,255,0.1); font-weight: 600;">إرسال 📤</button>
-                </div>
-            </div>
-
-            <div class="overlay-text">
-                <span id="connStatus" style="color: #64748b;">⏳ جاري فحص الاتصال...</span>
-            </div>
-
-            <script>
-                const html5QrCode = new Html5Qrcode("reader");
-                const toast = document.getElementById('toast');
-                const connStatus = document.getElementById('connStatus');
-
-                // Check connection every 5 seconds
-                async function checkConnection() {{
-                    try {{
-                        const res = await fetch(window.location.origin + '/api/mobile-sync/pull/');
-                        if(res.ok) connStatus.innerHTML = "🟢 متصل بالسيرفر المركزي";
-                        else connStatus.innerHTML = "🔴 خطأ في الاستجابة (" + res.status + ")";
-                    }} catch(e) {{
-                        connStatus.innerHTML = "🔴 غير متصل بالكمبيوتر (تأكد من الـ WiFi)";
-                    }}
-                }}
-                checkConnection();
-                setInterval(checkConnection, 10000);
-
-                function showToast(count) {{
-                    toast.innerText = count > 0 ? `✅ تم الإرسال! (في الانتظار: ${{count}})` : "✅ تم الإرسال والمزامنة!";
-                    toast.style.display = 'block';
-                    if(window.navigator.vibrate) window.navigator.vibrate([100, 50, 100]);
-                    setTimeout(() => {{ toast.style.display = 'none'; }}, 4000);
-                }}
-
-                async function sendToBackend(url) {{
-                    try {{
-                        const response = await fetch(window.location.origin + '/api/mobile-sync/push/', {{
-                            method: 'POST',
-                            headers: {{ 'Content-Type': 'application/json' }},
-                            body: JSON.stringify({{ url: url }})
-                        }});
-                        const result = await response.json();
-                        if(response.ok) {{
-                            showToast(result.pending);
-                            return true;
-                        }} else {{
-                            alert("Server Error: " + response.status + " - " + (result.error || "Unknown"));
-                        }}
-                    }} catch(e) {{
-                        alert("Network Error: " + e.message + " - Check WiFi");
-                    }}
-                    return false;
-                }}
-
-                function initScanner() {{
-                    document.getElementById('startBtn').style.display = 'none';
-                    document.getElementById('reader').style.display = 'block';
-
-                    const config = {{ 
-                        fps: 15, 
-                        qrbox: (viewfinderWidth, viewfinderHeight) => {{
-                            return {{
-                                width: viewfinderWidth * 0.7,
-                                height: viewfinderWidth * 0.7
-                            }};
-                        }},
-                        aspectRatio: 1.0
-                    }};
-
-                    html5QrCode.start(
-                        {{ facingMode: "environment" }}, 
-                        config,
-                        async (decodedText) => {{
-                            // Action on detection
-                            if(window.navigator.vibrate) window.navigator.vibrate(50);
-                            
-                            const success = await sendToBackend(decodedText);
-                            if(success) {{
-                                html5QrCode.pause();
-                                setTimeout(() => html5QrCode.resume(), 4000);
-                            }}
-                        }},
-                        (errorMessage) => {{ /* silent errors */ }}
-                    ).catch(err => {{
-                        alert("⚠️ تنبيه أمني: المتصفح يمنع الكاميرا على الروابط غير المؤمنة (HTTP).\\n\\nللمتابعة، يرجى استخدام متصفح مغاير أو السماح للكاميرا من إعدادات الموقع.");
-                        document.getElementById('startBtn').style.display = 'flex';
-                        document.getElementById('reader').style.display = 'none';
-                    }});
-                }}
-
-                async function sendManual() {{
-                    const input = document.getElementById('manualUrl');
-                    if(!input.value.trim()) return;
-                    const success = await sendToBackend(input.value.trim());
-                    if(success) input.value = '';
-                }}
-            </script>
-        </body>
-        </html>
-        """
-        return HttpResponse(html)
+        return scanner.page_response(request)
 
 class InvoiceViewSet(viewsets.ModelViewSet):
-    queryset = Invoice.objects.all().order_by('-created_at')
+    queryset = Invoice.objects.all().order_by('-created_at', '-id')
     serializer_class = InvoiceSerializer
+    pagination_class = InvoiceCursorPagination
 
     def get_queryset(self):
-        queryset = Invoice.objects.all().order_by('-created_at')
+        queryset = Invoice.objects.select_related('company', 'frozen_by', 'unfrozen_by').order_by('-created_at', '-id')
         rin = self.request.query_params.get('rin')
         invoice_id = self.request.query_params.get('invoice_id')
         status_filter = self.request.query_params.get('status')
@@ -219,100 +169,74 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         if not invoice_url and (not tax_number or not invoice_uuid):
             return Response({"error": "Invoice URL or (RIN and UUID) are required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        import sys
-        script_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'automation_engine.py')
-        venv_python = sys.executable
+        if jobs.queue_full():
+            return Response({
+                "result_code": "queue_full",
+                "error": "قائمة الانتظار ممتلئة، يرجى إعادة المحاولة بعد قليل",
+                "retry_after": settings.GOVERNANCE_RETRY_AFTER
+            }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(settings.GOVERNANCE_RETRY_AFTER)})
+
+        # Queue the run and answer at once; the result is polled from jobs/<id>/
+        job, created = jobs.enqueue(rin=tax_number, uuid=invoice_uuid, url=invoice_url, user=request.user)
+        return Response({
+            "job_id": job.id,
+            "status": job.status,
+            # True when the same invoice was already in flight and this call joined it
+            "coalesced": not created,
+            "status_url": self.reverse_action('job-status', kwargs={'job_id': job.id}),
+            "events_url": self.reverse_action('job-events', kwargs={'job_id': job.id})
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'])
+    def start_governance_batch(self, request):
+        items = request.data.get('items') or request.data.get('urls')
+        if not isinstance(items, list) or not items:
+            return Response({"error": "A non-empty list of invoice URLs or (RIN, UUID) pairs is required"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # Prepare command based on input
-            cmd = [venv_python, script_path]
-            if invoice_url:
-                cmd.append(invoice_url)
-            else:
-                cmd.extend([tax_number, invoice_uuid])
-
-            # Execute automation
-            result_process = subprocess.run(
-                cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE, 
-                text=True, 
-                encoding='utf-8',
-                errors='ignore'
-            )
-            
-            output = result_process.stdout or ""
-            error_output = result_process.stderr or ""
-            
-            # Parse the JSON from output
-            import json
-            res_data = {}
-            for line in output.splitlines():
-                if line.startswith("RESULT_JSON:"):
-                    try:
-                        res_data = json.loads(line.replace("RESULT_JSON:", ""))
-                    except:
-                        continue
-                    break
-            
-            if res_data.get('status') == 'success':
-                # Save to database
-                final_rin = res_data.get('rin') or tax_number
-                final_uuid = res_data.get('uuid') or invoice_uuid
-                
-                # Check if invoice already exists and is frozen
-                existing_invoice = Invoice.objects.filter(invoice_id=final_uuid).first()
-                if existing_invoice and existing_invoice.status == 'frozen':
-                    return Response({
-                        "result_code": "already_frozen",
-                        "message": "تم إيجاد الفاتورة ولكنها مجمدة مسبقاً",
-                        "rin": final_rin,
-                        "uuid": final_uuid,
-                        "status": "frozen"
-                    }, status=status.HTTP_200_OK)
-
-                company, _ = Company.objects.get_or_create(
-                    tax_registration_number=final_rin,
-                    defaults={'name': f"شركة - {final_rin}"}
-                )
-                
-                invoice, created = Invoice.objects.update_or_create(
-                    invoice_id=final_uuid,
-                    defaults={
-                        'company': company,
-                        'status': 'frozen', # Default to frozen on success per user request
-                        'governance_result': output,
-                        'frozen_by': request.user if request.user.is_authenticated else None
-                    }
-                )
-                
-                return Response({
-                    "result_code": "success_frozen",
-                    "message": "تم إيجاد الفاتورة وتجميدها بنجاح",
-                    "rin": final_rin,
-                    "uuid": final_uuid,
-                    "status": "frozen"
-                })
-            else:
-                error_msg = res_data.get('message', 'فشلت الأتمتة في استخراج البيانات أو التنفيذ')
-                return Response({
-                    "result_code": "not_found",
-                    "error": "لم يسفر البحث عن شيء أو حدث خطأ",
-                    "details": error_msg,
-                    "technical_details": output + error_output
-                }, status=status.HTTP_404_NOT_FOUND)
+            concurrency = int(request.data.get('concurrency', settings.GOVERNANCE_BATCH_MAX_CONCURRENCY))
+        except (TypeError, ValueError):
+            return Response({"error": "concurrency must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        # One JSON line per invoice as it finishes, the last line is the summary
+        lines = (json.dumps(result, ensure_ascii=False) + "\n" for result in govern_batch(items, concurrency, user))
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
-        except Exception as e:
-            return Response({
-                "error": "حدث خطأ غير متوقع أثناء تشغيل المحرك",
-                "details": str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    @action(detail=False, methods=['get'], url_path=r'jobs/(?P<job_id>\d+)')
+    def job_status(self, request, job_id=None):
+        try:
+            job = GovernanceJob.objects.get(pk=job_id)
+        except GovernanceJob.DoesNotExist:
+            return Response({"error": "المهمة غير موجودة"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(GovernanceJobSerializer(job).data)
+
+    @action(detail=False, methods=['get'], url_path=r'jobs/(?P<job_id>\d+)/events')
+    def job_events(self, request, job_id=None):
+        try:
+            job = GovernanceJob.objects.get(pk=job_id)
+        except GovernanceJob.DoesNotExist:
+            return Response({"error": "المهمة غير موجودة"}, status=status.HTTP_404_NOT_FOUND)
+        # Live step/timing events as NDJSON; the last line is the job's result. The stream holds
+        # its thread for up to AUTOMATION_TIMEOUT, so it shares the mobile-sync streams' slots
+        lines = (json.dumps(event, ensure_ascii=False) + "\n" for event in jobs.stream_events(job))
+        try:
+            stream = mobile_sync.HeldStream(lines)
+        except mobile_sync.SubscribersFull:
+            return Response({"error": "Too many open streams"}, status=503, headers={'Retry-After': '30'})
+        response = StreamingHttpResponse(stream, content_type='application/x-ndjson')
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
     @action(detail=False, methods=['post'])
     def check_status(self, request):
         invoice_url = request.data.get('url')
         invoice_uuid = request.data.get('uuid')
         deep_search = request.data.get('deep_search', False)
+        # Skip the inquiry cache and ask the portal again
+        refresh = str(request.data.get('refresh', False)).lower() in ('1', 'true', 'yes')
 
         if not invoice_uuid and invoice_url:
             import re
@@ -337,26 +261,37 @@ class InvoiceViewSet(viewsets.ModelViewSet):
 
         # لو العميل طالب "بحث عميق" في المنظومة الخارجية
         external_data = None
+        cache_info = None
         if deep_search or not local_data.get('found_locally'):
-            import sys
-            script_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'automation_engine.py')
-            venv_python = sys.executable
-            
-            cmd = [venv_python, script_path, invoice_url or invoice_uuid, "--inquiry"]
             try:
-                result_process = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-                import json
-                for line in result_process.stdout.splitlines():
-                    if line.startswith("RESULT_JSON:"):
-                        external_data = json.loads(line.replace("RESULT_JSON:", ""))
-                        break
-            except: pass
-
-        return Response({
+                cached = None if refresh else get_cached_inquiry(invoice_uuid)
+                if cached is not None:
+                    external_data, cache_info = cached
+                else:
+                    # Concurrent checks of the same invoice share one portal run
+                    job, created = jobs.run_or_join('inquiry', uuid=invoice_uuid, url=invoice_url)
+                    external_data, _ = jobs.job_payload(job)
+                    cache_info = {"hit": False, "age": 0, "coalesced": not created}
+            except (DatabaseError, OSError) as e:
+                # A failed lookup must not read as "nothing found on the portal"
+                print(f">>> CHECK_STATUS: external lookup failed for {invoice_uuid}: {e}")
+                external_data = {
+                    "status": "error",
+                    "error_type": "lookup_failed",
+                    "message": "تعذر الاستعلام من المنظومة الخارجية، يرجى إعادة المحاولة"
+                }
+
+        response = Response({
             "local": local_data,
             "external": external_data,
+            "cache": cache_info,
             "invoice_id": invoice_uuid
         })
+        if external_data and external_data.get('error_type') in ('busy', 'circuit_open', 'lookup_failed'):
+            # Portal budget exhausted or portal down: tell the client when to come back instead of hanging
+            response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+            response['Retry-After'] = str(external_data.get('retry_after', settings.GOVERNANCE_RETRY_AFTER))
+        return response
 
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
@@ -409,6 +344,29 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({"error": f"فشل تشغيل المتصفح: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'])
+    def automation_status(self, request):
+        return Response({
+            "breaker": breaker.snapshot(),
+            "selectors": get_engine().selector_stats.snapshot(),
+            "pool": get_engine().pool_snapshot(),
+            # Portal traffic of this worker process since it started, with asset blocking on or off
+            "network": {"block_assets": get_engine().BLOCK_ASSETS, **get_engine().network_stats.snapshot()},
+            "sessions": heartbeat.readiness(),
+            "jobs": {
+                "queued": GovernanceJob.objects.filter(status='queued').count(),
+                "running": GovernanceJob.objects.filter(status='running').count()
+            },
+            "mobile_sync": {
+                # Scanned links nobody claimed yet, and those dispatched but not finished
+                # (including ones still waiting for a job after a failed dispatch)
+                "unclaimed": MobileSync.objects.filter(is_processed=False).count(),
+                "dispatching": MobileSync.objects.filter(dispatched_at__isnull=False, result_code__isnull=True).exclude(
+                    job__status__in=dispatch.FINISHED_STATUSES
+                ).count()
+            }
+        })
+
     @action(detail=False, methods=['get'])
     def stats(self, request):
         total = Invoice.objects.count()
@@ -15,7 +15,12 @@ mapping_data = {
         "tax_registration_number": "#RIN",
         "invoice_id": "#invoiceId",
         "btn_inquire": "#btnInquire",
-        "btn_add": "#btnAdd"
+        "btn_add": "#btnAdd",
+        # ETA share page; tried together, the engine ranks them by hit rate
+        "rin_extraction": ["#TaxRegistrationNumber", ".tax-id", "td:has-text('رقم التسجيل') + td"]
+    },
+    "timeouts_ms": {
+        "rin_extraction": 4000
     },
     "automation_type": "remote_debugging",
     "browser_port": 9222
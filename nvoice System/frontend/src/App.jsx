@@ -87,12 +87,37 @@ axios.interceptors.response.use(
   }
 );
 
+// Runs a list of invoices through the batch endpoint and reports each NDJSON line as it arrives
+const streamBatchGovernance = async (urls, onLine) => {
+  const token = localStorage.getItem('token');
+  const response = await fetch(`${API_BASE}/invoices/start_governance_batch/`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', ...(token ? { Authorization: `Bearer ${token}` } : {}) },
+    body: JSON.stringify({ items: urls })
+  });
+  if (!response.ok) throw new Error(`Batch failed: ${response.status}`);
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    lines.filter(Boolean).forEach(l => onLine(JSON.parse(l)));
+  }
+  if (buffer.trim()) onLine(JSON.parse(buffer));
+};
 
 const App = () => {
   const [isLoggedIn, setIsLoggedIn] = useState(false);
   const [userRole, setUserRole] = useState(localStorage.getItem('role'));
   const [activeTab, setActiveTab] = useState('dashboard');
   const [invoices, setInvoices] = useState([]);
+  // Cursor of the next invoice page (null once the whole list is loaded)
+  const [invoicesNext, setInvoicesNext] = useState(null);
   const [authStep, setAuthStep] = useState('login');
   const [tempToken, setTempToken] = useState(null);
 
@@ -110,7 +135,8 @@ const App = () => {
     if (!localStorage.getItem('token')) return;
     try {
       const response = await axios.get(`${API_BASE}/invoices/`);
-      setInvoices(response.data);
+      setInvoices(response.data.results);
+      setInvoicesNext(response.data.next);
     } catch (error) {
       if (error.response?.status === 401) {
         setIsLoggedIn(false);
@@ -119,6 +145,17 @@ const App = () => {
     }
   };
 
+  const loadMoreInvoices = async () => {
+    if (!invoicesNext) return;
+    try {
+      const response = await axios.get(invoicesNext);
+      setInvoices(prev => [...prev, ...response.data.results]);
+      setInvoicesNext(response.data.next);
+    } catch (error) {
+      addToast('تعذر تحميل المزيد من الفواتير', 'error');
+    }
+  };
+
   React.useEffect(() => {
     const token = localStorage.getItem('token');
     if (token) {
@@ -253,7 +290,7 @@ const App = () => {
         <div className="content-container">
           {activeTab === 'dashboard' && <DashboardView invoices={invoices} onRefresh={fetchInvoices} userRole={userRole} addToast={addToast} stats={totalStats} />}
           {activeTab === 'setup' && <SetupView userRole={userRole} addToast={addToast} />}
-          {activeTab === 'invoices' && <InvoicesView invoices={invoices} onRefresh={fetchInvoices} userRole={userRole} addToast={addToast} />}
+          {activeTab === 'invoices' && <InvoicesView invoices={invoices} onRefresh={fetchInvoices} onLoadMore={invoicesNext ? loadMoreInvoices : null} userRole={userRole} addToast={addToast} />}
           {activeTab === 'analytics' && <AnalyticsView stats={totalStats} invoices={invoices} />}
           {activeTab === 'search' && <SearchView addToast={addToast} />}
           {activeTab === 'inquiry' && <InquiryView addToast={addToast} />}
@@ -392,6 +429,7 @@ const InquiryView = () => {
 
 const SearchView = () => {
   const [results, setResults] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
   const [query, setQuery] = useState({ rin: '', invoice_id: '', status: '' });
   const [loading, setLoading] = useState(false);
 
@@ -404,7 +442,22 @@ const SearchView = () => {
       if (query.status) params.append('status', query.status);
 
       const response = await axios.get(`${API_BASE}/invoices/?${params.toString()}`);
-      setResults(response.data);
+      setResults(response.data.results);
+      setNextPage(response.data.next);
+    } catch (error) {
+      alert('خطأ في البحث');
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  const loadMore = async () => {
+    setLoading(true);
+    try {
+      // The cursor already carries the filters of the original search
+      const response = await axios.get(nextPage);
+      setResults(prev => [...prev, ...response.data.results]);
+      setNextPage(response.data.next);
     } catch (error) {
       alert('خطأ في البحث');
     } finally {
@@ -461,7 +514,7 @@ const SearchView = () => {
 
       {results.length > 0 && (
         <div className="premium-card">
-          <h3>نتائج البحث ({results.length})</h3>
+          <h3>نتائج البحث ({results.length}{nextPage ? '+' : ''})</h3>
           <table style={{ width: '100%', borderCollapse: 'collapse', textAlign: 'right', marginTop: '1rem' }}>
             <thead>
               <tr style={{ borderBottom: '1px solid var(--glass-border)', color: 'var(--text-muted)' }}>
@@ -484,6 +537,13 @@ const SearchView = () => {
               ))}
             </tbody>
           </table>
+          {nextPage && (
+            <div style={{ marginTop: '1rem', display: 'flex', justifyContent: 'center' }}>
+              <button className="btn-secondary" onClick={loadMore} disabled={loading}>
+                {loading ? 'جاري التحميل...' : 'تحميل المزيد'}
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>
@@ -613,59 +673,86 @@ const DashboardView = ({ invoices, onRefresh, userRole, addToast, stats }) => {
   const startBatchGovernance = async () => {
     if (urlList.length === 0) return addToast('يرجى إضافة روابط للقائمة أولاً', 'warning');
     setLoading(true);
-    setResults(urlList.map(u => ({ url: u, status: 'pending', message: 'في الانتظار...' })));
+    setResults(urlList.map(u => ({ url: u, status: 'processing', message: 'جاري البحث...' })));
 
-    for (let i = 0; i < urlList.length; i++) {
-      const currentUrlVal = urlList[i];
-      setResults(prev => prev.map((r, idx) => idx === i ? { ...r, status: 'processing', message: 'جاري البحث...' } : r));
-      try {
-        const response = await axios.post(`${API_BASE}/invoices/start_governance/`, { url: currentUrlVal });
-        const resultCode = response.data.result_code;
-        addToast(response.data.message, resultCode === 'already_frozen' ? 'warning' : 'success');
-        setResults(prev => prev.map((r, idx) => idx === i ? { ...r, status: resultCode === 'already_frozen' ? 'warning' : 'success', message: response.data.message } : r));
-      } catch (error) {
-        const isNotFound = error.response?.status === 404;
-        addToast(isNotFound ? 'لم يسفر البحث عن شيء' : 'خطأ فني', 'error');
-        setResults(prev => prev.map((r, idx) => idx === i ? { ...r, status: 'error', message: isNotFound ? 'لم يسفر البحث عن شيء' : '❌ خطأ' } : r));
-      }
-      onRefresh();
+    try {
+      // The batch endpoint streams one JSON line per invoice as soon as its tab finishes
+      await streamBatchGovernance(urlList, (line) => {
+        if (line.summary) {
+          const { frozen, already_frozen, not_found } = line.summary;
+          addToast(`تم تجميد ${frozen} • مجمدة مسبقاً ${already_frozen} • غير موجودة ${not_found}`, 'success');
+          return;
+        }
+        const ok = line.http_status === 200;
+        const isNotFound = line.http_status === 404;
+        const message = ok ? line.message : (isNotFound ? 'لم يسفر البحث عن شيء' : '❌ خطأ');
+        const rowStatus = ok ? (line.result_code === 'already_frozen' ? 'warning' : 'success') : 'error';
+        setResults(prev => prev.map((r, idx) => idx === line.index ? { ...r, status: rowStatus, message } : r));
+      });
+    } catch (error) {
+      addToast('خطأ فني', 'error');
+      setResults(prev => prev.map(r => r.status === 'processing' ? { ...r, status: 'error', message: '❌ خطأ' } : r));
     }
+    onRefresh();
     setLoading(false);
     setUrlList([]); // Clear queue after finish
   };
 
-  const [processedMobileIds, setProcessedMobileIds] = React.useState(new Set());
+  // Cursor of the last mobile link seen; '' lets the server start at the recent window
+  const mobileCursor = useRef('');
 
   React.useEffect(() => {
-    const pollMobile = async () => {
-      try {
-        const response = await axios.get(`${API_BASE}/mobile-sync/pull/`);
-        if (response.data && response.data.length > 0) {
-          // Use ref or functional state to check against current set without making it a dependency
-          setProcessedMobileIds(prevSet => {
-            const newItems = response.data.filter(item => !prevSet.has(item.id));
-            if (newItems.length > 0) {
-              const newUrls = newItems.map(item => item.url);
-              const newIds = newItems.map(item => item.id);
-
-              setUrlList(prevUrls => {
-                const uniqueUrls = newUrls.filter(u => !prevUrls.includes(u));
-                if (uniqueUrls.length > 0) {
-                  addToast(`تم استلام ${uniqueUrls.length} روابط جديدة من الموبايل`, 'success');
-                  return [...prevUrls, ...uniqueUrls];
-                }
-                return prevUrls;
-              });
+    const receiveUrls = (newUrls) => {
+      if (newUrls.length === 0) return;
+      setUrlList(prevUrls => {
+        const uniqueUrls = newUrls.filter(u => !prevUrls.includes(u));
+        if (uniqueUrls.length > 0) {
+          addToast(`تم استلام ${uniqueUrls.length} روابط جديدة من الموبايل`, 'success');
+          return [...prevUrls, ...uniqueUrls];
+        }
+        return prevUrls;
+      });
+    };
 
-              return new Set([...prevSet, ...newIds]);
-            }
-            return prevSet;
-          });
+    // Long-poll the incremental pull; used without EventSource or when the server refuses a stream
+    let active = true;
+    const pollMobile = async () => {
+      while (active) {
+        try {
+          const response = await axios.get(`${API_BASE}/mobile-sync/pull/`, { params: { cursor: mobileCursor.current, claim: 1, wait: 25 } });
+          mobileCursor.current = response.data.next_cursor;
+          receiveUrls(response.data.results.map(item => item.url));
+          // The server was too busy to hold the request open: pause instead of spinning
+          if (!response.data.waited && response.data.results.length === 0) {
+            await new Promise(resolve => setTimeout(resolve, 5000));
+          }
+        } catch (e) {
+          console.error("Polling error", e);
+          await new Promise(resolve => setTimeout(resolve, 2000));
         }
-      } catch (e) { console.error("Polling error", e); }
+      }
+    };
+
+    // Server-Sent Events: links arrive the moment the phone pushes them.
+    // claim=1: each scanned link is handed to exactly one open dashboard
+    let source = null;
+    if (window.EventSource) {
+      source = new EventSource(`${API_BASE}/mobile-sync/stream/?claim=1&cursor=${mobileCursor.current}`);
+      source.addEventListener('link', (event) => {
+        mobileCursor.current = event.lastEventId;
+        receiveUrls([JSON.parse(event.data).url]);
+      });
+      // A 503 (too many open streams) closes the EventSource for good
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) pollMobile();
+      };
+    } else {
+      pollMobile();
+    }
+    return () => {
+      active = false;
+      if (source) source.close();
     };
-    const interval = setInterval(pollMobile, 2000);
-    return () => clearInterval(interval);
   }, [addToast]);
 
   return (
@@ -678,7 +765,7 @@ const DashboardView = ({ invoices, onRefresh, userRole, addToast, stats }) => {
         <div style={{ display: 'flex', gap: '1rem' }}>
           <div className="premium-card" style={{ padding: '10px 20px', margin: 0, textAlign: 'center' }}>
             <p style={{ fontSize: '0.7rem', color: 'var(--text-muted)' }}>إجمالي اليوم</p>
-            <p style={{ fontSize: '1.2rem', fontWeight: '800', color: 'var(--primary)' }}>{invoices.length}</p>
+            <p style={{ fontSize: '1.2rem', fontWeight: '800', color: 'var(--primary)' }}>{stats.total}</p>
           </div>
         </div>
       </header>
@@ -821,6 +908,21 @@ const DashboardView = ({ invoices, onRefresh, userRole, addToast, stats }) => {
 };
 
 const SetupView = ({ userRole, addToast }) => {
+  const [sessions, setSessions] = useState([]);
+
+  // Readiness comes from the backend heartbeat, no invoice has to run to know it
+  useEffect(() => {
+    const fetchReadiness = async () => {
+      try {
+        const res = await axios.get(`${API_BASE}/invoices/automation_status/`);
+        setSessions(res.data.sessions || []);
+      } catch (e) { console.error("Readiness error", e); }
+    };
+    fetchReadiness();
+    const interval = setInterval(fetchReadiness, 10000);
+    return () => clearInterval(interval);
+  }, []);
+
   const handleLaunch = async () => {
     try {
       const response = await axios.post(`${API_BASE}/invoices/launch_session/`);
@@ -852,6 +954,22 @@ const SetupView = ({ userRole, addToast }) => {
           </div>
         </div>
       )}
+      {sessions.length > 0 && (
+        <div className="premium-card">
+          <h3>جاهزية الجلسات</h3>
+          {sessions.map((s) => (
+            <div key={s.endpoint} style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', padding: '8px 0', borderBottom: '1px solid var(--glass-border)', fontSize: '0.8rem' }}>
+              <span style={{ display: 'flex', alignItems: 'center', gap: '6px', color: s.ready ? '#22c55e' : '#ef4444' }}>
+                {s.ready ? <CheckCircle2 size={14} /> : <XCircle size={14} />}
+                {s.endpoint}
+              </span>
+              <span style={{ color: 'var(--text-muted)' }}>
+                {!s.browser_alive ? 'المتصفح المؤمن غير متصل' : !s.logged_in ? 'يجب تسجيل الدخول' : `جاهزة (${s.portal_latency_ms ?? s.browser_latency_ms} ms)`}
+              </span>
+            </div>
+          ))}
+        </div>
+      )}
       <div className="premium-card">
         <div className="form-grid">
           <div className="input-group"><label>رابط الدخول</label><input type="text" readOnly value="https://auth.efinance.com.eg/..." /></div>
@@ -1112,7 +1230,7 @@ const VerifyOTPView = ({ onComplete, onBack }) => {
     </div>
   );
 };
-const InvoicesView = ({ invoices, onRefresh, userRole, addToast }) => {
+const InvoicesView = ({ invoices, onRefresh, onLoadMore, userRole, addToast }) => {
   const [searchTerm, setSearchTerm] = useState('');
   const [showAudit, setShowAudit] = useState(null);
 
@@ -1186,6 +1304,11 @@ const InvoicesView = ({ invoices, onRefresh, userRole, addToast }) => {
           </tbody>
         </table>
       </div>
+      {onLoadMore && (
+        <div style={{ marginTop: '1rem', display: 'flex', justifyContent: 'center' }}>
+          <button className="btn-secondary" onClick={onLoadMore}>تحميل المزيد</button>
+        </div>
+      )}
 
       {showAudit && (
         <div className="modal-overlay" onClick={() => setShowAudit(null)}>
@@ -1,22 +1,23 @@
+import argparse
 import subprocess
 import time
 import os
 
-def launch_secure_browser():
+def launch_secure_browser(port=9222, profile='GovernanceProfile'):
     # Path to Chrome (common location on Windows)
     chrome_path = r"C:\Program Files\Google\Chrome\Application\chrome.exe"
-    user_data_dir = os.path.join(os.environ['LOCALAPPDATA'], 'Google', 'Chrome', 'User Data', 'GovernanceProfile')
+    user_data_dir = os.path.join(os.environ['LOCALAPPDATA'], 'Google', 'Chrome', 'User Data', profile)
     
     if not os.path.exists(user_data_dir):
         os.makedirs(user_data_dir)
 
-    print(f"🚀 Launching Chrome in Secure Automation Mode...")
+    print(f"🚀 Launching Chrome in Secure Automation Mode (port {port})...")
     print(f"📁 Profile Path: {user_data_dir}")
     
     # Command to launch chrome with remote debugging enabled
     cmd = [
         chrome_path,
-        f"--remote-debugging-port=9222",
+        f"--remote-debugging-port={port}",
         f"--user-data-dir={user_data_dir}",
         "--no-first-run",
         "--no-default-browser-check",
@@ -32,4 +33,18 @@ def launch_secure_browser():
         print(f"❌ Error launching Chrome: {e}")
 
 if __name__ == "__main__":
-    launch_secure_browser()
+    # Each session gets its own port and profile, so it can hold its own portal login
+    parser = argparse.ArgumentParser(description="Launch secure browser session(s) for the automation engine")
+    parser.add_argument("--port", type=int, default=9222, help="Remote debugging port of the first session")
+    parser.add_argument("--profile", default="GovernanceProfile", help="Chrome profile name of the first session")
+    parser.add_argument("--sessions", type=int, default=1, help="Number of sessions (ports and profiles are numbered from the first)")
+    args = parser.parse_args()
+
+    endpoints = []
+    for i in range(args.sessions):
+        profile = args.profile if i == 0 else f"{args.profile}{i + 1}"
+        launch_secure_browser(args.port + i, profile)
+        endpoints.append(f"http://127.0.0.1:{args.port + i}")
+
+    if args.sessions > 1:
+        print(f"🔀 Set AUTOMATION_CDP_URLS={','.join(endpoints)} for the backend.")